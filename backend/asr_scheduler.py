@@ -0,0 +1,265 @@
+"""Central ASR scheduler shared by all rooms.
+
+Rooms submit chunks into one bounded queue. A single dispatcher groups pending
+chunks into batches (at most one chunk per room in flight, so per-room order
+is preserved) and runs each batch through WhisperASR.transcribe_batch on a
+dedicated thread, instead of N rooms running N batch-of-1 inferences that
+fight over the same cores. With an ASRWorkerPool as backend, `concurrency`
+batches run at once, one per worker process.
+
+Offline bulk-job pieces share the scheduler at lower priority: they are
+only taken when no live chunk is waiting, batch only with each other, are
+never shed, and do not feed the quality controller (they follow its current
+decode settings, so live pressure also makes them cheaper).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import asr_tiers
+import config
+
+logger = logging.getLogger("asr_scheduler")
+
+
+@dataclass
+class _Job:
+    kind: str  # "transcribe" or "detect"
+    room_id: str
+    audio: object
+    language: object
+    options: dict
+    future: asyncio.Future
+    bulk: bool = False  # offline job piece: lower priority, never shed
+    enqueued: float = 0.0  # once actually queued; waiting on a full queue does not count
+
+
+class ASRScheduler:
+    def __init__(self, asr, max_batch=config.ASR_BATCH_SIZE,
+                 max_wait_ms=config.ASR_BATCH_WAIT_MS, queue_size=config.ASR_QUEUE_SIZE,
+                 concurrency=1):
+        self.asr = asr
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = concurrency
+        # (priority, seq, job): live jobs before bulk ones. Only live jobs take
+        # one of the queue_size slots; bulk callers bound their own pieces.
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.queue_size = queue_size
+        self.live_slots = asyncio.Semaphore(queue_size)
+        self.live_queued = 0
+        self._seq = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="asr")
+        self._carry = deque()  # jobs deferred to keep per-room order
+        self._busy = set()  # rooms with a batch in flight
+        self._inflight = set()
+        self.quality = asr_tiers.QualityController()
+        self.dropped = 0
+        self._task = None
+        self.batches = 0
+        self.items = 0
+        self.last_batch_size = 0
+        self.last_batch_sec = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in list(self._inflight):
+            task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.executor.shutdown(wait=False)
+
+    async def transcribe(self, room_id: str, audio, language=None, bulk=False, **options):
+        """Queue a chunk and wait for its (segments, info); blocks while the queue is full."""
+        future = asyncio.get_running_loop().create_future()
+        await self._put(_Job("transcribe", room_id, audio, language, options, future, bulk))
+        return await future
+
+    async def detect_language(self, room_id: str, audio, bulk=False):
+        """Queue a language-ID-only pass; returns {language: probability}."""
+        future = asyncio.get_running_loop().create_future()
+        await self._put(_Job("detect", room_id, audio, None, {}, future, bulk))
+        return await future
+
+    async def _put(self, job):
+        if not job.bulk:
+            await self.live_slots.acquire()
+            self.live_queued += 1
+        job.enqueued = time.monotonic()
+        self.queue.put_nowait((int(job.bulk), next(self._seq), job))
+
+    async def _get(self, timeout=None):
+        """Next job, live first; raises QueueEmpty (timeout <= 0) or TimeoutError."""
+        if timeout is None:
+            _, _, job = await self.queue.get()
+        elif timeout <= 0:
+            _, _, job = self.queue.get_nowait()
+        else:
+            _, _, job = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        if not job.bulk:
+            self.live_queued -= 1
+            self.live_slots.release()
+        return job
+
+    def queue_depth(self) -> int:
+        """Live chunks waiting (what the quality controller reacts to)."""
+        return self.live_queued + sum(1 for j in self._carry if not j.bulk)
+
+    def bulk_depth(self) -> int:
+        return self.queue.qsize() - self.live_queued + sum(1 for j in self._carry if j.bulk)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "queue_capacity": self.queue_size,
+            "bulk_queued": self.bulk_depth(),
+            "in_flight": len(self._inflight),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "last_batch_sec": round(self.last_batch_sec, 3),
+            "tier": self.quality.tier["name"],
+            "rtf": round(self.quality.rtf, 3),
+            "dropped": self.dropped,
+        }
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            await slots.acquire()
+            batch = await self._collect()
+            self._busy.update(j.room_id for j in batch)
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        tier = self.quality.tier
+        bulk = batch[0].bulk
+        try:
+            if tier["shed"] and not bulk:
+                batch = self._shed_late(batch)
+                if not batch:
+                    return
+            started = time.monotonic()
+            results = await loop.run_in_executor(self.executor, self._execute, batch, tier)
+            elapsed = time.monotonic() - started
+            for job, result in zip(batch, results):
+                if job.kind == "transcribe" and result[1] is not None:
+                    result[1].tier = tier["name"]
+                if not job.future.done():
+                    job.future.set_result(result)
+        except Exception as e:
+            logger.exception("Batched ASR failed")
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+        finally:
+            self._busy.difference_update(j.room_id for j in batch)
+
+        if not bulk:
+            audio_sec = sum(len(j.audio) for j in batch) / config.SAMPLE_RATE
+            self.quality.observe(self.queue_depth(), elapsed / audio_sec if audio_sec else 0.0)
+        self.last_batch_sec = elapsed
+        self.last_batch_size = len(batch)
+        self.batches += 1
+        self.items += len(batch)
+        logger.debug(f"ASR batch of {len(batch)} in {elapsed:.2f}s, depth={self.queue_depth()}, "
+                     f"tier={tier['name']}")
+
+    def _shed_late(self, batch):
+        """Drop jobs that waited past ASR_DEADLINE_SEC; their callers get an empty result."""
+        now = time.monotonic()
+        keep = []
+        for job in batch:
+            if now - job.enqueued <= config.ASR_DEADLINE_SEC:
+                keep.append(job)
+                continue
+            self.dropped += 1
+            self._busy.discard(job.room_id)
+            logger.warning(f"Dropped ASR chunk for {job.room_id} after {now - job.enqueued:.1f}s in queue")
+            if not job.future.done():
+                job.future.set_result({} if job.kind == "detect" else ([], None))
+        return keep
+
+    def _execute(self, batch, tier):
+        audios = [j.audio for j in batch]
+        if batch[0].kind == "detect":
+            return self.asr.detect_language_batch(audios)
+        return self.asr.transcribe_batch(audios, [j.language for j in batch],
+                                         beam_size=tier["beam_size"],
+                                         fast_model=tier["fast_model"],
+                                         **batch[0].options)
+
+    async def _collect(self):
+        """Gather one batch: one job per room, all of the same kind and decode options."""
+        while True:
+            batch = self._take_carried()
+            if batch:
+                break
+            if self._carry:
+                # Every deferred room is still in flight; poll until one frees up
+                try:
+                    job = await self._get(timeout=self.max_wait)
+                except asyncio.TimeoutError:
+                    continue
+            else:
+                job = await self._get()
+            self._offer(batch, job)
+            if batch:
+                break
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = await self._get(timeout=remaining)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            self._offer(batch, job)
+        return batch
+
+    def _admissible(self, batch, job) -> bool:
+        if job.room_id in self._busy or any(j.room_id == job.room_id for j in batch):
+            return False
+        return not batch or (job.kind, job.options, job.bulk) == (batch[0].kind, batch[0].options, batch[0].bulk)
+
+    def _offer(self, batch, job):
+        """Add a fresh job to the batch, or defer it behind the room's earlier jobs."""
+        carried = any(c.room_id == job.room_id for c in self._carry)
+        if not carried and self._admissible(batch, job):
+            batch.append(job)
+        else:
+            self._carry.append(job)
+
+    def _take_carried(self):
+        """Start a batch from deferred jobs, oldest first, keeping per-room order."""
+        batch, deferred = [], deque()
+        while self._carry and len(batch) < self.max_batch:
+            job = self._carry.popleft()
+            blocked = any(d.room_id == job.room_id for d in deferred)
+            if not blocked and self._admissible(batch, job):
+                batch.append(job)
+            else:
+                deferred.append(job)
+        self._carry = deferred + self._carry
+        return batch
@@ -0,0 +1,64 @@
+"""Load-adaptive ASR quality tiers.
+
+The scheduler reports queue depth and the real-time factor (processing time
+divided by audio duration) of every batch. Under sustained pressure the
+controller steps down one tier at a time; when load falls it steps back up.
+Changes are at least ASR_TIER_DWELL_SEC apart so it does not flap.
+
+    full    beam 5, WHISPER_MODEL
+    greedy  beam 1, WHISPER_MODEL
+    fast    beam 1, ASR_FALLBACK_MODEL (int8)
+    shed    as fast, and chunks queued longer than ASR_DEADLINE_SEC are dropped
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+
+import config
+
+logger = logging.getLogger("asr_tiers")
+
+TIERS = [
+    {"name": "full", "beam_size": 5, "fast_model": False, "shed": False},
+    {"name": "greedy", "beam_size": 1, "fast_model": False, "shed": False},
+    {"name": "fast", "beam_size": 1, "fast_model": True, "shed": False},
+    {"name": "shed", "beam_size": 1, "fast_model": True, "shed": True},
+]
+
+
+class QualityController:
+    def __init__(self, enabled=config.ASR_ADAPTIVE, rtf_high=config.ASR_RTF_HIGH,
+                 rtf_low=config.ASR_RTF_LOW, queue_high=config.ASR_QUEUE_HIGH,
+                 dwell_sec=config.ASR_TIER_DWELL_SEC, clock=time.monotonic):
+        self.enabled = enabled
+        self.rtf_high = rtf_high
+        self.rtf_low = rtf_low
+        self.queue_high = queue_high
+        self.dwell_sec = dwell_sec
+        self.clock = clock
+        self.level = 0
+        self.rtf = 0.0  # EWMA of per-batch real-time factor
+        self.changed_at = clock()
+
+    @property
+    def tier(self) -> dict:
+        return TIERS[self.level]
+
+    def observe(self, queue_depth: int, rtf: float):
+        """Feed one batch's load sample and move at most one tier."""
+        self.rtf = rtf if self.rtf == 0.0 else 0.7 * self.rtf + 0.3 * rtf
+        if not self.enabled or self.clock() - self.changed_at < self.dwell_sec:
+            return
+        if (self.rtf > self.rtf_high or queue_depth > self.queue_high) and self.level < len(TIERS) - 1:
+            self._move(self.level + 1, queue_depth)
+        elif self.rtf < self.rtf_low and queue_depth <= self.queue_high // 4 and self.level > 0:
+            self._move(self.level - 1, queue_depth)
+
+    def _move(self, level: int, queue_depth: int):
+        old = self.tier["name"]
+        self.level = level
+        self.changed_at = self.clock()
+        logger.warning(f"ASR quality tier {old} -> {self.tier['name']} "
+                       f"(rtf={self.rtf:.2f}, queue_depth={queue_depth})")
@@ -1,35 +1,69 @@
 import logging
 import config
 import utils
+import numpy as np
 from typing import Sequence
 from pathlib import Path
 
 logger = logging.getLogger("asr")
 
+# Whisper's encoder window; longer buffers are never batched
+BATCH_MAX_SAMPLES = 30 * config.SAMPLE_RATE
+NO_SPEECH_THRESHOLD = 0.6
+
+class ASRInfo:
+    """Minimal, picklable stand-in for faster-whisper's TranscriptionInfo."""
+
+    def __init__(self, language=None, language_probability=1.0, duration=None, tier=None):
+        self.language = language
+        self.language_probability = language_probability
+        self.duration = duration
+        self.tier = tier  # quality tier that produced the result (set by the scheduler)
+
+    @classmethod
+    def from_info(cls, info):
+        if info is None or isinstance(info, cls):
+            return info
+        return cls(getattr(info, "language", None),
+                   getattr(info, "language_probability", 1.0),
+                   getattr(info, "duration", None))
+
+
 class WhisperASR:
     """
     CPU-optimized ASR wrapper using faster-whisper (int8) when available.
     Falls back to OpenAI Whisper if necessary (CPU-only mode).
     """
-    def __init__(self, model_name=config.WHISPER_MODEL, compute_type=config.WHISPER_COMPUTE):
+    def __init__(self, model_name=config.WHISPER_MODEL, compute_type=config.WHISPER_COMPUTE,
+                 cpu_threads=config.ASR_CPU_THREADS, num_workers=config.ASR_NUM_WORKERS,
+                 load=True):
         self.model_name = model_name
         self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
         self.model = None
         self.backend = None
-        self._load()
+        self.fallback = None  # lighter model for the "fast" quality tier
+        if load:
+            self._load()
 
     def _load(self):
         try:
             from faster_whisper import WhisperModel
             logger.info("Loading faster-whisper (CPU optimized)...")
             self.model = WhisperModel(self.model_name, device="cpu",
-                                      compute_type=self.compute_type)
+                                      compute_type=self.compute_type,
+                                      cpu_threads=self.cpu_threads,
+                                      num_workers=self.num_workers)
             self.backend = "faster-whisper"
             logger.info("faster-whisper loaded.")
         except Exception as e:
             logger.warning(f"faster-whisper not available, falling back to OpenAI Whisper: {e}")
             try:
                 import whisper
+                if self.cpu_threads:
+                    import torch
+                    torch.set_num_threads(self.cpu_threads)
                 self.model = whisper.load_model(self.model_name, device="cpu")
                 self.backend = "whisper"
                 logger.info("OpenAI Whisper loaded.")
@@ -37,37 +71,206 @@ class WhisperASR:
                 logger.exception("Unable to load any Whisper backend")
                 raise ex
 
+    def warmup(self):
+        """
+        Run one language-ID pass and one full decode on a synthetic buffer so the
+        first real chunk does not pay for lazy allocations and kernel selection.
+        """
+        rng = np.random.default_rng(0)
+        t = np.arange(config.SAMPLE_RATE, dtype=np.float32) / config.SAMPLE_RATE
+        audio = (0.1 * np.sin(2 * np.pi * 220 * t) + 0.01 * rng.standard_normal(len(t))).astype(np.float32)
+        self.detect_language_batch([audio])
+        if self.backend == "faster-whisper":
+            # Bypasses vad_filter, which would skip the decoder entirely
+            self._transcribe_batch_ct2([audio], ["en"])
+        else:
+            self._transcribe_sync(audio, language="en")
+
     async def transcribe_file(self, file_path: str):
         """Transcribe an audio file asynchronously."""
         return await utils.run_blocking(self._transcribe_sync, file_path)
 
-    def _transcribe_sync(self, file_path: str, language=None):
-        """Blocking transcription that returns (segments, info)."""
+    async def transcribe_array(self, audio: np.ndarray, language=None):
+        """Transcribe a float32 mono buffer at SAMPLE_RATE asynchronously."""
+        return await utils.run_blocking(self._transcribe_array_sync, audio, language)
+
+    def _transcribe_array_sync(self, audio: np.ndarray, language=None,
+                               word_timestamps=False, initial_prompt=None, beam_size=5):
+        """
+        Blocking in-memory transcription that returns (segments, info).
+
+        `audio` must be mono float32 in [-1.0, 1.0] sampled at config.SAMPLE_RATE,
+        which is what both backends accept directly, so nothing is written to disk
+        and no audio decoder runs.
+        """
+        if audio.dtype != np.float32:
+            audio = audio.astype(np.float32)
+        return self._transcribe_sync(audio, language=language,
+                                     word_timestamps=word_timestamps,
+                                     initial_prompt=initial_prompt,
+                                     beam_size=beam_size)
+
+    def _transcribe_sync(self, source, language=None, word_timestamps=False, initial_prompt=None,
+                         beam_size=5):
+        """
+        Blocking transcription of a file path or float32 array; returns (segments, info).
+
+        With word_timestamps=True every segment also carries a "words" list of
+        {"start", "end", "word"} dicts (used by the streaming mode).
+        """
         if self.backend == "faster-whisper":
             segments, info = self.model.transcribe(
-                file_path,
-                beam_size=5,
+                source,
+                beam_size=beam_size,
                 vad_filter=True,
                 vad_parameters=dict(min_silence_duration_ms=300),
                 temperature=0.0,
                 condition_on_previous_text=False,
-                language=language
+                language=language,
+                word_timestamps=word_timestamps,
+                initial_prompt=initial_prompt,
             )
             out = []
             for seg in segments:
-                out.append({"start": seg.start, "end": seg.end, "text": seg.text})
+                item = {"start": seg.start, "end": seg.end, "text": seg.text}
+                if word_timestamps:
+                    item["words"] = [{"start": w.start, "end": w.end, "word": w.word}
+                                     for w in (seg.words or [])]
+                out.append(item)
             return out, info
         elif self.backend == "whisper":
-            result = self.model.transcribe(file_path, language=language)
+            result = self.model.transcribe(source, language=language, fp16=False,
+                                           word_timestamps=word_timestamps,
+                                           initial_prompt=initial_prompt,
+                                           beam_size=beam_size if beam_size > 1 else None)
             # result["segments"] is a list of dicts with start, end, text
-            segments = [{"start": s["start"], "end": s["end"], "text": s["text"]}
-                       for s in result["segments"]]
+            segments = []
+            for s in result["segments"]:
+                item = {"start": s["start"], "end": s["end"], "text": s["text"]}
+                if word_timestamps:
+                    item["words"] = [{"start": w["start"], "end": w["end"], "word": w["word"]}
+                                     for w in s.get("words", [])]
+                segments.append(item)
             # Create a simple info object for compatibility
-            info = type('Info', (), {'language': result.get('language')})()
+            info = ASRInfo(result.get('language'))
             return segments, info
         else:
             raise RuntimeError("No ASR backend available")
 
+    def transcribe_batch(self, audios, languages=None, beam_size=5, fast_model=False, **options):
+        """
+        Blocking transcription of several float32 buffers in one call.
+
+        Returns a list of (segments, ASRInfo) in input order. With faster-whisper,
+        buffers of up to 30 s without per-call options are encoded and decoded as
+        a single CTranslate2 batch; everything else is transcribed one by one.
+        fast_model=True routes the batch to the ASR_FALLBACK_MODEL instance,
+        which is loaded on first use.
+        """
+        if fast_model and self.model_name != config.ASR_FALLBACK_MODEL:
+            if self.fallback is None:
+                logger.info(f"Loading fallback ASR model {config.ASR_FALLBACK_MODEL}...")
+                self.fallback = WhisperASR(config.ASR_FALLBACK_MODEL, compute_type="int8",
+                                           cpu_threads=self.cpu_threads,
+                                           num_workers=self.num_workers)
+            return self.fallback.transcribe_batch(audios, languages, beam_size=beam_size, **options)
+
+        languages = languages or [None] * len(audios)
+        batchable = (
+            self.backend == "faster-whisper"
+            and len(audios) > 1
+            and not options
+            and all(len(a) <= BATCH_MAX_SAMPLES for a in audios)
+        )
+        if not batchable:
+            results = [self._transcribe_array_sync(a, language=lang, beam_size=beam_size, **options)
+                       for a, lang in zip(audios, languages)]
+            return [(segments, ASRInfo.from_info(info)) for segments, info in results]
+        return self._transcribe_batch_ct2(audios, languages, beam_size=beam_size)
+
+    def detect_language_batch(self, audios):
+        """
+        Blocking language identification only (encoder + one decoder step, no
+        transcription) on the first 30 s of each buffer.
+
+        Returns one {language: probability} dict per buffer.
+        """
+        if self.backend == "faster-whisper":
+            import ctranslate2
+            from faster_whisper.audio import pad_or_trim
+
+            whisper = self.model
+            features = np.stack([
+                pad_or_trim(whisper.feature_extractor(a[:BATCH_MAX_SAMPLES].astype(np.float32, copy=False)))
+                for a in audios
+            ])
+            encoder_output = whisper.model.encode(
+                ctranslate2.StorageView.from_array(np.ascontiguousarray(features))
+            )
+            return [{token[2:-2]: prob for token, prob in candidates}
+                    for candidates in whisper.model.detect_language(encoder_output)]
+        elif self.backend == "whisper":
+            import whisper
+
+            out = []
+            for audio in audios:
+                audio = whisper.pad_or_trim(audio.astype(np.float32, copy=False))
+                mel = whisper.log_mel_spectrogram(audio, n_mels=self.model.dims.n_mels).to(self.model.device)
+                _, probs = self.model.detect_language(mel)
+                out.append(dict(probs))
+            return out
+        else:
+            raise RuntimeError("No ASR backend available")
+
+    def _transcribe_batch_ct2(self, audios, languages, beam_size=5):
+        import ctranslate2
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
+
+        whisper = self.model
+        features = np.stack([
+            pad_or_trim(whisper.feature_extractor(a.astype(np.float32, copy=False)))
+            for a in audios
+        ])
+        encoder_output = whisper.model.encode(
+            ctranslate2.StorageView.from_array(np.ascontiguousarray(features))
+        )
+
+        langs, probs = list(languages), [1.0] * len(audios)
+        if any(lang is None for lang in langs):
+            detected = whisper.model.detect_language(encoder_output)
+            for i, candidates in enumerate(detected):
+                if langs[i] is None:
+                    token, prob = candidates[0]
+                    langs[i], probs[i] = token[2:-2], prob
+
+        prompts, tokenizer = [], None
+        for lang in langs:
+            tokenizer = Tokenizer(whisper.hf_tokenizer, whisper.model.is_multilingual,
+                                  task="transcribe", language=lang)
+            prompts.append(list(tokenizer.sot_sequence) + [tokenizer.no_timestamps])
+
+        results = whisper.model.generate(
+            encoder_output,
+            prompts,
+            beam_size=beam_size,
+            max_length=448,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+            return_no_speech_prob=True,
+        )
+
+        out = []
+        for audio, lang, prob, result in zip(audios, langs, probs, results):
+            duration = len(audio) / config.SAMPLE_RATE
+            text = tokenizer.decode(result.sequences_ids[0])
+            segments = []
+            if text.strip() and result.no_speech_prob < NO_SPEECH_THRESHOLD:
+                segments.append({"start": 0.0, "end": duration, "text": text})
+            info = ASRInfo(lang, prob, duration)
+            out.append((segments, info))
+        return out
+
 
 def save_chunk(chunk: Sequence[int], folder: Path, idx: int) -> Path:
     folder.mkdir(parents=True, exist_ok=True)
@@ -76,3 +279,68 @@ def save_chunk(chunk: Sequence[int], folder: Path, idx: int) -> Path:
     return out_path
 
 
+
+
+def audio_duration(path):
+    """Length of an audio file in seconds from its container, or None when unknown."""
+    try:
+        import av
+        with av.open(str(path)) as container:
+            return container.duration / av.time_base if container.duration else None
+    except Exception:
+        return None
+
+
+def decode_audio_windows(path, window_sec=config.BULK_DECODE_WINDOW_SEC):
+    """
+    Decode an audio file to mono int16 PCM at SAMPLE_RATE, yielding about
+    `window_sec` of it at a time, so a long recording is never held whole.
+    Streams with PyAV (installed with faster-whisper); without it the file is
+    decoded in one go by decode_audio() and only handed out in windows.
+    """
+    window_bytes = int(window_sec * config.SAMPLE_RATE) * 2
+    try:
+        import av
+    except ImportError:
+        audio = decode_audio(path)
+        step = window_bytes // 2
+        for start in range(0, len(audio), step):
+            yield (np.clip(audio[start:start + step], -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+        return
+
+    buffer = bytearray()
+    with av.open(str(path)) as container:
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=config.SAMPLE_RATE)
+        for frame in container.decode(audio=0):
+            frame.pts = None  # let the resampler keep its own timeline
+            for resampled in resampler.resample(frame):
+                buffer += resampled.to_ndarray().tobytes()
+            while len(buffer) >= window_bytes:
+                yield bytes(buffer[:window_bytes])
+                del buffer[:window_bytes]
+        for resampled in resampler.resample(None):  # drain the resampler
+            buffer += resampled.to_ndarray().tobytes()
+    if buffer:
+        yield bytes(buffer)
+
+
+def decode_audio(path) -> np.ndarray:
+    """Decode any audio file to mono float32 at SAMPLE_RATE (for offline jobs)."""
+    try:
+        from faster_whisper.audio import decode_audio as fw_decode
+        return fw_decode(str(path), sampling_rate=config.SAMPLE_RATE)
+    except ImportError:
+        pass
+    try:
+        import whisper
+        return whisper.load_audio(str(path), sr=config.SAMPLE_RATE)
+    except ImportError:
+        from scipy.io import wavfile
+        rate, data = wavfile.read(str(path))
+        if rate != config.SAMPLE_RATE:
+            raise ValueError(f"{path}: expected {config.SAMPLE_RATE} Hz WAV, got {rate} Hz")
+        if data.dtype == np.int16:
+            data = data.astype(np.float32) / 32768.0
+        if data.ndim > 1:
+            data = data.mean(axis=1)
+        return data.astype(np.float32)
@@ -0,0 +1,235 @@
+"""Multi-process ASR worker pool.
+
+Each worker process loads its own WhisperASR with pinned CTranslate2
+cpu_threads/num_workers (and, optionally, its own block of CPU cores), so one
+backend can use every core without the uvicorn process's GIL in the way. The
+pool exposes the same blocking transcribe_batch/detect_language_batch API as
+WhisperASR, so the ASR scheduler drives it unchanged. Workers that die are
+restarted by a supervisor thread (with exponential backoff, up to
+ASR_WORKER_MAX_RESTARTS failed starts in a row) and their in-flight request
+fails.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import config
+
+logger = logging.getLogger("asr_workers")
+
+
+def _worker_main(index, generation, requests, responses, cpu_threads, num_workers, cores):
+    """Worker process entry point: load a model, then serve requests forever."""
+    import asr_whisper
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    try:
+        asr = asr_whisper.WhisperASR(cpu_threads=cpu_threads, num_workers=num_workers)
+        asr.warmup()
+    except Exception as e:
+        responses.put((None, index, generation, False, f"{type(e).__name__}: {e}"))
+        raise SystemExit(1)
+    responses.put((None, index, generation, True, "ready"))
+
+    while True:
+        job_id, method, args, kwargs = requests.get()
+        if method is None:
+            break
+        try:
+            result = getattr(asr, method)(*args, **kwargs)
+            responses.put((job_id, index, generation, True, result))
+        except Exception as e:
+            responses.put((job_id, index, generation, False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, index, cores):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.requests = None
+        self.job = None  # (job_id, Future) in flight
+        self.ready = False
+        self.generation = 0  # bumped on every (re)spawn; stale idle entries are skipped
+        self.started_at = 0.0
+        self.load_sec = None  # spawn -> model loaded and warmed up
+        self.restarts = 0
+        self.failures = 0  # failed starts in a row (reset once the model loads)
+        self.retry_at = 0.0
+        self.error = None  # last load error
+        self.given_up = False
+
+
+class ASRWorkerPool:
+    def __init__(self, workers=config.ASR_WORKERS, cpu_threads=config.ASR_CPU_THREADS,
+                 num_workers=config.ASR_NUM_WORKERS, affinity=config.ASR_CPU_AFFINITY):
+        self.size = workers
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.ctx = mp.get_context("spawn")
+        self.responses = self.ctx.Queue()
+        self.workers = [_Worker(i, self._cores_for(i) if affinity else None) for i in range(workers)]
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count()
+        self.running = False
+
+    def _cores_for(self, index):
+        if not hasattr(os, "sched_getaffinity"):
+            return None
+        cores = sorted(os.sched_getaffinity(0))
+        per_worker = self.cpu_threads or max(1, len(cores) // max(1, self.size))
+        block = cores[index * per_worker:(index + 1) * per_worker]
+        return set(block) or None
+
+    def start(self):
+        self.running = True
+        for worker in self.workers:
+            self._spawn(worker)
+        threading.Thread(target=self._collect, name="asr-pool-collector", daemon=True).start()
+        threading.Thread(target=self._supervise, name="asr-pool-supervisor", daemon=True).start()
+        logger.info(f"Started {self.size} ASR worker processes")
+
+    def stop(self):
+        self.running = False
+        for worker in self.workers:
+            try:
+                worker.requests.put((None, None, None, None))
+            except Exception:
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def _spawn(self, worker):
+        worker.requests = self.ctx.Queue()
+        worker.ready = False
+        worker.generation += 1
+        worker.started_at = time.monotonic()
+        worker.process = self.ctx.Process(
+            target=_worker_main,
+            args=(worker.index, worker.generation, worker.requests, self.responses,
+                  self.cpu_threads, self.num_workers, worker.cores),
+            name=f"asr-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+
+    def _collect(self):
+        while self.running:
+            try:
+                job_id, index, generation, ok, result = self.responses.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            worker = self.workers[index]
+            if generation != worker.generation:
+                continue  # reply from a process that has since been replaced
+            if job_id is None and not ok:
+                worker.error = result
+                logger.error(f"ASR worker {index} failed to load its model: {result}")
+                continue
+            if job_id is None:
+                worker.ready = True
+                worker.failures, worker.error = 0, None
+                worker.load_sec = time.monotonic() - worker.started_at
+                self.idle.put((worker, worker.generation))
+                logger.info(f"ASR worker {index} ready in {worker.load_sec:.1f}s")
+                continue
+            with self.lock:
+                job, worker.job = worker.job, None
+            if job is None or job[0] != job_id:
+                continue
+            if ok:
+                job[1].set_result(result)
+            else:
+                job[1].set_exception(RuntimeError(result))
+            self.idle.put((worker, worker.generation))
+
+    def _supervise(self):
+        while self.running:
+            time.sleep(1.0)
+            self._check_workers()
+
+    def _check_workers(self):
+        for worker in self.workers:
+            if not self.running or worker.given_up or worker.process.is_alive():
+                continue
+            if worker.retry_at == 0.0:
+                with self.lock:
+                    job, worker.job = worker.job, None
+                if job is not None:
+                    job[1].set_exception(RuntimeError(f"ASR worker {worker.index} crashed"))
+                if not worker.ready:
+                    worker.failures += 1  # died before its model loaded
+                worker.ready = False
+                if worker.failures >= config.ASR_WORKER_MAX_RESTARTS:
+                    worker.given_up = True
+                    logger.error(f"ASR worker {worker.index} failed to start {worker.failures} times, giving up")
+                    continue
+                delay = min(60.0, 2.0 ** worker.failures) if worker.failures else 0.0
+                worker.retry_at = time.monotonic() + delay
+                logger.error(f"ASR worker {worker.index} died (exit code {worker.process.exitcode}), "
+                             f"restarting in {delay:.0f}s")
+            if time.monotonic() >= worker.retry_at:
+                worker.retry_at = 0.0
+                worker.restarts += 1
+                self._spawn(worker)
+
+    @property
+    def error(self):
+        """Why the pool cannot serve: every worker was given up (None otherwise)."""
+        if all(w.given_up for w in self.workers):
+            errors = {w.error or "process exited" for w in self.workers}
+            return f"all ASR workers failed to start: {'; '.join(sorted(errors))}"
+        return None
+
+    def _call(self, method, *args, **kwargs):
+        """Blocking: run `method` on the next idle worker and return its result."""
+        deadline = time.monotonic() + config.ASR_WORKER_TIMEOUT_SEC
+        while True:
+            try:
+                worker, generation = self.idle.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise RuntimeError(self.error or f"no idle ASR worker within {config.ASR_WORKER_TIMEOUT_SEC}s")
+            if generation == worker.generation and worker.process.is_alive():
+                break
+        future = Future()
+        job_id = next(self.job_ids)
+        with self.lock:
+            worker.job = (job_id, future)
+        worker.requests.put((job_id, method, args, kwargs))
+        try:
+            return future.result(timeout=config.ASR_WORKER_TIMEOUT_SEC)
+        except FutureTimeout:
+            # Stuck: kill it; the supervisor restarts it and drops this job
+            logger.error(f"ASR worker {worker.index} gave no result in {config.ASR_WORKER_TIMEOUT_SEC}s, restarting it")
+            worker.process.terminate()
+            raise RuntimeError(f"ASR worker {worker.index} timed out")
+
+    def transcribe_batch(self, audios, languages=None, **options):
+        return self._call("transcribe_batch", audios, languages, **options)
+
+    def detect_language_batch(self, audios):
+        return self._call("detect_language_batch", audios)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.size,
+            "ready": sum(1 for w in self.workers if w.ready and w.process.is_alive()),
+            "busy": sum(1 for w in self.workers if w.job is not None),
+            "restarts": sum(w.restarts for w in self.workers),
+            "given_up": sum(1 for w in self.workers if w.given_up),
+            "errors": [w.error for w in self.workers],
+            "load_sec": [round(w.load_sec, 2) if w.load_sec is not None else None for w in self.workers],
+        }
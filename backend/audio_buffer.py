@@ -0,0 +1,71 @@
+"""Per-room audio ring buffer.
+
+Incoming int16 frames are converted once, straight into a preallocated
+float32 ring of AUDIO_RING_SEC. Every sample is written twice (at i and
+i + capacity), so any window up to the capacity is one contiguous slice: ASR
+windows, including overlapping streaming windows, are read-only NumPy views
+handed to Whisper without a copy. Positions are absolute sample offsets since
+the connection started, so transcript timestamps line up with the stream.
+
+A view is only checked when it is taken; a reader that keeps one across an
+await (the ASR queue) must check holds() afterwards, since the writer may
+have wrapped over it in the meantime.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+import config
+
+
+class AudioOverwritten(LookupError):
+    """The requested samples were already overwritten (the reader fell too far behind)."""
+
+
+class AudioRingBuffer:
+    def __init__(self, capacity_sec=config.AUDIO_RING_SEC, sample_rate=config.SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.capacity = int(capacity_sec * sample_rate)
+        self._data = np.zeros(2 * self.capacity, dtype=np.float32)
+        self.end = 0  # absolute offset one past the newest sample
+
+    @property
+    def start(self) -> int:
+        """Oldest absolute offset still held."""
+        return max(0, self.end - self.capacity)
+
+    def write(self, pcm) -> int:
+        """Append little-endian int16 PCM (bytes-like or int16 array); returns the new end."""
+        samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+        if len(samples) > self.capacity:
+            self.end += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        position = self.end % self.capacity
+        first = min(len(samples), self.capacity - position)
+        for offset, part in ((position, samples[:first]), (0, samples[first:])):
+            if len(part):
+                np.multiply(part, 1.0 / 32768.0, out=self._data[offset:offset + len(part)], casting="unsafe")
+                np.multiply(part, 1.0 / 32768.0, out=self._data[offset + self.capacity:offset + self.capacity + len(part)],
+                            casting="unsafe")
+        self.end += len(samples)
+        return self.end
+
+    def holds(self, start: int) -> bool:
+        """True while the samples from absolute offset `start` have not been overwritten."""
+        return start >= self.start
+
+    def view(self, start: int, end: int = None) -> np.ndarray:
+        """Read-only float32 view of absolute samples [start, end)."""
+        end = self.end if end is None else end
+        if start < self.start:
+            raise AudioOverwritten(f"samples from {start} were overwritten (ring starts at {self.start})")
+        if end > self.end or end < start:
+            raise ValueError(f"invalid window [{start}, {end}) for ring ending at {self.end}")
+        position = start % self.capacity
+        window = self._data[position:position + (end - start)]
+        window.flags.writeable = False
+        return window
+
+    def seconds(self, offset: int) -> float:
+        return offset / self.sample_rate
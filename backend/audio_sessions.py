@@ -0,0 +1,130 @@
+"""Resumable audio sender sessions.
+
+A sender that handshakes with protocol version 2 gets a session: it numbers
+its audio frames, and the server acks the highest frame written into the
+room's ring buffer. If the connection drops without a {"type": "bye"}, the
+session and the room's pipeline (ring, VAD / streaming window, aggregator)
+are kept for AUDIO_SESSION_GRACE_SEC. A sender that reconnects with the
+session token resends everything after the last ack; frames the server
+already received are dropped, so a reconnect leaves no gap and no
+duplicate audio, and the room does not start cold again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import secrets
+import time
+
+import config
+
+logger = logging.getLogger("audio_sessions")
+
+
+class AudioSession:
+    def __init__(self, room_id, token):
+        self.room_id = room_id
+        self.token = token
+        self.owner = None  # WebSocket currently sending for this session
+        self.notify = None  # owner's control-message sender; None while detached
+        self.received_seq = -1  # highest frame accepted from the sender
+        self.committed_seq = -1  # highest frame written into the room's ring
+        self.acked_at = 0.0
+        self.expiry = None  # TimerHandle while detached
+        self.resumes = 0
+        self.duplicates = 0
+        self.lost = 0  # frames the sender skipped (never resent)
+
+    def accept(self, seq) -> bool:
+        """False for a frame already received (resent after a reconnect)."""
+        if self.received_seq < 0:
+            # First frame of a fresh session: a sender resuming a session this
+            # server no longer knows starts at its own high seq, not at 0
+            self.received_seq = seq - 1
+        if seq <= self.received_seq:
+            self.duplicates += 1
+            return False
+        self.lost += seq - self.received_seq - 1
+        self.received_seq = seq
+        return True
+
+    def commit(self, seq):
+        """Ingest stage wrote `seq`; ack it, at most once per AUDIO_ACK_INTERVAL_MS."""
+        self.committed_seq = max(self.committed_seq, seq)
+        now = time.monotonic()
+        if self.notify is not None and now - self.acked_at >= config.AUDIO_ACK_INTERVAL_MS / 1000.0:
+            self.acked_at = now
+            self.notify({"type": "ack", "seq": self.committed_seq})
+
+
+class SessionRegistry:
+    def __init__(self, grace_sec=config.AUDIO_SESSION_GRACE_SEC):
+        self.grace_sec = grace_sec
+        self.sessions = {}  # token -> AudioSession
+        self.expired = 0
+        # Counters of sessions already closed or expired
+        self.resumes = 0
+        self.duplicates = 0
+        self.lost = 0
+
+    def open(self, room_id) -> AudioSession:
+        session = AudioSession(room_id, secrets.token_urlsafe(16))
+        self.sessions[session.token] = session
+        return session
+
+    def resume(self, token, room_id):
+        """The live or detached session for `token`, or None (unknown, expired, other room)."""
+        session = self.sessions.get(token)
+        if session is None or session.room_id != room_id:
+            return None
+        session.resumes += 1
+        return session
+
+    def attach(self, session, ws, notify) -> bool:
+        """Make `ws` the sender; True when this ended a grace period."""
+        session.owner, session.notify = ws, notify
+        session.acked_at = 0.0  # next commit acks right away
+        if session.expiry is None:
+            return False
+        session.expiry.cancel()
+        session.expiry = None
+        return True
+
+    def detach(self, session, on_expire):
+        """Sender gone without a bye: keep the session for the grace period."""
+        session.owner = session.notify = None
+        loop = asyncio.get_running_loop()
+        session.expiry = loop.call_later(self.grace_sec, self._expire, session, on_expire)
+        logger.info(f"Audio session for {session.room_id} detached, kept {self.grace_sec}s")
+
+    def close(self, session):
+        self._retire(session)
+        if session.expiry is not None:
+            session.expiry.cancel()
+            session.expiry = None
+
+    def _expire(self, session, on_expire):
+        session.expiry = None
+        self._retire(session)
+        self.expired += 1
+        logger.info(f"Audio session for {session.room_id} expired")
+        asyncio.ensure_future(on_expire())
+
+    def _retire(self, session):
+        if self.sessions.pop(session.token, None) is None:
+            return
+        self.resumes += session.resumes
+        self.duplicates += session.duplicates
+        self.lost += session.lost
+
+    def stats(self) -> dict:
+        live = self.sessions.values()
+        return {
+            "active": sum(1 for s in live if s.owner is not None),
+            "detached": sum(1 for s in live if s.expiry is not None),
+            "expired": self.expired,
+            "resumes": self.resumes + sum(s.resumes for s in live),
+            "duplicates": self.duplicates + sum(s.duplicates for s in live),
+            "lost": self.lost + sum(s.lost for s in live),
+        }
@@ -0,0 +1,283 @@
+"""Offline bulk transcription jobs for recorded lectures.
+
+A job covers one file or every audio file in a directory. Each file is decoded
+and split on speech boundaries (SpeechSegmenter) a window at a time, and the
+pieces go through the shared ASR scheduler BULK_PARALLEL at a time, so they
+batch like live rooms do. Batched translation and a bulk insert of window k run while the ASR
+works on window k + 1. Each window's rows are inserted in the same
+transaction as the job's progress (bulk_job_checkpoints), and the job is
+also checkpointed to JOB_DIR/<id>.json, so interrupted jobs resume where
+they stopped without duplicating rows. Pieces go to the scheduler as bulk
+work: behind live audio, and never shed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+import asr_whisper
+import config
+import database
+import models
+import segmenter
+import utils
+
+logger = logging.getLogger("bulk_jobs")
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".m4a", ".ogg", ".opus", ".webm", ".aac"}
+
+
+@dataclass
+class BulkJob:
+    id: str
+    room_id: str
+    files: List[str]
+    language: Optional[str] = None
+    target_language: str = "en"
+    status: str = "queued"  # queued | running | done | failed | cancelled
+    file_index: int = 0
+    offset_sec: float = 0.0  # resume point inside files[file_index]
+    file_duration_sec: float = 0.0
+    processed_sec: float = 0.0  # audio covered across all files
+    segments: int = 0
+    error: Optional[str] = None
+    created_at: str = field(default_factory=utils.timestamp_now)
+    updated_at: str = field(default_factory=utils.timestamp_now)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class BulkJobManager:
+    def __init__(self, scheduler, batcher, broadcast, job_dir=config.JOB_DIR,
+                 parallel=config.BULK_PARALLEL):
+        self.scheduler = scheduler
+        self.batcher = batcher  # TranslationBatcher
+        self.broadcast = broadcast  # async (message, topic)
+        self.job_dir = Path(job_dir)
+        self.parallel = parallel
+        self.jobs = {}
+        self.tasks = {}
+        self._stopping = False
+
+    def resume_all(self):
+        """Restart jobs whose checkpoint says they were queued or running."""
+        if not self.job_dir.is_dir():
+            return
+        for path in sorted(self.job_dir.glob("*.json")):
+            try:
+                job = BulkJob(**json.loads(path.read_text(encoding="utf-8")))
+            except Exception as e:
+                logger.error(f"Ignoring unreadable job checkpoint {path}: {e}")
+                continue
+            self._adopt_db_progress(job)
+            self.jobs[job.id] = job
+            if job.status in ("queued", "running"):
+                logger.info(f"Resuming job {job.id} at file {job.file_index}, {job.offset_sec:.1f}s")
+                self._start(job)
+
+    def _adopt_db_progress(self, job: BulkJob):
+        """The DB checkpoint wins when it is ahead: its rows are already stored."""
+        try:
+            with database.session_scope() as session:
+                saved = session.get(models.BulkJobCheckpoint, job.id)
+                if saved is None or (saved.file_index, saved.offset_sec) <= (job.file_index, job.offset_sec):
+                    return
+                job.file_index, job.offset_sec = saved.file_index, saved.offset_sec
+                job.processed_sec, job.segments = saved.processed_sec, saved.segments
+        except Exception as e:
+            logger.error(f"Could not read DB checkpoint of job {job.id}: {e}")
+
+    def submit(self, path: str, room_id=None, language=None, target_language="en") -> BulkJob:
+        root = Path(path)
+        if root.is_dir():
+            files = sorted(str(p) for p in root.rglob("*") if p.suffix.lower() in AUDIO_EXTENSIONS)
+        elif root.is_file():
+            files = [str(root)]
+        else:
+            raise ValueError(f"No such file or directory: {path}")
+        if not files:
+            raise ValueError(f"No audio files under {path}")
+
+        job_id = uuid.uuid4().hex[:12]
+        job = BulkJob(id=job_id, room_id=room_id or f"job-{job_id}", files=files,
+                      language=language, target_language=target_language)
+        self.jobs[job_id] = job
+        self._checkpoint(job)
+        self._start(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[BulkJob]:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[BulkJob]:
+        return list(self.jobs.values())
+
+    async def cancel(self, job_id: str) -> bool:
+        task = self.tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def stop(self):
+        """Shutdown: stop tasks but leave checkpoints as running so they resume."""
+        self._stopping = True
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def _start(self, job: BulkJob):
+        self.tasks[job.id] = asyncio.create_task(self._run(job))
+        self.tasks[job.id].add_done_callback(lambda _: self.tasks.pop(job.id, None))
+
+    def _checkpoint(self, job: BulkJob):
+        job.updated_at = utils.timestamp_now()
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        path = self.job_dir / f"{job.id}.json"
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(job.to_dict()), encoding="utf-8")
+        os.replace(tmp, path)
+
+    async def _run(self, job: BulkJob):
+        job.status = "running"
+        self._checkpoint(job)
+        try:
+            while job.file_index < len(job.files):
+                await self._run_file(job, job.files[job.file_index])
+                job.file_index += 1
+                job.offset_sec = 0.0
+                self._checkpoint(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            if not self._stopping:
+                job.status = "cancelled"
+            self._checkpoint(job)
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.status, job.error = "failed", str(e)
+        self._checkpoint(job)
+        await self.broadcast({"type": "job", "payload": job.to_dict()}, topic=f"job:{job.id}")
+
+    async def _run_file(self, job: BulkJob, path: str):
+        job.file_duration_sec = await utils.run_blocking(asr_whisper.audio_duration, path) or 0.0
+        language = job.language
+        pending = None  # (window, its ASR task): overlaps the next window's decode
+        pieces = 0
+        try:
+            async for window in self._piece_windows(job, path):
+                pieces += len(window)
+                if language is None:
+                    probs = await self.scheduler.detect_language(f"{job.room_id}#0", window[0][1], bulk=True)
+                    language = max(probs, key=probs.get) if probs else "en"
+                transcribing = asyncio.create_task(self._transcribe_window(job, window, language))
+                if pending is not None:
+                    # This window's ASR overlaps the previous window's translation + insert
+                    await self._finish_window(job, path, language, *pending)
+                pending = (window, transcribing)
+            if pending is not None:
+                await self._finish_window(job, path, language, *pending)
+        finally:
+            if pending is not None and not pending[1].done():
+                pending[1].cancel()
+        logger.info(f"Job {job.id}: {path} -> {pieces} speech pieces")
+
+    async def _finish_window(self, job: BulkJob, path, language, window, transcribing):
+        results = await transcribing
+        rows = await self._translate_rows(job, window, results, language)
+        last_start, last_audio = window[-1]
+        done_until = last_start + len(last_audio) / config.SAMPLE_RATE
+        progress = {"file_index": job.file_index, "offset_sec": done_until,
+                    "processed_sec": job.processed_sec + done_until - job.offset_sec,
+                    "segments": job.segments + len(rows)}
+        await utils.run_blocking(self._insert, job, rows, language, progress)
+
+        job.offset_sec, job.processed_sec, job.segments = (
+            progress["offset_sec"], progress["processed_sec"], progress["segments"])
+        self._checkpoint(job)
+        await self.broadcast({
+            "type": "job_progress",
+            "payload": {"job_id": job.id, "file": path, "offset_sec": round(done_until, 2),
+                        "file_duration_sec": round(job.file_duration_sec, 2),
+                        "segments": rows},
+        }, topic=f"job:{job.id}")
+
+    async def _piece_windows(self, job: BulkJob, path: str):
+        """
+        (start_sec, float32 piece) lists of up to BULK_PARALLEL pieces past the
+        job's offset. The file is decoded and segmented BULK_DECODE_WINDOW_SEC
+        at a time, the segmenter carrying its state across decode windows, so
+        only that much audio (plus the pieces in flight) is in memory.
+        """
+        reader = asr_whisper.decode_audio_windows(path)
+        seg = segmenter.SpeechSegmenter(max_utterance_sec=config.BULK_MAX_PIECE_SEC)
+        decoded = 0
+        ready = []
+        try:
+            while True:
+                pcm = await utils.run_blocking(next, reader, None)
+                if pcm is None:
+                    found = seg.split_end()
+                else:
+                    decoded += len(pcm) // 2
+                    found = await utils.run_blocking(seg.split_window, pcm)
+                job.file_duration_sec = max(job.file_duration_sec, decoded / config.SAMPLE_RATE)
+                ready.extend((start / config.SAMPLE_RATE, utils.pcm16_to_float32(piece))
+                             for start, piece in found if start / config.SAMPLE_RATE >= job.offset_sec)
+                while len(ready) >= self.parallel or (pcm is None and ready):
+                    yield ready[:self.parallel]
+                    del ready[:self.parallel]
+                if pcm is None:
+                    return
+        finally:
+            try:
+                reader.close()
+            except ValueError:  # cancelled mid-decode: the executor thread still holds it
+                pass
+
+    async def _transcribe_window(self, job: BulkJob, window, language):
+        # One scheduler lane per piece so the whole window can share a batch
+        return await asyncio.gather(*(
+            self.scheduler.transcribe(f"{job.room_id}#{lane}", audio, language=language, bulk=True)
+            for lane, (_, audio) in enumerate(window)
+        ))
+
+    async def _translate_rows(self, job: BulkJob, window, results, language):
+        rows = []
+        for (start, _), (segments, info) in zip(window, results):
+            if info is None:  # not transcribed; finishing the job would lose this audio
+                raise RuntimeError(f"ASR dropped the piece at {start:.1f}s")
+            for seg in segments:
+                if seg["text"].strip():
+                    rows.append({"start": round(start + seg["start"], 2),
+                                 "end": round(start + seg["end"], 2),
+                                 "text": seg["text"].strip()})
+
+        translations = await asyncio.gather(*(
+            self.batcher.translate(r["text"], language, job.target_language) for r in rows
+        ))
+        for row, translation in zip(rows, translations):
+            row["translation"] = translation
+        return rows
+
+    def _insert(self, job: BulkJob, rows, language, progress):
+        """Rows and the progress they complete, in one transaction."""
+        with database.session_scope() as session:
+            session.bulk_save_objects([
+                models.Transcript(room_id=job.room_id, speaker="offline", text=r["text"],
+                                  translation=r["translation"], detected_language=language)
+                for r in rows
+            ])
+            session.merge(models.BulkJobCheckpoint(job_id=job.id, **progress))
@@ -1,4 +1,5 @@
 import os
+import socket
 
 # Directory for storing models (set via MODEL_DIR env, default to D:\AI_MODELS)
 MODEL_DIR = os.getenv("MODEL_DIR", r"D:\AI_MODELS")
@@ -10,18 +11,182 @@ os.environ["TRANSFORMERS_CACHE"] = MODEL_DIR
 WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
 WHISPER_COMPUTE = os.getenv("WHISPER_COMPUTE", "int8")
 
-# Translation backend: "marian", "m2m100", or "cloud"
+# ASR worker pool: 0 runs the model in-process; N > 0 starts N worker
+# processes, each loading its own model
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "0"))
+# CTranslate2 threads per model (0 = library default) and parallel decoders per model
+ASR_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", "0"))
+ASR_NUM_WORKERS = int(os.getenv("ASR_NUM_WORKERS", "1"))
+# Pin each worker process to its own block of ASR_CPU_THREADS cores (Linux only)
+ASR_CPU_AFFINITY = os.getenv("ASR_CPU_AFFINITY", "0") == "1"
+# A worker whose model fails to load this many times in a row (restarts back
+# off exponentially) is given up; the pool must have a ready worker within
+# ASR_WORKER_LOAD_TIMEOUT_SEC, and a request waits at most ASR_WORKER_TIMEOUT_SEC
+# for an idle worker and again for its result
+ASR_WORKER_MAX_RESTARTS = int(os.getenv("ASR_WORKER_MAX_RESTARTS", "5"))
+ASR_WORKER_LOAD_TIMEOUT_SEC = float(os.getenv("ASR_WORKER_LOAD_TIMEOUT_SEC", "600"))
+ASR_WORKER_TIMEOUT_SEC = float(os.getenv("ASR_WORKER_TIMEOUT_SEC", "120"))
+
+# Translation backend: "marian", "m2m100", "ct2" (Opus-MT on CTranslate2),
+# "ct2-m2m100" (M2M100 on CTranslate2), or "cloud"
 TRANSLATION_BACKEND = os.getenv("TRANSLATION_BACKEND", "marian")
+# Language pairs loaded (and warmed up) at startup and never evicted, e.g. "hi-en,en-hi"
+TRANSLATION_PRELOAD_PAIRS = [
+    tuple(pair.split("-", 1)) for pair in os.getenv("TRANSLATION_PRELOAD_PAIRS", "hi-en,en-hi").split(",")
+    if "-" in pair
+]
+# Translation micro-batching: segments for the same language pair (across all
+# rooms) are gathered for up to TRANSLATION_BATCH_WAIT_MS into one generate() call
+TRANSLATION_BATCH_SIZE = int(os.getenv("TRANSLATION_BATCH_SIZE", "16"))
+TRANSLATION_BATCH_WAIT_MS = int(os.getenv("TRANSLATION_BATCH_WAIT_MS", "10"))
+
+# CTranslate2 translation backends: weight quantization (models are converted
+# once into MODEL_DIR/ct2), threads per batch, parallel batches, and beam size
+TRANSLATION_CT2_COMPUTE = os.getenv("TRANSLATION_CT2_COMPUTE", "int8")
+TRANSLATION_CT2_THREADS = int(os.getenv("TRANSLATION_CT2_THREADS", "0"))
+TRANSLATION_CT2_INTER_THREADS = int(os.getenv("TRANSLATION_CT2_INTER_THREADS", "1"))
+TRANSLATION_CT2_BEAM = int(os.getenv("TRANSLATION_CT2_BEAM", "2"))
+
+# Translation model memory: RAM budget for loaded models (least recently used
+# unpinned models are evicted past it), idle time before a model is dropped,
+# and how long a failed load is remembered before it is retried
+TRANSLATION_MEMORY_MB = int(os.getenv("TRANSLATION_MEMORY_MB", "3072"))
+TRANSLATION_IDLE_EVICT_SEC = float(os.getenv("TRANSLATION_IDLE_EVICT_SEC", "1800"))
+TRANSLATION_LOAD_RETRY_SEC = float(os.getenv("TRANSLATION_LOAD_RETRY_SEC", "300"))
+
+# Translation result cache: entries kept in the in-memory LRU (0 disables the
+# cache) and whether results are also stored in the database to survive restarts
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "10000"))
+TRANSLATION_CACHE_PERSIST = os.getenv("TRANSLATION_CACHE_PERSIST", "1") == "1"
 
 # Database URL (SQLite for local storage)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///transcripts.db")
 
+# Write-behind transcript persistence: rows from every room are grouped into
+# one transaction per PERSIST_FLUSH_MS or PERSIST_BATCH_SIZE rows, and writers
+# wait only once PERSIST_QUEUE_SIZE rows are pending. PERSIST_DURABILITY:
+# "async" (broadcast first, write behind), "sync" (broadcast after the commit)
+# or "off" (live transcripts are not stored)
+PERSIST_FLUSH_MS = int(os.getenv("PERSIST_FLUSH_MS", "250"))
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "10000"))
+PERSIST_DURABILITY = os.getenv("PERSIST_DURABILITY", "async")
+
 # Server host/port (0.0.0.0 to listen on LAN)
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8000"))
 
 # ASR chunk length in seconds (reduced for faster response)
 WHISPER_CHUNK_SEC = int(os.getenv("WHISPER_CHUNK_SEC", "1"))
+
+# ASR mode: "chunked" (independent WHISPER_CHUNK_SEC slices) or "streaming"
+# (rolling window re-decoded every STREAM_STEP_SEC with local-agreement commits)
+ASR_MODE = os.getenv("ASR_MODE", "chunked")
+STREAM_STEP_SEC = float(os.getenv("STREAM_STEP_SEC", "0.5"))
+# Uncommitted audio kept in the window before the tail is force-committed
+STREAM_MAX_WINDOW_SEC = float(os.getenv("STREAM_MAX_WINDOW_SEC", "15"))
+
+# Server-side chunking: "vad" cuts utterances on speech endpoints (silence never
+# reaches the ASR), "fixed" sends every WHISPER_CHUNK_SEC slice
+CHUNKING = os.getenv("CHUNKING", "vad")
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", "30"))  # webrtcvad accepts 10/20/30
+VAD_AGGRESSIVENESS = int(os.getenv("VAD_AGGRESSIVENESS", "2"))
+VAD_ENERGY_DBFS = float(os.getenv("VAD_ENERGY_DBFS", "-45"))
+VAD_PREROLL_MS = int(os.getenv("VAD_PREROLL_MS", "300"))
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "400"))
+VAD_MAX_UTTERANCE_SEC = float(os.getenv("VAD_MAX_UTTERANCE_SEC", "10"))
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "250"))
+
+# Per-room float32 audio ring: seconds of received audio kept for ASR windows
+# (must cover VAD_MAX_UTTERANCE_SEC and STREAM_MAX_WINDOW_SEC plus queueing)
+AUDIO_RING_SEC = float(os.getenv("AUDIO_RING_SEC", "60"))
+
+# Language identification: detection-only passes on the first seconds of
+# speech until the room's language locks; locks survive reconnects for the TTL
+LANGID_WINDOW_SEC = float(os.getenv("LANGID_WINDOW_SEC", "10"))
+LANGID_MIN_SPEECH_SEC = float(os.getenv("LANGID_MIN_SPEECH_SEC", "2"))
+LANGID_MAX_SPEECH_SEC = float(os.getenv("LANGID_MAX_SPEECH_SEC", "8"))
+LANGID_MIN_CONFIDENCE = float(os.getenv("LANGID_MIN_CONFIDENCE", "0.7"))
+LANGUAGE_LOCK_TTL_SEC = float(os.getenv("LANGUAGE_LOCK_TTL_SEC", "1800"))
+
+# Cross-room ASR scheduler: pending chunks from all rooms are grouped into
+# batches of up to ASR_BATCH_SIZE, waiting at most ASR_BATCH_WAIT_MS to fill one
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "8"))
+ASR_BATCH_WAIT_MS = int(os.getenv("ASR_BATCH_WAIT_MS", "20"))
+ASR_QUEUE_SIZE = int(os.getenv("ASR_QUEUE_SIZE", "64"))
+
+# Load-adaptive ASR quality: under pressure step down full (beam 5) -> greedy
+# -> ASR_FALLBACK_MODEL -> shed chunks older than ASR_DEADLINE_SEC; step back up
+# when load falls. Pressure = real-time factor or queue depth above the limits.
+ASR_ADAPTIVE = os.getenv("ASR_ADAPTIVE", "1") == "1"
+ASR_FALLBACK_MODEL = os.getenv("ASR_FALLBACK_MODEL", "base")
+ASR_RTF_HIGH = float(os.getenv("ASR_RTF_HIGH", "0.8"))
+ASR_RTF_LOW = float(os.getenv("ASR_RTF_LOW", "0.4"))
+ASR_QUEUE_HIGH = int(os.getenv("ASR_QUEUE_HIGH", "16"))
+ASR_TIER_DWELL_SEC = float(os.getenv("ASR_TIER_DWELL_SEC", "5"))
+ASR_DEADLINE_SEC = float(os.getenv("ASR_DEADLINE_SEC", "5"))
+
+# Offline bulk transcription jobs: checkpoint directory, pieces in flight per
+# job, and the longest speech piece cut from a recording
+JOB_DIR = os.getenv("JOB_DIR", "jobs")
+BULK_PARALLEL = int(os.getenv("BULK_PARALLEL", "8"))
+BULK_MAX_PIECE_SEC = float(os.getenv("BULK_MAX_PIECE_SEC", "25"))
+# Recordings are decoded and segmented this much at a time, never whole
+BULK_DECODE_WINDOW_SEC = float(os.getenv("BULK_DECODE_WINDOW_SEC", "120"))
+
+# Live pipeline (ingest -> asr -> aggregate -> translate -> persist -> broadcast):
+# items queued per stage per room, threads for VAD/chunking and for database writes,
+# and rooms allowed to wait on the ASR / translation at the same time
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "32"))
+PIPELINE_INGEST_THREADS = int(os.getenv("PIPELINE_INGEST_THREADS", "2"))
+PIPELINE_DB_THREADS = int(os.getenv("PIPELINE_DB_THREADS", "1"))
+PIPELINE_ASR_CONCURRENCY = int(os.getenv("PIPELINE_ASR_CONCURRENCY", str(ASR_QUEUE_SIZE)))
+PIPELINE_TRANSLATE_CONCURRENCY = int(os.getenv("PIPELINE_TRANSLATE_CONCURRENCY", "64"))
+# Received audio frames queued per room before INGEST_OVERFLOW applies:
+# "drop_oldest", "merge" (append to the newest queued frame) or "slow_down"
+# (drop oldest, and ask the sender to slow down from INGEST_SLOW_DOWN_AT full)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "64"))
+INGEST_OVERFLOW = os.getenv("INGEST_OVERFLOW", "drop_oldest")
+INGEST_SLOW_DOWN_AT = float(os.getenv("INGEST_SLOW_DOWN_AT", "0.75"))
+# Longest queued item "merge" builds; past it the oldest audio is dropped
+INGEST_MERGE_MAX_SEC = float(os.getenv("INGEST_MERGE_MAX_SEC", "5"))
+
+# Resumable audio sessions (ingest protocol v2): how long a dropped sender's
+# session and room pipeline are kept for it to reconnect, and the minimum gap
+# between acknowledgements of committed frames
+AUDIO_SESSION_GRACE_SEC = float(os.getenv("AUDIO_SESSION_GRACE_SEC", "30"))
+AUDIO_ACK_INTERVAL_MS = int(os.getenv("AUDIO_ACK_INTERVAL_MS", "200"))
+
+# Sentence aggregation before translation: fragments are held until a sentence
+# terminator, SENTENCE_PAUSE_SEC without new speech, SENTENCE_MAX_LATENCY_SEC
+# after the first fragment, or SENTENCE_MAX_CHARS (captions are not delayed)
+SENTENCE_AGGREGATION = os.getenv("SENTENCE_AGGREGATION", "1") == "1"
+SENTENCE_PAUSE_SEC = float(os.getenv("SENTENCE_PAUSE_SEC", "0.8"))
+SENTENCE_MAX_LATENCY_SEC = float(os.getenv("SENTENCE_MAX_LATENCY_SEC", "3.0"))
+SENTENCE_MAX_CHARS = int(os.getenv("SENTENCE_MAX_CHARS", "300"))
+
+# WebSocket fan-out: messages queued per client, what to do when a client's
+# queue is full ("drop_oldest" or "disconnect"), and the per-send timeout
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "256"))
+WS_SLOW_POLICY = os.getenv("WS_SLOW_POLICY", "drop_oldest")
+WS_SEND_TIMEOUT_SEC = float(os.getenv("WS_SEND_TIMEOUT_SEC", "10"))
+# Messages published within this window go out together (one frame for
+# batching / binary clients); 0 sends every message immediately
+WS_COALESCE_MS = int(os.getenv("WS_COALESCE_MS", "15"))
+
+# Horizontal scaling: "memory" keeps room state and broadcasts in this process
+# (one worker); "redis" shares them through REDIS_URL so listeners on any
+# worker or node receive every room's transcripts
+ROOM_STATE_BACKEND = os.getenv("ROOM_STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# This worker's id and the WebSocket base URL clients can reach it on directly
+# (e.g. ws://10.0.0.5:8001); audio for a room another worker owns is
+# redirected to that worker's URL. A room's lease is renewed every third of
+# ROOM_LEASE_SEC while its pipeline runs.
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+WORKER_URL = os.getenv("WORKER_URL", f"ws://127.0.0.1:{os.getenv('PORT', '8000')}")
+ROOM_LEASE_SEC = float(os.getenv("ROOM_LEASE_SEC", "15"))
+
 # Audio sample rate
 SAMPLE_RATE = int(os.getenv("SAMPLE_RATE", "16000"))
 ROOM_ID = "default"
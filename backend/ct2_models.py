@@ -0,0 +1,76 @@
+"""CTranslate2 conversions of the Hugging Face translation models.
+
+Opus-MT and M2M100 checkpoints are converted once and cached under
+MODEL_DIR/ct2/, quantized to TRANSLATION_CT2_COMPUTE. The ct2 translation
+backends convert on first use; this script does it ahead of time:
+
+    python ct2_models.py hi-en en-hi ta-en
+    python ct2_models.py --m2m100
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import shutil
+
+import config
+
+logger = logging.getLogger("ct2_models")
+
+
+def model_path(model_name: str, quantization=config.TRANSLATION_CT2_COMPUTE) -> str:
+    return os.path.join(config.MODEL_DIR, "ct2", f"{model_name.replace('/', '--')}-{quantization}")
+
+
+def disk_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def convert(model_name: str, quantization=config.TRANSLATION_CT2_COMPUTE, force=False) -> str:
+    """Return the converted model directory, converting it if it is not cached."""
+    output = model_path(model_name, quantization)
+    if os.path.isfile(os.path.join(output, "model.bin")) and not force:
+        return output
+
+    from ctranslate2.converters import TransformersConverter
+
+    logger.info(f"Converting {model_name} to CTranslate2 ({quantization})")
+    staging = output + ".tmp"
+    TransformersConverter(model_name).convert(staging, quantization=quantization, force=True)
+    if os.path.isdir(output):
+        shutil.rmtree(output)
+    os.replace(staging, output)  # readers never see a half-written model
+    logger.info(f"Converted {model_name}: {disk_bytes(output) / 2**20:.0f} MB at {output}")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert translation models to CTranslate2")
+    parser.add_argument("pairs", nargs="*", help="Opus-MT language pairs, e.g. hi-en en-hi "
+                                                 "(default: TRANSLATION_PRELOAD_PAIRS)")
+    parser.add_argument("--m2m100", action="store_true", help="also convert facebook/m2m100_418M")
+    parser.add_argument("--quantization", default=config.TRANSLATION_CT2_COMPUTE)
+    parser.add_argument("--force", action="store_true", help="reconvert cached models")
+    args = parser.parse_args()
+
+    import translation_engine
+
+    pairs = [tuple(p.split("-", 1)) for p in args.pairs] or config.TRANSLATION_PRELOAD_PAIRS
+    names = [translation_engine.marian_model_name(src, tgt) for src, tgt in pairs]
+    if args.m2m100:
+        names.append(translation_engine.M2M100_MODEL)
+    for name in names:
+        try:
+            print(convert(name, args.quantization, args.force))
+        except Exception as e:
+            print(f"Failed to convert {name}: {e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,142 @@
+"""Audio ingest wire protocol for /ws/audio.
+
+A sender may open with a versioned handshake (text frame):
+
+    {"type": "hello", "version": 2, "codec": "opus", "sample_rate": 16000, "channels": 1}
+
+and the server answers {"type": "welcome", "version": 2, "codec": ..., "codecs": [...]}
+or, when it cannot honour the request, {"type": "error", "reason": ..., "codecs": [...]}
+and keeps the connection on the previous codec so the sender can fall back.
+
+Version 2 adds resumable sessions (see audio_sessions): every audio frame
+carries a sequence number, as a 4-byte big-endian prefix on binary frames or
+a "seq" field on text frames, and the hello may carry the "session" token of
+a connection being resumed.
+
+With INGEST_OVERFLOW=slow_down the server may send {"type": "flow", "action":
+"slow_down" | "resume"}. It is advisory: a sender that ignores it only loses
+the oldest queued audio. The Pi client stops bursting its resend backlog and
+sends in real time until it gets "resume".
+
+Codecs:
+    pcm16   binary frames of raw little-endian int16 mono PCM (the default)
+    base64  legacy text frames {"type": "audio", "data": <base64 pcm16>} as sent
+            by older Pi clients; accepted without a handshake
+    opus    binary frames holding one Opus packet each, decoded here with a
+            decoder per connection (needs opuslib / libopus)
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import logging
+import struct
+from typing import Optional, Tuple
+
+import config
+
+try:
+    import opuslib
+except Exception:  # ImportError, or libopus missing on the host
+    opuslib = None
+
+logger = logging.getLogger("ingest")
+
+PROTOCOL_VERSION = 2
+SEQ = struct.Struct(">I")  # v2 binary frame prefix
+OPUS_MAX_FRAME_MS = 120  # longest Opus packet duration
+
+
+class ProtocolError(ValueError):
+    """A frame or handshake the server cannot accept."""
+
+
+def supported_codecs() -> list:
+    return ["pcm16", "base64"] + (["opus"] if opuslib is not None else [])
+
+
+class IngestDecoder:
+    """Turns one connection's frames into int16 PCM at config.SAMPLE_RATE."""
+
+    def __init__(self, sample_rate=config.SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.codec = "pcm16"
+        self.version = 0  # 0 until a handshake (legacy senders never send one)
+        self.opus = None
+        self.wire_bytes = 0
+        self.pcm_bytes = 0
+        self.errors = 0
+
+    def hello(self, message: dict) -> dict:
+        """Apply a handshake; returns the reply frame."""
+        try:
+            version = int(message.get("version", PROTOCOL_VERSION))
+            codec = message.get("codec", "pcm16")
+            if version > PROTOCOL_VERSION:
+                raise ProtocolError(f"unsupported protocol version {version}")
+            if codec not in supported_codecs():
+                raise ProtocolError(f"unsupported codec {codec!r}")
+            if int(message.get("channels", 1)) != 1:
+                raise ProtocolError("only mono audio is accepted")
+            if codec != "opus" and int(message.get("sample_rate", self.sample_rate)) != self.sample_rate:
+                raise ProtocolError(f"{codec} audio must be {self.sample_rate} Hz")
+        except (TypeError, ValueError) as e:
+            self.errors += 1
+            return {"type": "error", "reason": str(e), "version": PROTOCOL_VERSION,
+                    "codecs": supported_codecs()}
+
+        self.version, self.codec = version, codec
+        # Opus decodes to any of its native rates; ask for ours directly
+        self.opus = opuslib.Decoder(self.sample_rate, 1) if codec == "opus" else None
+        return {"type": "welcome", "version": PROTOCOL_VERSION, "codec": codec,
+                "sample_rate": self.sample_rate, "codecs": supported_codecs()}
+
+    def decode_binary(self, frame: bytes) -> Tuple[Optional[int], Optional[bytes]]:
+        """(seq, pcm); seq is None before v2, pcm None for an undecodable frame."""
+        self.wire_bytes += len(frame)
+        seq = None
+        if self.version >= 2:
+            if len(frame) < SEQ.size:
+                self.errors += 1
+                return None, None
+            seq, frame = SEQ.unpack_from(frame)[0], frame[SEQ.size:]
+        if self.opus is not None:
+            try:
+                pcm = self.opus.decode(frame, self.sample_rate * OPUS_MAX_FRAME_MS // 1000)
+            except opuslib.OpusError as e:
+                self.errors += 1
+                logger.debug(f"Dropping undecodable Opus packet: {e}")
+                return seq, None
+        else:
+            pcm = frame
+        if len(pcm) % 2:
+            pcm = pcm[:-1]  # half a sample cannot be placed in the ring
+        self.pcm_bytes += len(pcm)
+        return seq, pcm
+
+    def decode_text(self, message: dict) -> Tuple[Optional[int], Optional[bytes]]:
+        """Legacy {"type": "audio", "data": <base64>, "seq": n} frame."""
+        data = message.get("data") or ""
+        self.wire_bytes += len(data)
+        seq = message.get("seq") if self.version >= 2 else None
+        try:
+            pcm = base64.b64decode(data, validate=True)
+            seq = None if seq is None else int(seq)
+        except (binascii.Error, ValueError, TypeError):
+            self.errors += 1
+            return None, None
+        if len(pcm) % 2:
+            pcm = pcm[:-1]
+        self.pcm_bytes += len(pcm)
+        return seq, pcm
+
+    def stats(self) -> dict:
+        return {
+            "codec": self.codec,
+            "version": self.version,
+            "wire_bytes": self.wire_bytes,
+            "pcm_bytes": self.pcm_bytes,
+            "compression": round(self.pcm_bytes / self.wire_bytes, 1) if self.wire_bytes else None,
+            "errors": self.errors,
+        }
@@ -0,0 +1,89 @@
+"""Per-room spoken-language identification and lock cache.
+
+Until a room's language is locked, each chunk gets a cheap Whisper
+language-detection pass (no decoding) on its first LANGID_WINDOW_SEC seconds.
+The detected probabilities are accumulated as confidence-weighted votes,
+weighted by seconds of speech. The language locks once it holds
+LANGID_MIN_CONFIDENCE of the vote after LANGID_MIN_SPEECH_SEC, or
+unconditionally after LANGID_MAX_SPEECH_SEC. Locks live for
+LANGUAGE_LOCK_TTL_SEC after last use, so a device that reconnects keeps its
+room's language instead of paying for detection again.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+import config
+
+
+class RoomLanguageCache:
+    def __init__(self, ttl_sec=config.LANGUAGE_LOCK_TTL_SEC,
+                 min_speech_sec=config.LANGID_MIN_SPEECH_SEC,
+                 max_speech_sec=config.LANGID_MAX_SPEECH_SEC,
+                 min_confidence=config.LANGID_MIN_CONFIDENCE,
+                 clock=time.monotonic):
+        self.ttl_sec = ttl_sec
+        self.min_speech_sec = min_speech_sec
+        self.max_speech_sec = max_speech_sec
+        self.min_confidence = min_confidence
+        self.clock = clock
+        self._locked: Dict[str, tuple] = {}  # room -> (language, expires_at)
+        self._votes: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._seconds: Dict[str, float] = defaultdict(float)
+
+    def get(self, room_id: str) -> Optional[str]:
+        """Locked language for the room, refreshing its TTL; None if unlocked or expired."""
+        entry = self._locked.get(room_id)
+        if entry is None:
+            return None
+        language, expires_at = entry
+        now = self.clock()
+        if now >= expires_at:
+            del self._locked[room_id]
+            return None
+        self._locked[room_id] = (language, now + self.ttl_sec)
+        return language
+
+    def lock(self, room_id: str, language: str):
+        self._locked[room_id] = (language, self.clock() + self.ttl_sec)
+        self._votes.pop(room_id, None)
+        self._seconds.pop(room_id, None)
+
+    def vote(self, room_id: str, probabilities: Dict[str, float], seconds: float) -> Optional[str]:
+        """Add one detection result; returns the language if this vote locked it."""
+        votes = self._votes[room_id]
+        for language, prob in probabilities.items():
+            votes[language] += prob * seconds
+        self._seconds[room_id] += seconds
+
+        leader = self.leader(room_id)
+        if leader is None:
+            return None
+        total = sum(votes.values())
+        share = votes[leader] / total if total else 0.0
+        heard = self._seconds[room_id]
+        if (heard >= self.min_speech_sec and share >= self.min_confidence) or heard >= self.max_speech_sec:
+            self.lock(room_id, leader)
+            return leader
+        return None
+
+    def leader(self, room_id: str) -> Optional[str]:
+        votes = self._votes.get(room_id)
+        if not votes:
+            return None
+        return max(votes, key=votes.get)
+
+    def forget(self, room_id: str):
+        self._locked.pop(room_id, None)
+        self._votes.pop(room_id, None)
+        self._seconds.pop(room_id, None)
+
+    def stats(self) -> dict:
+        now = self.clock()
+        return {
+            "locked": {room: lang for room, (lang, exp) in self._locked.items() if exp > now},
+            "detecting": {room: round(sec, 2) for room, sec in self._seconds.items()},
+        }
@@ -2,25 +2,40 @@ import asyncio
 import base64
 import json
 import logging
-import tempfile
-import os
 import sys
-import io
+import time
+from datetime import datetime
 from pathlib import Path
+from typing import List
 
 # FIX 1: FORCE UTF-8 ENCODING FOR WINDOWS COMPATIBILITY
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
+# (in place: wrapping the buffers again would close them when the old stream goes)
+for _stream in (sys.stdout, sys.stderr):
+    if hasattr(_stream, "reconfigure"):
+        _stream.reconfigure(encoding="utf-8")
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import numpy as np
-from scipy.io import wavfile
+from fastapi.responses import JSONResponse
 
 import config
 import asr_whisper
+import asr_scheduler
+import asr_workers
+import audio_buffer
+import audio_sessions
+import bulk_jobs
 import database
+import ingest_protocol
+import language_id
 import models
+import pipeline
+import room_state
+import segmenter
+import sentence_aggregator
+import streaming_asr
+import translation_batcher
+import transcript_writer
 import translation_engine
 import utils
 import websocket_manager
@@ -37,27 +52,114 @@ app.add_middleware(
 )
 
 manager = websocket_manager.ConnectionManager()
-asr = asr_whisper.WhisperASR()
+# Room settings, ownership leases and broadcasts shared across workers
+store, broker = room_state.create()
+
+
+def deliver_event(topic, event):
+    """Broker callback: hand an event published on any worker to this worker's subscribers."""
+    manager.publish(event["message"], topic=topic, translations=event.get("translations"))
+
+
+async def broadcast(message: dict, topic="default", translations=None):
+    """Publish to the topic's subscribers on every worker."""
+    await broker.publish(topic, {"message": message, "translations": translations})
+
+
+if config.ASR_WORKERS > 0:
+    # One model per worker process; the scheduler keeps one batch per worker in flight
+    asr = asr_workers.ASRWorkerPool()
+else:
+    # Loaded by the background startup task so /health answers immediately
+    asr = asr_whisper.WhisperASR(load=False)
 translator = translation_engine.Translator()
+scheduler = asr_scheduler.ASRScheduler(asr, concurrency=max(1, config.ASR_WORKERS))
+batcher = translation_batcher.TranslationBatcher(translator)
+jobs = bulk_jobs.BulkJobManager(scheduler, batcher, broadcast)
+
+# Background model loading state, reported by /ready
+MODEL_STATUS = {
+    "asr": {"ready": False, "load_sec": None, "error": None},
+    "translation": {"ready": False, "load_sec": {}, "error": None},
+}
 
-# Language lock per room
-ROOM_LANGUAGE = {}
+# Language lock per room (detection votes + TTL so reconnects keep the lock)
+room_languages = language_id.RoomLanguageCache()
 
-# Target language per room (user selected)
-ROOM_TARGET_LANGUAGE = {}
+# Resumable audio sender sessions (ingest protocol v2)
+sessions = audio_sessions.SessionRegistry()
 
-# Track chunks per room for delayed language locking
-ROOM_CHUNK_COUNT = {}
+# Live pipeline per room; one consumer per stage keeps a room's segments in order
+ROOM_PIPELINES = {}
 
-# Atomic ASR locks per room to prevent CPU overload
-from collections import defaultdict
-ASR_LOCKS = defaultdict(asyncio.Lock)
+# Stage executors and cross-room concurrency limits. ASR runs on the
+# scheduler's threads/workers and translation on the batcher's thread.
+from concurrent.futures import ThreadPoolExecutor
+INGEST_EXECUTOR = ThreadPoolExecutor(config.PIPELINE_INGEST_THREADS, thread_name_prefix="ingest")
+DB_EXECUTOR = ThreadPoolExecutor(config.PIPELINE_DB_THREADS, thread_name_prefix="db")
+ASR_SLOTS = asyncio.Semaphore(config.PIPELINE_ASR_CONCURRENCY)
+TRANSLATE_SLOTS = asyncio.Semaphore(config.PIPELINE_TRANSLATE_CONCURRENCY)
 
 
 @app.on_event("startup")
 async def on_startup():
     database.init_db()
     logger.info("Database initialized")
+    await broker.start(deliver_event)
+    writer.start()
+    asyncio.create_task(_refresh_listener_languages())
+    # Models load in the background; audio queues in the scheduler until ASR is up
+    asyncio.create_task(load_models())
+
+
+async def load_models():
+    """Load and warm up ASR, then the configured translation pairs."""
+    started = time.monotonic()
+    try:
+        if isinstance(asr, asr_workers.ASRWorkerPool):
+            asr.start()
+            while asr.stats()["ready"] == 0:
+                if asr.error:
+                    raise RuntimeError(asr.error)
+                if time.monotonic() - started > config.ASR_WORKER_LOAD_TIMEOUT_SEC:
+                    raise RuntimeError(f"no ASR worker ready after {config.ASR_WORKER_LOAD_TIMEOUT_SEC:.0f}s: "
+                                       f"{asr.stats()['errors']}")
+                await asyncio.sleep(0.5)
+        else:
+            await utils.run_blocking(asr._load)
+            await utils.run_blocking(asr.warmup)
+        MODEL_STATUS["asr"].update(ready=True, load_sec=round(time.monotonic() - started, 2))
+        scheduler.start()
+        logger.info(f"ASR ready in {MODEL_STATUS['asr']['load_sec']}s")
+        jobs.resume_all()
+    except Exception as e:
+        MODEL_STATUS["asr"]["error"] = str(e)
+        logger.exception("ASR model load failed")
+        return
+
+    try:
+        timings = await utils.run_blocking(translator.preload, config.TRANSLATION_PRELOAD_PAIRS)
+        MODEL_STATUS["translation"].update(ready=True, load_sec=timings)
+    except Exception as e:
+        MODEL_STATUS["translation"]["error"] = str(e)
+        logger.exception("Translation preload failed")
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Live rooms first, while ASR, translation and the writer still run: their
+    # buffered audio goes through every stage and its rows reach the writer
+    await drain_rooms()
+    await jobs.stop()
+    await scheduler.stop()
+    await batcher.stop()
+    if isinstance(asr, asr_workers.ASRWorkerPool):
+        asr.stop()
+    INGEST_EXECUTOR.shutdown(wait=False)
+    await writer.stop()  # queued transcripts are written before exit
+    DB_EXECUTOR.shutdown(wait=True)
+    await broker.stop()
+    await store.close()
 
 
 @app.get("/health")
@@ -65,6 +167,34 @@ async def health():
     return {"status": "ok", "time": utils.timestamp_now()}
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once ASR is loaded and warmed up, 503 before."""
+    status = dict(MODEL_STATUS)
+    if isinstance(asr, asr_workers.ASRWorkerPool):
+        status["asr_workers"] = asr.stats()
+    code = 200 if MODEL_STATUS["asr"]["ready"] else 503
+    return JSONResponse(status_code=code, content={"ready": code == 200, "models": status})
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "time": utils.timestamp_now(),
+        "asr": scheduler.stats(),
+        "translation": batcher.stats(),
+        "translation_cache": translator.cache.stats() if translator.cache is not None else None,
+        "translation_models": translator.models.stats(),
+        "asr_workers": asr.stats() if isinstance(asr, asr_workers.ASRWorkerPool) else None,
+        "languages": room_languages.stats(),
+        "pipelines": {room: p.stats() for room, p in ROOM_PIPELINES.items()},
+        "persistence": writer.stats(),
+        "websockets": manager.stats(),
+        "audio_sessions": sessions.stats(),
+        "cluster": dict(broker.stats(), worker=config.WORKER_ID, rooms_owned=sorted(ROOM_PIPELINES)),
+    }
+
+
 @app.get("/transcripts", response_model=models.TranscriptList)
 async def list_transcripts(room_id: str = config.ROOM_ID, limit: int = 50):
     with database.session_scope() as session:
@@ -80,132 +210,619 @@ async def list_transcripts(room_id: str = config.ROOM_ID, limit: int = 50):
 
 @app.post("/transcripts", response_model=models.TranscriptRead)
 async def create_transcript(payload: models.TranscriptCreate):
-    with database.session_scope() as session:
-        obj = models.Transcript(
-            room_id=payload.room_id,
-            speaker=payload.speaker,
-            text=payload.text,
-            translation=payload.translation,
-            detected_language=payload.detected_language,
-        )
-        session.add(obj)
-        session.flush()
-        result = serialize_transcript(obj)
-        await manager.broadcast({"type": "transcript", "payload": result}, topic=payload.room_id)
+    result = (await writer.write([(payload, None)], wait=True))[0]  # the response carries the row id
+    message = {"type": "transcript", "payload": result}
+    await broadcast(message, topic=payload.room_id)
     return result
 
 
-def serialize_transcript(row) -> dict:
-    data=models.TranscriptRead.from_orm(row).dict()
-    if "created_at" in data and data["created_at"] is not None:
-        data["created_at"] = data["created_at"].isoformat()
-    return data
-    # return models.TranscriptRead.from_orm(row).dict()
-
+@app.post("/jobs", response_model=models.JobRead)
+async def create_job(payload: models.JobCreate):
+    """Submit an offline transcription job for a server-side file or directory."""
+    try:
+        job = jobs.submit(payload.path, room_id=payload.room_id, language=payload.language,
+                          target_language=payload.target_language)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
 
-async def process_audio_chunk(room_id: str, pcm_bytes: bytes):
-    """Process audio chunk: ASR -> Translation -> Save -> Broadcast."""
-    # FIX 2: Atomic ASR locking - guarantees only one ASR job per room
-    async with ASR_LOCKS[room_id]:
-        await _process_audio_chunk_internal(room_id, pcm_bytes)
 
+@app.get("/jobs", response_model=List[models.JobRead])
+async def list_jobs():
+    return [job.to_dict() for job in jobs.list()]
 
-async def _process_audio_chunk_internal(room_id: str, pcm_bytes: bytes):
-    """Internal ASR processing with proper resource management."""
-    temp_file_path = None
-    try:
-        # Convert PCM bytes to numpy array
-        pcm_array = np.frombuffer(pcm_bytes, dtype=np.int16)
 
-        # Create temporary WAV file
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-            temp_file_path = temp_file.name
-            # Write WAV file (scipy expects sample rate and data)
-            wavfile.write(temp_file_path, config.SAMPLE_RATE, pcm_array)
+@app.get("/jobs/{job_id}", response_model=models.JobRead)
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
-        logger.info(f"Created temp WAV file: {temp_file_path}, size: {len(pcm_bytes)} bytes")
 
-        # FIX 2: MOVE WHISPER OFF EVENT LOOP TO PREVENT WS TIMEOUT
-        # STEP A2: Language detection and locking (delayed for better accuracy)
-        loop = asyncio.get_running_loop()
+@app.delete("/jobs/{job_id}", response_model=models.JobRead)
+async def cancel_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    await jobs.cancel(job_id)
+    return job.to_dict()
 
-        # Track chunk count for this room
-        chunk_count = ROOM_CHUNK_COUNT.get(room_id, 0) + 1
-        ROOM_CHUNK_COUNT[room_id] = chunk_count
 
-        if room_id not in ROOM_LANGUAGE:
-            segments, info = await loop.run_in_executor(
-                None,
-                lambda: asr._transcribe_sync(temp_file_path)
-            )
-            # Lock language after 2-3 chunks for better accuracy
-            if info and info.language and chunk_count >= 2:
-                ROOM_LANGUAGE[room_id] = info.language
-                logger.info(f"🔒 Locked language for {room_id} after {chunk_count} chunks: {info.language}")
-        else:
-            segments, info = await loop.run_in_executor(
-                None,
-                lambda: asr._transcribe_sync(temp_file_path, language=ROOM_LANGUAGE[room_id])
-            )
+@app.get("/jobs/{job_id}/transcripts", response_model=models.TranscriptList)
+async def job_transcripts(job_id: str, offset: int = 0, limit: int = 500):
+    """Results written so far, oldest first (poll with a growing offset)."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    with database.session_scope() as session:
+        query = (
+            session.query(models.Transcript)
+            .filter(models.Transcript.room_id == job.room_id)
+            .order_by(models.Transcript.id.asc())
+            .offset(offset)
+            .limit(limit)
+        )
+        items = [serialize_transcript(row) for row in query.all()]
+    return {"items": items}
 
-        logger.info(f"ASR returned {len(segments)} segments")
 
-        # Always process segments - WebSocket itself is a client
-        for seg in segments:
-            text = seg["text"]
-            logger.info(f"Segment text: (length={len(text)})")  # Avoid logging raw Unicode
-            if text.strip():
-                try:
-                    # Translate with detected language (safe access)
-                    source_lang = getattr(info, 'language', 'en') if info else 'en'
-                    target_lang = ROOM_TARGET_LANGUAGE.get(room_id, "en")
-                    translation = translator.translate(text, source_lang=source_lang, target_lang=target_lang)
-                    logger.info(f"Translation {source_lang}→{target_lang}: (length={len(translation)})")  # Avoid logging raw Unicode
-                except Exception as e:
-                    logger.error(f"Translation failed: {e}")
-                    translation = ""  # Continue without translation
+@app.websocket("/ws/jobs/{job_id}")
+async def job_websocket(ws: WebSocket, job_id: str):
+    """Live job progress and result segments as they are written."""
+    await manager.subscribe(ws, topic=f"job:{job_id}")
+    try:
+        while True:
+            await ws.receive_text()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await manager.disconnect(ws, topic=f"job:{job_id}")
 
-                try:
-                    # Create transcript with detected language
-                    payload = models.TranscriptCreate(
-                        room_id=room_id,
-                        speaker="speaker_auto",
-                        text=text,
-                        translation=translation,
-                        detected_language=source_lang,  # Include detected language
-                    )
-                    await create_transcript(payload)
-                    logger.info(f"Created transcript for room {room_id}: (length={len(text)}), lang: {source_lang}")
-                except Exception as e:
-                    logger.error(f"Failed to create transcript: {e}")
 
-    except Exception as e:
-        logger.error(f"ASR processing failed: {e}")
-        logger.error(f"Error details: {type(e).__name__}: {e}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        # Don't re-raise - we don't want to crash the websocket
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
+def serialize_transcript(row) -> dict:
+    """Plain dict of a Transcript row, built once per event (no pydantic round trip)."""
+    return {
+        "id": row.id,
+        "room_id": row.room_id,
+        "speaker": row.speaker,
+        "text": row.text,
+        "translation": row.translation,
+        "detected_language": row.detected_language,
+        "asr_tier": None,
+        "start": None,
+        "end": None,
+        "created_at": row.created_at.isoformat() if row.created_at is not None else None,
+    }
+
+
+def save_transcripts(entries) -> list:
+    """
+    Insert (payload, created_at) entries in one transaction (DB thread);
+    returns them serialized. created_at None means now.
+    """
+    results = []
+    with database.session_scope() as session:
+        rows = [
+            models.Transcript(
+                room_id=payload.room_id,
+                speaker=payload.speaker,
+                text=payload.text,
+                translation=payload.translation,
+                detected_language=payload.detected_language,
+                created_at=created_at or datetime.utcnow(),
+            )
+            for payload, created_at in entries
+        ]
+        session.add_all(rows)
+        session.flush()
+        for (payload, _), row in zip(entries, rows):
+            result = serialize_transcript(row)
+            result.update(asr_tier=payload.asr_tier, start=payload.start, end=payload.end)
+            results.append(result)
+    return results
+
+
+# Live transcript rows from every room, written behind the broadcast in grouped transactions
+writer = transcript_writer.TranscriptWriter(save_transcripts, DB_EXECUTOR)
+
+
+async def _resolve_language(room_id: str, audio):
+    """Locked room language, or run a detection-only vote on the chunk's first seconds."""
+    language = room_languages.get(room_id)
+    if language:
+        return language
+    probe = audio[: int(config.SAMPLE_RATE * config.LANGID_WINDOW_SEC)]
+    probabilities = await scheduler.detect_language(room_id, probe)
+    locked = room_languages.vote(room_id, probabilities, len(probe) / config.SAMPLE_RATE)
+    if locked:
+        logger.info(f"🔒 Locked language for {room_id}: {locked}")
+        return locked
+    return room_languages.leader(room_id)
+
+
+def _segments(segments, language, tier, offset=0.0) -> list:
+    """Stage items for ASR segments; start/end become absolute stream seconds."""
+    return [
+        {"text": seg["text"], "language": language, "tier": tier,
+         "start": round(offset + seg["start"], 2), "end": round(offset + seg["end"], 2)}
+        for seg in segments if seg["text"].strip()
+    ]
+
+
+def _words_segment(words) -> dict:
+    return {"text": streaming_asr.words_to_text(words), "start": words[0][0], "end": words[-1][1]}
+
+
+# ---- Pipeline stages: ingest -> asr -> aggregate -> translate -> persist -> broadcast ----
+
+async def ingest_stage(room, item):
+    """VAD / fixed-size chunking on the ingest threads; yields ASR work items."""
+    kind, pcm_bytes, received_at, tag = item
+    room.stages["ingest"].queue.observe(received_at)
+    loop = asyncio.get_running_loop()
+    work = await loop.run_in_executor(INGEST_EXECUTOR, _chunk_audio, room.state, kind, pcm_bytes)
+    if tag is not None:
+        session, seq = tag
+        session.commit(seq)  # in the ring buffer now; safe to ack
+    return work
+
+
+def _chunk_audio(state, kind: str, pcm_bytes: bytes) -> list:
+    """
+    Write received PCM into the room's ring buffer and cut ASR work items as
+    absolute sample spans of it (ASR_MODE and CHUNKING pick the cuts).
+    """
+    if "ring" not in state:
+        state["ring"] = audio_buffer.AudioRingBuffer()
+        state["cursor"] = 0  # fixed mode: first sample not yet handed to the ASR
+        state["stream_start"] = None  # streaming mode: start of the open stream
+        state["seg"] = segmenter.SpeechSegmenter() if config.CHUNKING == "vad" else None
+    ring, seg = state["ring"], state["seg"]
+    if pcm_bytes:
+        ring.write(pcm_bytes)
+    work = []
+
+    if config.ASR_MODE == "streaming":
+        endpoint = False
+        if seg is not None and pcm_bytes:
+            _, endpoint = seg.feed_speech(pcm_bytes)
+        ended = endpoint or kind == "flush"
+        if state["stream_start"] is None and (seg is None or seg.in_speech or endpoint):
+            # A new stream never reaches back into audio an earlier one finished
+            if seg is not None:
+                state["cursor"] = max(seg.utterance_start, state["cursor"])
+            state["stream_start"] = state["cursor"]
+        if state["stream_start"] is not None:
+            step = int(config.SAMPLE_RATE * config.STREAM_STEP_SEC)
+            while ring.end - state["cursor"] >= step:
+                state["cursor"] += step
+                work.append(("stream", (state["stream_start"], state["cursor"])))
+            if ended:
+                work.append(("finish", (state["stream_start"], ring.end)))
+                state["stream_start"], state["cursor"] = None, ring.end
+    elif seg is not None:
+        spans = seg.flush_spans() if kind == "flush" else seg.feed_spans(pcm_bytes)
+        work.extend(("chunk", (start, start + samples)) for start, samples in spans)
+    else:
+        required = int(config.SAMPLE_RATE * config.WHISPER_CHUNK_SEC)
+        while ring.end - state["cursor"] >= required:
+            work.append(("chunk", (state["cursor"], state["cursor"] + required)))
+            state["cursor"] += required
+    if kind == "flush":
+        work.append(("end", None))  # releases text held by the sentence aggregator
+    return work
+
+
+async def asr_stage(room, item):
+    """One ASR pass (batched across rooms by the scheduler); yields the chunk's segments."""
+    kind, span = item
+    if kind == "end":
+        return ["end"]
+    if kind == "chunk":
+        segments = await transcribe_chunk(room, span)
+    elif kind == "stream":
+        segments = await transcribe_stream_step(room, span)
+    else:
+        segments = await finish_audio_stream(room, span)
+    return [segments] if segments else []
+
+
+async def transcribe_chunk(room, span) -> list:
+    """Chunked mode: Whisper reads a view of the room's ring buffer (no copy)."""
+    start, end = span
+    audio = room.state["ring"].view(start, end)
+    logger.info(f"Audio chunk for {room.room_id}: {(end - start) / config.SAMPLE_RATE:.2f}s at sample {start}")
+
+    # Language is identified up front, so the chunk is decoded once
+    language = await _resolve_language(room.room_id, audio)
+    segments, info = await scheduler.transcribe(room.room_id, audio, language=language)
+    if not room.state["ring"].holds(start):
+        logger.warning(f"Discarding ASR result for {room.room_id}: ring wrapped over sample {start} while queued")
+        return []
+    logger.info(f"ASR returned {len(segments)} segments")
+
+    source_lang = getattr(info, 'language', 'en') if info else 'en'
+    return _segments(segments, source_lang, getattr(info, 'tier', None), start / config.SAMPLE_RATE)
+
+
+async def transcribe_stream_step(room, span) -> list:
+    """Streaming mode: grow the room window, emit partial and final hypotheses."""
+    stream = room.state.get("stream")
+    if stream is None:
+        stream = room.state["stream"] = streaming_asr.StreamingTranscriber(room.state["ring"], span[0])
+    stream.advance(span[1])
+    if not stream.ready():
+        return []
+
+    since = stream.base
+    audio, prompt = stream.window()
+    language = await _resolve_language(room.room_id, audio[-stream.step_samples:])
+    segments, info = await scheduler.transcribe(
+        room.room_id, audio, language=language, word_timestamps=True, initial_prompt=prompt
+    )
+    if not room.state["ring"].holds(since):
+        # The window was overwritten while queued; restart the stream at the next span
+        logger.warning(f"Discarding ASR result for {room.room_id}: ring wrapped over sample {since} while queued")
+        room.state.pop("stream", None)
+        return []
+    committed, partial = stream.update(segments)
+
+    source_lang = getattr(info, 'language', 'en') if info else 'en'
+    tier = getattr(info, 'tier', None)
+    # Partials skip translation and persistence
+    await room.put({
+        "type": "partial",
+        "payload": {
+            "room_id": room.room_id,
+            "text": streaming_asr.words_to_text(partial),
+            "detected_language": source_lang,
+            "asr_tier": tier,
+            "start": partial[0][0] if partial else None,
+            "end": partial[-1][1] if partial else None,
+        },
+    }, stage="broadcast")
+    if not committed:
+        return []
+    return _segments([_words_segment(committed)], source_lang, tier)
+
+
+async def finish_audio_stream(room, span) -> list:
+    """Decode any undecoded audio and commit the room's tail (speech endpoint or disconnect)."""
+    stream = room.state.pop("stream", None)
+    if stream is None:
+        if span[1] - span[0] < int(config.SAMPLE_RATE * config.STREAM_STEP_SEC):
+            return []
+        # Utterance shorter than one step never opened a stream
+        stream = streaming_asr.StreamingTranscriber(room.state["ring"], span[0])
+    stream.advance(span[1])
+    language = room_languages.get(room.room_id) or room_languages.leader(room.room_id) or "en"
+    if stream.pending:
+        since = stream.base
+        audio, prompt = stream.window()
+        segments, info = await scheduler.transcribe(
+            room.room_id, audio, language=language,
+            word_timestamps=True, initial_prompt=prompt
+        )
+        if not room.state["ring"].holds(since):
+            logger.warning(f"Discarding ASR result for {room.room_id}: ring wrapped over sample {since} while queued")
+            return []
+        language = getattr(info, 'language', None) or language
+        stream.update(segments)
+    tail = stream.finish()
+    if not tail:
+        return []
+    return _segments([_words_segment(tail)], language, None)
+
+
+async def aggregate_stage(room, item):
+    """
+    Send each fragment as a source-language caption right away, and pass
+    only whole sentences on to translation (see sentence_aggregator).
+    """
+    if not config.SENTENCE_AGGREGATION:
+        return [item] if item not in ("tick", "end") else []
+    aggregator = room.state.get("aggregator")
+    if aggregator is None:
+        aggregator = room.state["aggregator"] = sentence_aggregator.SentenceAggregator()
+
+    if item == "tick":
+        sentences = aggregator.expire()
+    elif item == "end":
+        sentences = aggregator.flush()
+    else:
+        for seg in item:
+            await room.put({
+                "type": "caption",
+                "payload": {
+                    "room_id": room.room_id,
+                    "text": seg["text"].strip(),
+                    "detected_language": seg["language"],
+                    "asr_tier": seg["tier"],
+                    "start": seg["start"],
+                    "end": seg["end"],
+                },
+            }, stage="broadcast")
+        sentences = aggregator.add(item)
+
+    # One timer per room, re-armed for the held text's pause/latency deadline
+    timer = room.state.pop("aggregate_timer", None)
+    if timer is not None:
+        timer.cancel()
+    deadline = aggregator.deadline()
+    if deadline is not None:
+        loop = asyncio.get_running_loop()
+        room.state["aggregate_timer"] = loop.call_later(
+            max(0.0, deadline - time.monotonic()),
+            lambda: asyncio.ensure_future(room.put("tick", stage="aggregate")),
+        )
+    return [sentences] if sentences else []
+
+
+async def translate_stage(room, segments):
+    """
+    Translate a chunk's segments once per distinct target language (the room
+    default plus every listener's), all in parallel through the batcher.
+    """
+    default_lang = await store.get(room.room_id, "target_language", "en")
+    targets = sorted(await listener_languages(room.room_id) | {default_lang})
+    work = [(seg, target) for seg in segments for target in targets]
+    translations = await asyncio.gather(*(
+        batcher.translate(seg["text"], seg["language"], target) for seg, target in work
+    ), return_exceptions=True)
+    for seg in segments:
+        seg["translations"] = {}
+    for (seg, target), translation in zip(work, translations):
+        if isinstance(translation, Exception):
+            logger.error(f"Translation failed: {translation}")
+            translation = ""  # Continue without translation
+        seg["translations"][target] = translation
+    for seg in segments:
+        seg["translation"] = seg["translations"][default_lang]
+    return [segments]
+
+
+async def persist_stage(room, segments):
+    """Queue a chunk's segments for the transcript writer; yields the broadcast messages."""
+    payloads = [
+        models.TranscriptCreate(
+            room_id=room.room_id,
+            speaker="speaker_auto",
+            text=seg["text"],
+            translation=seg["translation"],
+            detected_language=seg["language"],
+            asr_tier=seg["tier"],
+            start=seg["start"],
+            end=seg["end"],
+        )
+        for seg in segments
+    ]
+    created_at = datetime.utcnow()
+    results = await writer.write([(payload, created_at) for payload in payloads])
+    if results is None:
+        # Write-behind: broadcast now; the row id is only known after the flush
+        results = [dict(payload.dict(), id=None, created_at=created_at.isoformat()) for payload in payloads]
+    return [
+        {"type": "transcript", "payload": result, "translations": seg["translations"]}
+        for seg, result in zip(segments, results)
+    ]
+
+
+async def broadcast_stage(room, message):
+    """Audio source gets the room default; each listener (on any worker) its own language."""
+    translations = message.pop("translations", None)
+    await broadcast(message, topic=room.room_id, translations=translations)
+    return ()
+
+
+def open_pipeline(room_id: str):
+    """Pipeline for an audio connection; connections to the same room share it."""
+    room = ROOM_PIPELINES.get(room_id)
+    if room is None:
+        room = ROOM_PIPELINES[room_id] = pipeline.RoomPipeline(room_id, [
+            ("ingest", ingest_stage, None),
+            ("asr", asr_stage, ASR_SLOTS),
+            ("aggregate", aggregate_stage, None),
+            ("translate", translate_stage, TRANSLATE_SLOTS),
+            ("persist", persist_stage, None),  # write-behind queue shared by all rooms
+            ("broadcast", broadcast_stage, None),
+        ])
+        room.state["sources"] = 0
+        room.state["senders"] = set()  # audio WebSockets on this worker
+        room.state["lease"] = asyncio.create_task(_hold_lease(room_id))
+    room.state["sources"] += 1
+    return room
+
+
+async def close_pipeline(room_id: str):
+    """Last connection gone: push the utterance / stream tail through, then drain."""
+    room = ROOM_PIPELINES.get(room_id)
+    if room is None:
+        return
+    room.state["sources"] -= 1
+    if room.state["sources"] > 0:
+        return
+    del ROOM_PIPELINES[room_id]
+    room.state["lease"].cancel()
+    await room.put(("flush", b"", time.monotonic(), None))
+    await room.close()
+    if room_id not in ROOM_PIPELINES:  # not reopened while draining
+        await store.release(room_id, config.WORKER_ID)
+
+
+async def drain_rooms():
+    """Shutdown: end every audio session (no grace period) and drain every room's pipeline."""
+    for session in list(sessions.sessions.values()):
+        sessions.close(session)
+    for room in ROOM_PIPELINES.values():
+        room.state["sources"] = 1  # senders still connected are going away with the server
+    await asyncio.gather(*(close_pipeline(room_id) for room_id in list(ROOM_PIPELINES)))
+
+
+async def _hold_lease(room_id: str):
+    """Renew this worker's ownership of a room while its pipeline runs."""
+    while True:
+        await asyncio.sleep(config.ROOM_LEASE_SEC / 3)
+        try:
+            owner = await store.claim(room_id, config.WORKER_ID, config.WORKER_URL, config.ROOM_LEASE_SEC)
+        except Exception:
+            logger.exception(f"Lease renewal failed for room {room_id}")
+            continue
+        if owner["worker"] != config.WORKER_ID:
+            logger.error(f"Room {room_id} is now owned by {owner['worker']}; handing its audio over")
+            _hand_over(room_id, owner)
+            return
+
+
+def _hand_over(room_id: str, owner: dict):
+    """
+    Another worker holds the room's lease: redirect this worker's senders
+    there and let go of the local pipeline (sessions end rather than detach).
+    """
+    room = ROOM_PIPELINES.get(room_id)
+    if room is None:
+        return
+    room.state["moved"] = owner
+    for ws in list(room.state["senders"]):
+        asyncio.create_task(_redirect(ws, owner, room_id, accepted=True))
+    for session in [s for s in sessions.sessions.values() if s.room_id == room_id and s.owner is None]:
+        sessions.close(session)
+        asyncio.create_task(close_pipeline(room_id))  # the reference held over the grace period
+
+
+async def listener_languages(room_id: str) -> set:
+    """Target languages of the room's listeners on every worker."""
+    shared = await store.scan(room_id, "listeners:")
+    now = time.time()
+    live = [entry["languages"] for entry in shared.values() if entry.get("expires", 0) > now]
+    return set(manager.target_languages(room_id)).union(*live)
+
+
+async def share_listener_languages(room_id: str):
+    """
+    Publish this worker's listener languages for the room's owner to
+    translate into. Entries expire after ROOM_LEASE_SEC unless refreshed, so
+    a worker that dies does not leave its languages behind.
+    """
+    languages = sorted(manager.target_languages(room_id))
+    key = f"listeners:{config.WORKER_ID}"
+    if languages:
+        await store.set(room_id, key, {"languages": languages, "expires": time.time() + config.ROOM_LEASE_SEC})
+    else:
+        await store.delete(room_id, key)
+
+
+async def _refresh_listener_languages():
+    """Heartbeat for the listener languages of every room with listeners here."""
+    while True:
+        await asyncio.sleep(config.ROOM_LEASE_SEC / 3)
+        for room_id in list(manager.topics):
             try:
-                os.unlink(temp_file_path)
-                logger.info(f"Cleaned up temp file: {temp_file_path}")
-            except Exception as e:
-                logger.error(f"Failed to clean up temp file {temp_file_path}: {e}")
-        # ASR lock automatically released when exiting async with block
+                if manager.target_languages(room_id):
+                    await share_listener_languages(room_id)
+            except Exception:
+                logger.exception(f"Listener language refresh failed for room {room_id}")
+
+
+@app.websocket("/ws/transcripts/{room_id}")
+async def transcript_websocket(ws: WebSocket, room_id: str, lang: str = "en",
+                               encoding: str = "json", batch: bool = False):
+    """
+    Listener: final transcripts translated into `lang` (plus partials).
+    Send {"type": "config", "target_language": "ta"} to switch language.
+    `encoding` is json (text frames), orjson or msgpack (binary frames);
+    binary clients and batch=true get coalesced {"type": "batch"} frames.
+    """
+    await manager.subscribe(ws, topic=room_id, language=lang, encoding=encoding, batch=batch)
+    await share_listener_languages(room_id)
+    try:
+        while True:
+            try:
+                data = json.loads(await ws.receive_text())
+            except ValueError:
+                continue
+            if data.get("type") == "config" and data.get("target_language"):
+                manager.set_language(ws, room_id, data["target_language"])
+                await share_listener_languages(room_id)
+                logger.info(f"Listener in {room_id} switched to {data['target_language']}")
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await manager.unsubscribe(ws, topic=room_id)
+        await share_listener_languages(room_id)
+
+
+async def _start_session(ws: WebSocket, room_id: str, token, current):
+    """Resume the session for `token` (or open a new one) with `ws` as its sender."""
+    session = sessions.resume(token, room_id) if token else None
+    resumed = session is not None
+    if session is None:
+        session = sessions.open(room_id)
+    if current is not None and current is not session:
+        sessions.close(current)
+    # Taking over a session still owned by a half-open socket is fine: that
+    # connection sees it lost ownership and releases its own reference
+    if sessions.attach(session, ws, lambda message: manager.notify(ws, room_id, message)):
+        await close_pipeline(room_id)  # the reference held over the grace period
+    return session, resumed
+
+
+async def _redirect(ws: WebSocket, owner: dict, room_id: str, accepted=False):
+    """Send an audio client to the worker that owns the room's pipeline."""
+    url = f"{owner['url']}/ws/audio/{room_id}" + (f"?{ws.url.query}" if ws.url.query else "")
+    logger.info(f"Redirecting audio for {room_id} to {owner['worker']} ({url})")
+    try:
+        if not accepted:
+            await ws.accept()
+        await ws.send_text(json.dumps({"type": "redirect", "url": url}))
+        await ws.close(code=4307)
+    except Exception:
+        pass
 
 
 @app.websocket("/ws/audio/{room_id}")
-async def websocket_endpoint(ws: WebSocket, room_id: str):
+async def websocket_endpoint(ws: WebSocket, room_id: str, encoding: str = "json", batch: bool = False):
+    # Room affinity: the room's audio must reach the worker holding its pipeline
     try:
-        await manager.connect(ws, topic=room_id)
+        owner = await store.claim(room_id, config.WORKER_ID, config.WORKER_URL, config.ROOM_LEASE_SEC)
+    except Exception:
+        logger.exception(f"Cannot claim room {room_id}, refusing its audio")
+        try:
+            await ws.close(code=1013)  # try again later
+        except Exception:
+            pass
+        return
+    if owner["worker"] != config.WORKER_ID:
+        await _redirect(ws, owner, room_id)
+        return
+
+    try:
+        await manager.connect(ws, topic=room_id, encoding=encoding, batch=batch)
     except Exception as e:
         logger.error(f"Failed to accept WebSocket: {e}")
         return
 
-    buffer = bytearray()
-    logger.warning(">>> USING FINAL BINARY-ONLY WS LOOP")
+    room = open_pipeline(room_id)  # a detached session keeps this reference past disconnect
+    room.state["senders"].add(ws)
+    decoder = ingest_protocol.IngestDecoder()
+    session = None
+    said_bye = False
+    throttled = False
+
+    def offer(seq, pcm):
+        # Never waits on the ASR; INGEST_OVERFLOW handles a full queue
+        nonlocal throttled
+        tag = None
+        if seq is not None and session is not None:
+            if not session.accept(seq):
+                return  # resent after a reconnect, already received
+            tag = (session, seq)
+        if not pcm:
+            return
+        slow_down = room.offer_audio(pcm, tag)
+        if slow_down != throttled:
+            throttled = slow_down
+            manager.notify(ws, room_id, {"type": "flow", "action": "slow_down" if slow_down else "resume"})
 
     try:
         while True:
@@ -223,34 +840,52 @@ async def websocket_endpoint(ws: WebSocket, room_id: str):
                 logger.exception("Fatal WebSocket error")
                 break
 
-            # 🔴 HANDLE RAW AUDIO ONLY
-            if "bytes" in message and message["bytes"]:
-                buffer.extend(message["bytes"])
+            if message.get("type") == "websocket.disconnect":
+                break
 
-                required = int(config.SAMPLE_RATE * config.WHISPER_CHUNK_SEC) * 2
-                if len(buffer) >= required:
-                    chunk = bytes(buffer[:required])
-                    del buffer[:required]
-                    await process_audio_chunk(room_id, chunk)
+            # 🔴 BINARY AUDIO (pcm16, or one Opus packet after an opus handshake)
+            if message.get("bytes"):
+                offer(*decoder.decode_binary(message["bytes"]))
 
-            # 🔵 HANDLE CONFIG MESSAGES (text frames)
-            elif "text" in message:
+            # 🔵 TEXT FRAMES: handshake, legacy base64 audio, config
+            elif message.get("text"):
                 try:
                     data = json.loads(message["text"])
-                    if data.get("type") == "config":
-                        ROOM_TARGET_LANGUAGE[room_id] = data["target_language"]
-                        logger.info(f"🎯 Target language set for {room_id}: {data['target_language']}")
-                    else:
-                        logger.debug("Ignoring unknown text WS frame")
-                except Exception:
+                except ValueError:
                     logger.debug("Ignoring malformed text WS frame")
+                    continue
+                kind = data.get("type") if isinstance(data, dict) else None
+                if kind == "audio":
+                    offer(*decoder.decode_text(data))
+                elif kind == "hello":
+                    reply = decoder.hello(data)
+                    if reply["type"] == "welcome" and decoder.version >= 2:
+                        session, resumed = await _start_session(ws, room_id, data.get("session"), session)
+                        reply.update(session=session.token, ack=session.committed_seq, resumed=resumed)
+                    manager.notify(ws, room_id, reply)
+                    logger.info(f"Ingest handshake for {room_id}: {reply}")
+                elif kind == "bye":
+                    said_bye = True  # deliberate end: no grace period
+                    break
+                elif kind == "config" and data.get("target_language"):
+                    await store.set(room_id, "target_language", data["target_language"])
+                    logger.info(f"🎯 Target language set for {room_id}: {data['target_language']}")
+                else:
+                    logger.debug("Ignoring unknown text WS frame")
 
     finally:
         await manager.disconnect(ws, topic=room_id)
-        # Cleanup language lock and chunk count on disconnect
-        ROOM_LANGUAGE.pop(room_id, None)
-        ROOM_CHUNK_COUNT.pop(room_id, None)
-        logger.info(f"🧹 Cleared language lock and chunk count for {room_id}")
+        room.state["senders"].discard(ws)
+        moved = "moved" in room.state  # redirected to the room's new owner
+        if session is not None and session.owner is ws and not said_bye and not moved:
+            # Dropped: the session keeps the pipeline until it resumes or expires
+            sessions.detach(session, lambda: close_pipeline(room_id))
+        else:
+            if session is not None and session.owner is ws:
+                sessions.close(session)
+            await close_pipeline(room_id)
+        logger.info(f"Ingest closed for {room_id}: {decoder.stats()}")
+        # Language lock is kept (with TTL) so a reconnecting device skips detection
         try:
             await ws.close()
         except:
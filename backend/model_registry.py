@@ -0,0 +1,148 @@
+"""Memory-budgeted registry for translation models.
+
+Loaded models are kept within TRANSLATION_MEMORY_MB. Loading past the budget
+evicts the least recently used models first, and models idle for longer than
+TRANSLATION_IDLE_EVICT_SEC are dropped too. Pinned models (the preload pairs)
+are never evicted. A failed load is remembered for TRANSLATION_LOAD_RETRY_SEC,
+so a missing pair does not hit from_pretrained() on every segment.
+"""
+
+from __future__ import annotations
+
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+logger = logging.getLogger("model_registry")
+
+
+class ModelUnavailable(RuntimeError):
+    """Raised while a model's last load failure is still negative-cached."""
+
+
+def estimate_bytes(value) -> int:
+    """Parameter and buffer bytes of a torch module (or a tuple holding one)."""
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_bytes(v) for v in value)
+    total = 0
+    for attr in ("parameters", "buffers"):
+        tensors = getattr(value, attr, None)
+        if callable(tensors):
+            total += sum(t.numel() * t.element_size() for t in tensors())
+    return total
+
+
+class _Entry:
+    def __init__(self, value, size, load_sec, now):
+        self.value = value
+        self.size = size
+        self.load_sec = load_sec
+        self.last_used = now
+        self.uses = 0
+
+
+class ModelRegistry:
+    def __init__(self, budget_mb=config.TRANSLATION_MEMORY_MB,
+                 idle_sec=config.TRANSLATION_IDLE_EVICT_SEC,
+                 retry_sec=config.TRANSLATION_LOAD_RETRY_SEC,
+                 sizer=estimate_bytes, clock=time.monotonic):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.idle_sec = idle_sec
+        self.retry_sec = retry_sec
+        self.sizer = sizer
+        self.clock = clock
+        self.entries = OrderedDict()  # name -> _Entry, least recently used first
+        self.pinned = set()
+        self.failures = {}  # name -> (failed_at, error)
+        self.lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def pin(self, name):
+        self.pinned.add(name)
+
+    def get(self, name, loader, size=None):
+        """
+        Return the model for `name`, calling loader() to load it on a miss.
+        `size` optionally returns its bytes when the sizer cannot see them.
+        """
+        with self.lock:
+            now = self.clock()
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = self._load(name, loader, size, now)
+            self.entries.move_to_end(name)
+            entry.last_used = now
+            entry.uses += 1
+            self._evict_idle(now)
+            return entry.value
+
+    def _load(self, name, loader, size, now):
+        failure = self.failures.get(name)
+        if failure is not None and now - failure[0] < self.retry_sec:
+            raise ModelUnavailable(f"{name} failed to load {now - failure[0]:.0f}s ago: {failure[1]}")
+        started = time.monotonic()
+        try:
+            value = loader()
+        except Exception as e:
+            self.failures[name] = (now, str(e))
+            raise
+        self.failures.pop(name, None)
+        size = size() if size is not None else self.sizer(value)
+        self._make_room(size, keep=name)
+        entry = self.entries[name] = _Entry(value, size, time.monotonic() - started, now)
+        self.loads += 1
+        logger.info(f"Loaded {name} ({size / 2**20:.0f} MB, {entry.load_sec:.1f}s), "
+                    f"{self.used() / 2**20:.0f}/{self.budget / 2**20:.0f} MB in use")
+        return entry
+
+    def used(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    def _make_room(self, size, keep):
+        for name in list(self.entries):
+            if self.used() + size <= self.budget:
+                return
+            if name not in self.pinned and name != keep:
+                self._evict(name, "over budget")
+        if self.used() + size > self.budget:
+            logger.warning(f"Translation models exceed TRANSLATION_MEMORY_MB after loading {keep}")
+
+    def _evict_idle(self, now):
+        for name, entry in list(self.entries.items()):
+            if name not in self.pinned and now - entry.last_used > self.idle_sec:
+                self._evict(name, "idle")
+
+    def _evict(self, name, reason):
+        entry = self.entries.pop(name)
+        self.evictions += 1
+        logger.info(f"Evicted {name} ({entry.size / 2**20:.0f} MB, {reason})")
+        del entry
+        gc.collect()
+
+    def stats(self) -> dict:
+        now = self.clock()
+        return {
+            "budget_mb": round(self.budget / 2**20),
+            "used_mb": round(self.used() / 2**20, 1),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "models": {
+                name: {
+                    "memory_mb": round(entry.size / 2**20, 1),
+                    "idle_sec": round(now - entry.last_used, 1),
+                    "uses": entry.uses,
+                    "load_sec": round(entry.load_sec, 2),
+                    "pinned": name in self.pinned,
+                }
+                for name, entry in self.entries.items()
+            },
+            "failed": {name: error for name, (_, error) in self.failures.items()},
+        }
@@ -6,7 +6,7 @@ from datetime import datetime
 from typing import List, Optional
 
 from pydantic import BaseModel
-from sqlalchemy import Column, DateTime, Integer, String, Text
+from sqlalchemy import Column, DateTime, Float, Integer, String, Text
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -24,12 +24,40 @@ class Transcript(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class TranslationCacheEntry(Base):
+    __tablename__ = "translation_cache"
+
+    key = Column(String(40), primary_key=True)  # sha1 of backend/source/target/text
+    backend = Column(String(16))
+    source_lang = Column(String(8))
+    target_lang = Column(String(8))
+    text = Column(Text)
+    translation = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BulkJobCheckpoint(Base):
+    """Bulk job progress, committed together with the rows it covers."""
+
+    __tablename__ = "bulk_job_checkpoints"
+
+    job_id = Column(String(32), primary_key=True)
+    file_index = Column(Integer, default=0)
+    offset_sec = Column(Float, default=0.0)
+    processed_sec = Column(Float, default=0.0)
+    segments = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class TranscriptCreate(BaseModel):
     room_id: str
     speaker: str
     text: str
     translation: Optional[str] = None
     detected_language: Optional[str] = None
+    asr_tier: Optional[str] = None  # ASR quality tier, broadcast only (not stored)
+    start: Optional[float] = None  # stream seconds since the audio connection, broadcast only
+    end: Optional[float] = None
 
 
 class TranscriptRead(BaseModel):
@@ -39,6 +67,9 @@ class TranscriptRead(BaseModel):
     text: str
     translation: Optional[str] = None
     detected_language: Optional[str] = None  # Add detected language field
+    asr_tier: Optional[str] = None
+    start: Optional[float] = None
+    end: Optional[float] = None
     created_at: datetime
 
     class Config:
@@ -49,3 +80,27 @@ class TranscriptList(BaseModel):
     items: List[TranscriptRead]
 
 
+
+
+class JobCreate(BaseModel):
+    path: str  # audio file or directory on the server
+    room_id: Optional[str] = None
+    language: Optional[str] = None  # None = detect per file
+    target_language: str = "en"
+
+
+class JobRead(BaseModel):
+    id: str
+    room_id: str
+    files: List[str]
+    language: Optional[str] = None
+    target_language: str
+    status: str
+    file_index: int
+    offset_sec: float
+    file_duration_sec: float
+    processed_sec: float
+    segments: int
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
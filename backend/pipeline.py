@@ -0,0 +1,186 @@
+"""Per-room live processing pipeline.
+
+    ingest -> asr -> aggregate -> translate -> persist -> broadcast
+
+Every stage is a bounded asyncio.Queue drained by one task per room, so a
+room's segments stay in order while different stages work on different chunks
+(chunk n is translated and written while chunk n + 1 is in the ASR). A full
+queue blocks the stage in front of it, which pushes back on the WebSocket
+instead of growing memory. Stages shared across rooms take a slot from a
+shared semaphore; blocking work runs on each stage's own executor, never on
+the event loop.
+
+The ingest queue is the exception to blocking backpressure: the WebSocket
+receive loop must keep reading even when the ASR falls behind, so received
+audio is offered to an IngestQueue that applies INGEST_OVERFLOW instead.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+import config
+
+logger = logging.getLogger("pipeline")
+
+
+class IngestQueue(asyncio.Queue):
+    """
+    Bounded queue of ("audio", pcm, received_at, tag) items whose put side
+    never waits (tag: the sender's (session, seq), or None). When it is full, the overflow policy applies:
+
+        drop_oldest  the oldest queued audio is discarded (bounded latency)
+        merge        new audio is appended to the newest queued item, up to
+                     INGEST_MERGE_MAX_SEC of it, then as drop_oldest
+        slow_down    as drop_oldest, and offer() asks the sender to slow down
+                     from INGEST_SLOW_DOWN_AT of capacity
+    """
+
+    def __init__(self, maxsize=config.INGEST_QUEUE_SIZE, policy=config.INGEST_OVERFLOW,
+                 sample_rate=config.SAMPLE_RATE, merge_max_sec=config.INGEST_MERGE_MAX_SEC):
+        super().__init__(maxsize)
+        self.policy = policy
+        self.bytes_per_sec = sample_rate * 2
+        self.merge_max_bytes = int(merge_max_sec * self.bytes_per_sec)
+        self.queued_bytes = 0
+        self.dropped_sec = 0.0
+        self.merged = 0
+        self.lag_sec = 0.0  # receive -> ingest, EWMA
+        self.max_lag_sec = 0.0
+
+    def _put(self, item):
+        self.queued_bytes += len(item[1])
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        self.queued_bytes -= len(item[1])
+        if isinstance(item[1], bytearray):  # merged in place while queued
+            item = (item[0], bytes(item[1]), item[2], item[3])
+        return item
+
+    def offer(self, pcm: bytes, received_at: float, tag=None) -> bool:
+        """Queue received audio without waiting; True when the sender should slow down."""
+        if self.full():
+            newest = self._queue[-1]
+            if (self.policy == "merge" and newest[0] == "audio"
+                    and len(newest[1]) + len(pcm) <= self.merge_max_bytes):
+                merged = newest[1] if isinstance(newest[1], bytearray) else bytearray(newest[1])
+                merged += pcm  # in place: no copy of what is already merged
+                self._queue[-1] = (newest[0], merged, newest[2], tag or newest[3])
+                self.queued_bytes += len(pcm)
+                self.merged += 1
+                return False
+            for index, (kind, old, _, _) in enumerate(self._queue):
+                if kind == "audio":
+                    del self._queue[index]
+                    self.queued_bytes -= len(old)
+                    self.dropped_sec += len(old) / self.bytes_per_sec
+                    self.task_done()
+                    break
+            else:  # only control items queued: the new audio is what goes
+                self.dropped_sec += len(pcm) / self.bytes_per_sec
+                return self.policy == "slow_down"
+        self.put_nowait(("audio", pcm, received_at, tag))
+        return self.policy == "slow_down" and self.qsize() >= self.maxsize * config.INGEST_SLOW_DOWN_AT
+
+    def observe(self, received_at: float):
+        lag = time.monotonic() - received_at
+        self.lag_sec = lag if self.lag_sec == 0.0 else 0.8 * self.lag_sec + 0.2 * lag
+        self.max_lag_sec = max(self.max_lag_sec, lag)
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "queued_sec": round(self.queued_bytes / self.bytes_per_sec, 2),
+            "oldest_age_sec": round(time.monotonic() - self._queue[0][2], 3) if self._queue else 0.0,
+            "lag_sec": round(self.lag_sec, 3),
+            "max_lag_sec": round(self.max_lag_sec, 3),
+            "dropped_sec": round(self.dropped_sec, 2),
+            "merged": self.merged,
+        }
+
+
+class Stage:
+    def __init__(self, name, handler, maxsize=config.PIPELINE_QUEUE_SIZE, limit=None, queue=None):
+        self.name = name
+        self.handler = handler  # async (pipeline, item) -> items for the next stage
+        self.limit = limit  # asyncio.Semaphore shared by this stage in every room
+        self.queue = queue if queue is not None else asyncio.Queue(maxsize)
+        self.next = None
+        self.task = None
+        self.processed = 0
+        self.busy_sec = 0.0
+
+    async def run(self, pipeline):
+        while True:
+            item = await self.queue.get()
+            started = time.monotonic()
+            try:
+                if self.limit is None:
+                    outputs = await self.handler(pipeline, item)
+                else:
+                    async with self.limit:
+                        outputs = await self.handler(pipeline, item)
+                self.busy_sec += time.monotonic() - started
+                self.processed += 1
+                if self.next is not None:
+                    for output in outputs or ():
+                        await self.next.queue.put(output)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"{self.name} stage failed for {pipeline.room_id}")
+            finally:
+                self.queue.task_done()
+
+
+class RoomPipeline:
+    """One room's chain of stages; `state` holds per-room ingest/ASR state."""
+
+    def __init__(self, room_id, stages):
+        self.room_id = room_id
+        self.state = {}
+        self.stages = {}
+        previous = None
+        for name, handler, limit in stages:
+            queue = IngestQueue() if name == "ingest" else None
+            stage = Stage(name, handler, limit=limit, queue=queue)
+            if previous is not None:
+                previous.next = stage
+            self.stages[name] = previous = stage
+        for stage in self.stages.values():
+            stage.task = asyncio.create_task(stage.run(self), name=f"{room_id}:{stage.name}")
+
+    async def put(self, item, stage="ingest"):
+        """Queue an item at `stage` (waits while that stage's queue is full)."""
+        await self.stages[stage].queue.put(item)
+
+    def offer_audio(self, pcm: bytes, tag=None) -> bool:
+        """Receive loop entry point: never waits; True asks the sender to slow down."""
+        return self.stages["ingest"].queue.offer(pcm, time.monotonic(), tag)
+
+    async def close(self):
+        """Drain every stage front to back, then stop the stage tasks."""
+        try:
+            for stage in self.stages.values():
+                await stage.queue.join()
+        finally:
+            for stage in self.stages.values():
+                stage.task.cancel()
+            await asyncio.gather(*(s.task for s in self.stages.values()), return_exceptions=True)
+
+    def stats(self) -> dict:
+        stats = {
+            name: {
+                "queued": stage.queue.qsize(),
+                "processed": stage.processed,
+                "busy_sec": round(stage.busy_sec, 3),
+            }
+            for name, stage in self.stages.items()
+        }
+        if "ingest" in self.stages:
+            stats["ingest"].update(self.stages["ingest"].queue.stats())
+        return stats
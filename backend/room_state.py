@@ -0,0 +1,215 @@
+"""Room state shared between workers, and the broadcast broker.
+
+A room's pipeline (ring buffer, ASR / aggregator state, language lock, audio
+sessions) lives on the one worker that owns the room; ownership is a lease
+in the store, renewed while the pipeline runs, and audio that reaches any
+other worker is redirected to the owner. Everything a room needs beyond its
+owner goes through two small interfaces:
+
+    store   per-room settings (target language, each worker's listener
+            languages) and room ownership leases
+    broker  publish(topic, event) reaches the subscribers of every worker,
+            including this one, through the callback given to start()
+
+ROOM_STATE_BACKEND picks the implementation: "memory" (one worker, the
+default) or "redis" (REDIS_URL, shared by every worker and node).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+
+import config
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - only needed for ROOM_STATE_BACKEND=redis
+    aioredis = None
+
+logger = logging.getLogger("room_state")
+
+# Lease updates run as scripts so the ownership check and the write are one step:
+# with GET then EXPIRE / DEL, a lease that expired and was taken by another
+# worker in between would be renewed or deleted by its previous owner.
+CLAIM_LEASE = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return ARGV[2]
+end
+if cjson.decode(current)['worker'] == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return current
+"""
+RELEASE_LEASE = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['worker'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class MemoryRoomStore:
+    """Room settings and ownership leases in this process."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.rooms = {}  # room_id -> {key: value}
+        self.owners = {}  # room_id -> (owner dict, expires_at)
+
+    async def get(self, room_id, key, default=None):
+        return self.rooms.get(room_id, {}).get(key, default)
+
+    async def set(self, room_id, key, value):
+        self.rooms.setdefault(room_id, {})[key] = value
+
+    async def delete(self, room_id, key):
+        self.rooms.get(room_id, {}).pop(key, None)
+
+    async def scan(self, room_id, prefix) -> dict:
+        """Entries whose key starts with `prefix`."""
+        return {k: v for k, v in self.rooms.get(room_id, {}).items() if k.startswith(prefix)}
+
+    async def claim(self, room_id, worker, url, ttl) -> dict:
+        """Take or renew the room's lease; returns the owner, which may be another worker."""
+        now = self.clock()
+        owner, expires_at = self.owners.get(room_id, (None, 0.0))
+        if owner is None or expires_at <= now or owner["worker"] == worker:
+            owner = {"worker": worker, "url": url}
+            self.owners[room_id] = (owner, now + ttl)
+        return owner
+
+    async def release(self, room_id, worker):
+        owner, _ = self.owners.get(room_id, (None, 0.0))
+        if owner is not None and owner["worker"] == worker:
+            del self.owners[room_id]
+
+    async def close(self):
+        pass
+
+
+class MemoryBroker:
+    """Single worker: a publish is a local delivery."""
+
+    def __init__(self):
+        self.deliver = None
+        self.published = 0
+
+    async def start(self, deliver):
+        self.deliver = deliver  # (topic, event) -> None, on the event loop
+
+    async def publish(self, topic, event: dict):
+        self.published += 1
+        if self.deliver is not None:
+            self.deliver(topic, event)
+
+    async def stop(self):
+        self.deliver = None
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "published": self.published}
+
+
+class RedisRoomStore:
+    """
+    Room settings in one Redis hash per room (JSON values) and leases as
+    keys with an expiry, so every worker sees the same rooms.
+    """
+
+    def __init__(self, client, prefix="rooms"):
+        self.client = client
+        self.prefix = prefix
+        self._claim = client.register_script(CLAIM_LEASE)
+        self._release = client.register_script(RELEASE_LEASE)
+
+    def _room(self, room_id):
+        return f"{self.prefix}:{room_id}"
+
+    def _owner(self, room_id):
+        return f"{self.prefix}:{room_id}:owner"
+
+    async def get(self, room_id, key, default=None):
+        value = await self.client.hget(self._room(room_id), key)
+        return default if value is None else json.loads(value)
+
+    async def set(self, room_id, key, value):
+        await self.client.hset(self._room(room_id), key, json.dumps(value))
+
+    async def delete(self, room_id, key):
+        await self.client.hdel(self._room(room_id), key)
+
+    async def scan(self, room_id, prefix) -> dict:
+        entries = await self.client.hgetall(self._room(room_id))
+        return {k: json.loads(v) for k, v in entries.items() if k.startswith(prefix)}
+
+    async def claim(self, room_id, worker, url, ttl) -> dict:
+        mine = json.dumps({"worker": worker, "url": url})
+        owner = await self._claim(keys=[self._owner(room_id)], args=[worker, mine, max(1, int(ttl))])
+        return json.loads(owner)
+
+    async def release(self, room_id, worker):
+        await self._release(keys=[self._owner(room_id)], args=[worker])
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class RedisBroker:
+    """Events go out on one channel per topic; each worker listens on all of them."""
+
+    def __init__(self, client, prefix="broadcast"):
+        self.client = client
+        self.prefix = prefix
+        self.pubsub = None
+        self.task = None
+        self.deliver = None
+        self.published = 0
+        self.received = 0
+
+    async def start(self, deliver):
+        self.deliver = deliver
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.psubscribe(f"{self.prefix}:*")
+        self.task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        skip = len(self.prefix) + 1
+        async for item in self.pubsub.listen():
+            if item["type"] != "pmessage":
+                continue
+            self.received += 1
+            try:
+                self.deliver(item["channel"][skip:], json.loads(item["data"]))
+            except Exception:
+                logger.exception(f"Broadcast delivery failed on {item['channel']}")
+
+    async def publish(self, topic, event: dict):
+        self.published += 1
+        await self.client.publish(f"{self.prefix}:{topic}", json.dumps(event, default=str))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "published": self.published, "received": self.received}
+
+
+def create(backend=config.ROOM_STATE_BACKEND):
+    """(store, broker) for ROOM_STATE_BACKEND."""
+    if backend == "redis":
+        if aioredis is None:
+            raise RuntimeError("ROOM_STATE_BACKEND=redis needs the redis package")
+        client = aioredis.from_url(config.REDIS_URL, decode_responses=True)
+        return RedisRoomStore(client), RedisBroker(client)
+    if backend != "memory":
+        logger.warning(f"Unknown ROOM_STATE_BACKEND {backend!r}, using memory")
+    return MemoryRoomStore(), MemoryBroker()
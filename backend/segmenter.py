@@ -0,0 +1,207 @@
+"""Server-side speech segmentation between the WebSocket and the ASR.
+
+Incoming int16 PCM is cut into VAD_FRAME_MS frames and classified with a cheap
+energy gate plus webrtcvad (when installed). Speech frames are grouped into
+variable-length utterances that start with VAD_PREROLL_MS of lead-in, end after
+VAD_HANGOVER_MS of silence and never exceed VAD_MAX_UTTERANCE_SEC. Silence is
+dropped here and never reaches Whisper.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import deque
+from typing import List, Tuple
+
+import numpy as np
+
+import config
+
+try:
+    import webrtcvad
+except ImportError:  # pragma: no cover - energy-only fallback
+    webrtcvad = None
+
+logger = logging.getLogger("segmenter")
+
+
+class SpeechSegmenter:
+    def __init__(self, sample_rate=config.SAMPLE_RATE, frame_ms=config.VAD_FRAME_MS,
+                 aggressiveness=config.VAD_AGGRESSIVENESS, energy_dbfs=config.VAD_ENERGY_DBFS,
+                 preroll_ms=config.VAD_PREROLL_MS, hangover_ms=config.VAD_HANGOVER_MS,
+                 max_utterance_sec=config.VAD_MAX_UTTERANCE_SEC,
+                 min_speech_ms=config.VAD_MIN_SPEECH_MS):
+        self.sample_rate = sample_rate
+        self.frame_bytes = int(sample_rate * frame_ms / 1000) * 2
+        self.frame_ms = frame_ms
+        self.energy_threshold = 32768.0 * 10 ** (energy_dbfs / 20.0)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.max_frames = int(max_utterance_sec * 1000 // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.preroll = deque(maxlen=max(0, preroll_ms // frame_ms))
+        self.vad = None
+        if webrtcvad is not None:
+            self.vad = webrtcvad.Vad(aggressiveness)
+        else:
+            logger.warning("webrtcvad not available, using energy-only VAD")
+
+        self._pending = bytearray()  # bytes short of a full frame
+        self._utterance = bytearray()  # frames of the current utterance (feed())
+        self._in_speech = False
+        self._position = 0  # frames consumed so far
+        self._start = 0  # first frame of the current utterance
+        self._frames = 0  # frames in the current utterance
+        self._span_samples = 0  # samples in the current utterance (feed_spans())
+        self._speech_frames = 0
+        self._silence_run = 0
+
+    def is_speech(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        if np.sqrt(np.mean(samples * samples)) < self.energy_threshold:
+            return False
+        if self.vad is None:
+            return True
+        try:
+            return self.vad.is_speech(frame, self.sample_rate)
+        except Exception:
+            return True
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        """Consume PCM; return the utterances that reached an endpoint."""
+        utterances = []
+        for passed, ended in self._step(pcm):
+            self._utterance.extend(passed)
+            if ended:
+                utterances.extend(self._take_utterance())
+        return utterances
+
+    def feed_speech(self, pcm: bytes) -> Tuple[bytes, bool]:
+        """
+        Streaming variant of feed(): return speech audio as soon as it is
+        classified, plus whether an utterance endpoint was crossed.
+        """
+        out, endpoint = bytearray(), False
+        for passed, ended in self._step(pcm):
+            out.extend(passed)
+            endpoint = endpoint or ended
+        if endpoint:
+            self._speech_frames = 0
+        return bytes(out), endpoint
+
+    def feed_spans(self, pcm: bytes) -> List[Tuple[int, int]]:
+        """
+        feed() for callers that keep the audio themselves (the room ring
+        buffer): returns (start_sample, samples) per finished utterance, as
+        absolute offsets into the stream fed so far.
+        """
+        spans = []
+        for passed, ended in self._step(pcm):
+            self._span_samples += len(passed) // 2
+            if ended:
+                spans.extend(self._take_span())
+        return spans
+
+    def flush_spans(self) -> List[Tuple[int, int]]:
+        self._pending.clear()
+        return self._take_span()
+
+    @property
+    def in_speech(self) -> bool:
+        return self._in_speech
+
+    @property
+    def utterance_start(self) -> int:
+        """Absolute sample where the current utterance (with pre-roll) began."""
+        return self._start * (self.frame_bytes // 2)
+
+    def split(self, pcm: bytes) -> List[Tuple[int, bytes]]:
+        """Segment a whole recording; returns (start_sample, utterance) pairs."""
+        return self.split_window(pcm) + self.split_end()
+
+    def split_window(self, pcm: bytes) -> List[Tuple[int, bytes]]:
+        """
+        split() for a recording fed one window at a time: the utterances that
+        ended inside this window; state carries over to the next one.
+        """
+        pieces = []
+        for passed, ended in self._step(pcm):
+            self._utterance.extend(passed)
+            if ended:
+                start = self._start
+                pieces.extend((start, u) for u in self._take_utterance())
+                self._start = self._position
+        return self._at_samples(pieces)
+
+    def split_end(self) -> List[Tuple[int, bytes]]:
+        """End of a windowed recording: the utterance still open, if any."""
+        start = self._start
+        return self._at_samples([(start, u) for u in self.flush()])
+
+    def _at_samples(self, pieces):
+        frame_samples = self.frame_bytes // 2
+        return [(start * frame_samples, audio) for start, audio in pieces]
+
+    def flush(self) -> List[bytes]:
+        """End of stream: return the in-progress utterance, if it has enough speech."""
+        self._pending.clear()
+        return self._take_utterance()
+
+    def _take_span(self) -> List[Tuple[int, int]]:
+        start, samples, speech = self.utterance_start, self._span_samples, self._speech_frames
+        self._span_samples = 0
+        self._speech_frames = 0
+        self._start = self._position
+        if speech < self.min_speech_frames:
+            return []
+        return [(start, samples)]
+
+    def _take_utterance(self) -> List[bytes]:
+        audio, speech = bytes(self._utterance), self._speech_frames
+        self._utterance.clear()
+        self._speech_frames = 0
+        if speech < self.min_speech_frames:
+            return []
+        return [audio]
+
+    def _step(self, pcm: bytes):
+        """Yield (bytes passed to ASR, utterance ended) per complete frame."""
+        self._pending.extend(pcm)
+        pending = memoryview(self._pending)
+        offset = 0
+        while len(pending) - offset >= self.frame_bytes:
+            frame = bytes(pending[offset:offset + self.frame_bytes])
+            offset += self.frame_bytes
+            self._position += 1
+            speech = self.is_speech(frame)
+
+            if not self._in_speech:
+                if not speech:
+                    self.preroll.append(frame)
+                    continue
+                self._in_speech = True
+                self._start = self._position - 1 - len(self.preroll)
+                self._frames = len(self.preroll)
+                self._silence_run = 0
+                lead_in = b"".join(self.preroll)
+                self.preroll.clear()
+                frame = lead_in + frame
+
+            self._frames += 1
+            if speech:
+                self._speech_frames += 1
+                self._silence_run = 0
+            else:
+                self._silence_run += 1
+
+            if self._silence_run >= self.hangover_frames:
+                self._in_speech = False
+                yield frame, True
+            elif self._frames >= self.max_frames:
+                # Forced split on long monologues; stay in speech
+                self._frames = 0
+                yield frame, True
+            else:
+                yield frame, False
+        pending.release()
+        # One compaction per call instead of a memmove per frame
+        del self._pending[:offset]
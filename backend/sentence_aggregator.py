@@ -0,0 +1,102 @@
+"""Per-room sentence aggregation between the ASR and translation.
+
+Whisper segments from short chunks are often sentence fragments; translating
+each one separately costs more model calls and gives worse output. Fragments
+are held until a sentence terminator, a pause of SENTENCE_PAUSE_SEC with no
+new speech, or SENTENCE_MAX_LATENCY_SEC since the first held fragment, and
+only whole sentences go on to translation. Source captions are not delayed:
+the pipeline sends each fragment as it arrives.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from typing import List, Optional
+
+import config
+
+# Latin, Devanagari danda / double danda, Arabic-script question mark
+_TERMINATOR = re.compile(r"[.?!।॥؟](?=\s|$)")
+
+
+class SentenceAggregator:
+    def __init__(self, pause_sec=config.SENTENCE_PAUSE_SEC,
+                 max_latency_sec=config.SENTENCE_MAX_LATENCY_SEC,
+                 max_chars=config.SENTENCE_MAX_CHARS, clock=time.monotonic):
+        self.pause_sec = pause_sec
+        self.max_latency_sec = max_latency_sec
+        self.max_chars = max_chars
+        self.clock = clock
+        self.parts = []
+        self.language = None
+        self.tier = None
+        self.start = None  # stream seconds covered by the held text
+        self.end = None
+        self.first_at = None  # arrival of the oldest held fragment
+        self.last_at = None
+
+    def add(self, segments) -> List[dict]:
+        """Hold new fragments; return the sentences they completed."""
+        out = []
+        for seg in segments:
+            text = seg["text"].strip()
+            if not text:
+                continue
+            if self.parts and seg["language"] != self.language:
+                out.extend(self.flush())
+            now = self.clock()
+            if not self.parts:
+                self.first_at, self.language = now, seg["language"]
+                self.start = seg.get("start")
+            self.parts.append(text)
+            self.tier, self.last_at, self.end = seg.get("tier"), now, seg.get("end")
+
+            held = " ".join(self.parts)
+            ends = [m.end() for m in _TERMINATOR.finditer(held)]
+            if ends:
+                head, tail = held[:ends[-1]].strip(), held[ends[-1]:].strip()
+                # Earlier held parts had no terminator, so the cut is inside this fragment
+                cut = self._split_time(seg, text, ends[-1] - (len(held) - len(text)))
+                if tail:
+                    self.end = cut
+                out.append(self._sentence(head))
+                self.parts = [tail] if tail else []
+                # The tail was spoken from the cut on, not when the fragment arrived
+                spoken = seg.get("end") - cut if tail and cut is not None else 0.0
+                self.first_at, self.start, self.end = now - spoken, cut, seg.get("end")
+            if len(" ".join(self.parts)) >= self.max_chars:
+                out.extend(self.flush())
+        return out
+
+    @staticmethod
+    def _split_time(seg, text, position) -> Optional[float]:
+        """Stream time of character `position` of a fragment, by its share of the text."""
+        start, end = seg.get("start"), seg.get("end")
+        if start is None or end is None:
+            return None
+        return round(start + (end - start) * position / len(text), 2)
+
+    def deadline(self) -> Optional[float]:
+        """Clock time at which held text must go out, or None when nothing is held."""
+        if not self.parts:
+            return None
+        return min(self.last_at + self.pause_sec, self.first_at + self.max_latency_sec)
+
+    def expire(self) -> List[dict]:
+        """Pause or max-latency timeout: release held text once the deadline passed."""
+        deadline = self.deadline()
+        if deadline is None or self.clock() < deadline:
+            return []
+        return self.flush()
+
+    def flush(self) -> List[dict]:
+        if not self.parts:
+            return []
+        sentence = self._sentence(" ".join(self.parts))
+        self.parts = []
+        return [sentence]
+
+    def _sentence(self, text) -> dict:
+        return {"text": text, "language": self.language, "tier": self.tier,
+                "start": self.start, "end": self.end}
@@ -0,0 +1,150 @@
+"""Streaming transcription on top of WhisperASR.
+
+Each room keeps a rolling window, a view into its audio ring buffer, holding
+only the audio that has not been committed yet. Every STREAM_STEP_SEC of new
+audio the window is re-decoded with word timestamps; words that two
+consecutive hypotheses agree on (LocalAgreement-2) are committed as final
+text and the window start moves past them, so only the unstable tail is ever
+decoded again.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import List, Tuple
+
+import config
+
+logger = logging.getLogger("streaming_asr")
+
+# (start_sec, end_sec, word) with absolute stream times
+Word = Tuple[float, float, str]
+
+
+def _norm(word: str) -> str:
+    return word.strip().lower().strip(".,!?;:\"'")
+
+
+def words_to_text(words: List[Word]) -> str:
+    return "".join(w[2] for w in words).strip()
+
+
+class LocalAgreement:
+    """
+    LocalAgreement-2 commit policy.
+
+    A word becomes final once it is part of the common prefix of two
+    consecutive hypotheses for the same audio.
+    """
+
+    def __init__(self):
+        self.committed_end = 0.0
+        self.previous: List[Word] = []
+        self.last_committed: List[Word] = []
+
+    def insert(self, words: List[Word]) -> Tuple[List[Word], List[Word]]:
+        """Feed a new hypothesis; returns (newly committed words, unstable tail)."""
+        # Ignore words that belong to audio which is already committed
+        words = [w for w in words if w[0] >= self.committed_end - 0.1]
+        words = self._drop_repeated_prefix(words)
+
+        committed = []
+        for prev, cur in zip(self.previous, words):
+            if _norm(prev[2]) != _norm(cur[2]):
+                break
+            committed.append(cur)
+
+        self.previous = words[len(committed):]
+        if committed:
+            self.committed_end = committed[-1][1]
+            self.last_committed = (self.last_committed + committed)[-5:]
+        return committed, self.previous
+
+    def flush(self) -> List[Word]:
+        """Commit whatever is left of the last hypothesis."""
+        tail = self.previous
+        self.previous = []
+        if tail:
+            self.committed_end = tail[-1][1]
+            self.last_committed = (self.last_committed + tail)[-5:]
+        return tail
+
+    def _drop_repeated_prefix(self, words: List[Word]) -> List[Word]:
+        # Whisper often re-emits the last committed words at the start of the
+        # window; strip the longest such n-gram (up to 5 words).
+        if not words or not self.last_committed:
+            return words
+        for n in range(min(5, len(words), len(self.last_committed)), 0, -1):
+            head = [_norm(w[2]) for w in words[:n]]
+            tail = [_norm(w[2]) for w in self.last_committed[-n:]]
+            if head == tail:
+                return words[n:]
+        return words
+
+
+class StreamingTranscriber:
+    """
+    Per-room rolling window with partial/final hypotheses. The audio lives in
+    the room's AudioRingBuffer; the window is a view of [base, end) in it.
+    """
+
+    def __init__(self, ring, start=0, step_sec=config.STREAM_STEP_SEC,
+                 max_window_sec=config.STREAM_MAX_WINDOW_SEC):
+        self.ring = ring
+        self.sample_rate = ring.sample_rate
+        self.step_samples = int(self.sample_rate * step_sec)
+        self.max_window_samples = int(self.sample_rate * max_window_sec)
+        self.base = start  # absolute sample of the window start
+        self.end = start
+        self.pending = 0  # samples received since the last decode
+        self.agreement = LocalAgreement()
+
+    @property
+    def offset(self) -> float:
+        """Absolute stream time (s) of the window start."""
+        return self.base / self.sample_rate
+
+    def advance(self, end: int):
+        """The ring now holds audio up to absolute sample `end`."""
+        self.pending += end - self.end
+        self.end = end
+
+    def ready(self) -> bool:
+        return self.pending >= self.step_samples
+
+    def window(self):
+        """Return (audio view, prompt) for the next decode and reset the step counter."""
+        self.pending = 0
+        prompt = words_to_text(self.agreement.last_committed) or None
+        return self.ring.view(self.base, self.end), prompt
+
+    def update(self, segments):
+        """
+        Apply the commit policy to a decode of window().
+
+        Returns (committed_words, partial_words).
+        """
+        words = [
+            (self.offset + w["start"], self.offset + w["end"], w["word"])
+            for seg in segments for w in seg.get("words", [])
+        ]
+        committed, partial = self.agreement.insert(words)
+
+        if self.end - self.base > self.max_window_samples:
+            # The tail never stabilised; commit it so the window stays bounded
+            committed = committed + self.agreement.flush()
+            partial = []
+        self._trim(self.agreement.committed_end)
+        return committed, partial
+
+    def finish(self) -> List[Word]:
+        """Commit the remaining tail (end of stream)."""
+        tail = self.agreement.flush()
+        self._trim(self.end / self.sample_rate)
+        return tail
+
+    def _trim(self, until_sec: float):
+        cut = int((until_sec - self.offset) * self.sample_rate)
+        if cut <= 0:
+            return
+        self.base += min(cut, self.end - self.base)
@@ -0,0 +1,138 @@
+"""Write-behind transcript persistence.
+
+Live segments no longer wait on the database: their rows are queued here
+and one task writes the rows of every room together, one transaction per
+PERSIST_FLUSH_MS or PERSIST_BATCH_SIZE rows, whichever comes first, on the
+DB executor. PERSIST_DURABILITY picks the trade-off:
+
+    async  broadcast right away, rows are written within the flush interval
+           (rows still queued are lost if the process dies)
+    sync   rows are still grouped, but the caller waits for their commit
+    off    live segments are not stored
+
+stop() drains the queue, so a clean shutdown loses nothing.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+import config
+
+logger = logging.getLogger("transcript_writer")
+
+DURABILITY_MODES = ("async", "sync", "off")
+
+
+class TranscriptWriter:
+    def __init__(self, save, executor=None, batch_size=config.PERSIST_BATCH_SIZE,
+                 flush_ms=config.PERSIST_FLUSH_MS, max_queue=config.PERSIST_QUEUE_SIZE,
+                 durability=config.PERSIST_DURABILITY):
+        if durability not in DURABILITY_MODES:
+            logger.warning(f"Unknown PERSIST_DURABILITY {durability!r}, using async")
+            durability = "async"
+        self.save = save  # blocking: list of rows -> their results, in one transaction
+        self.executor = executor
+        self.batch_size = batch_size
+        self.flush_sec = flush_ms / 1000.0
+        self.durability = durability
+        self.queue = asyncio.Queue(max_queue)  # (row, future or None)
+        self.full = asyncio.Event()  # a whole batch is waiting
+        self.task = None
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.ok_batches = 0  # committed; avg_batch counts only these
+        self.max_queued = 0
+        self.flush_ms = 0.0  # EWMA
+        self.max_flush_ms = 0.0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def write(self, rows, wait=None):
+        """
+        Queue rows for the next flush. Waits for the commit (and returns the
+        results) in sync mode or with wait=True, otherwise returns None once
+        queued; only a full queue makes the caller wait.
+        """
+        wait = self.durability == "sync" if wait is None else wait
+        if self.durability == "off" and not wait:
+            return None
+        loop = asyncio.get_running_loop()
+        futures = []
+        for row in rows:
+            future = loop.create_future() if wait else None
+            await self.queue.put((row, future))
+            futures.append(future)
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+        if self.queue.qsize() >= self.batch_size - 1:
+            self.full.set()
+        if wait:
+            return await asyncio.gather(*futures)
+        return None
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.queue.qsize() < self.batch_size - 1:
+                self.full.clear()
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.flush_sec)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            results = await loop.run_in_executor(self.executor, self.save, [row for row, _ in batch])
+        except Exception as e:
+            self.failed += len(batch)
+            logger.exception(f"Failed to write {len(batch)} transcripts")
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+        else:
+            self.written += len(batch)
+            self.ok_batches += 1
+            for (_, future), result in zip(batch, results):
+                if future is not None and not future.done():
+                    future.set_result(result)
+        finally:
+            elapsed = (time.monotonic() - started) * 1000
+            self.flush_ms = elapsed if self.batches == 0 else 0.8 * self.flush_ms + 0.2 * elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.batches += 1
+            for _ in batch:
+                self.queue.task_done()
+
+    async def stop(self):
+        """Write everything still queued, then stop the flush task."""
+        if self.task is None:
+            return
+        self.full.set()
+        await self.queue.join()
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        logger.info(f"Transcript writer drained ({self.written} rows written, {self.failed} failed)")
+
+    def stats(self) -> dict:
+        return {
+            "durability": self.durability,
+            "queued": self.queue.qsize(),
+            "max_queued": self.max_queued,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch": round(self.written / self.ok_batches, 1) if self.ok_batches else 0.0,
+            "flush_ms": round(self.flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
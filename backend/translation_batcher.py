@@ -0,0 +1,92 @@
+"""Micro-batched translation shared by all rooms.
+
+Callers await translate(text, source, target). Pending texts are grouped per
+(source, target) model pair and flushed after TRANSLATION_BATCH_WAIT_MS or
+once TRANSLATION_BATCH_SIZE texts are waiting. Each flush is one padded
+Translator.translate_batch call on the translation thread. While a batch runs,
+new segments pile up behind it, so batches grow with load.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger("translation_batcher")
+
+
+class TranslationBatcher:
+    def __init__(self, translator, max_batch=config.TRANSLATION_BATCH_SIZE,
+                 max_wait_ms=config.TRANSLATION_BATCH_WAIT_MS):
+        self.translator = translator
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="translate")
+        self._pending = {}  # (source, target) -> [(text, future)]
+        self._timers = {}  # (source, target) -> TimerHandle
+        self._running = set()
+        self.batches = 0
+        self.items = 0
+
+    async def translate(self, text: str, source_lang: str, target_lang: str) -> str:
+        if not text.strip():
+            return ""
+        if source_lang == target_lang:
+            return text
+
+        loop = asyncio.get_running_loop()
+        key = (source_lang, target_lang)
+        future = loop.create_future()
+        items = self._pending.setdefault(key, [])
+        items.append((text, future))
+        if len(items) >= self.max_batch:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(key, None)
+        if not items:
+            return
+        task = asyncio.ensure_future(self._run(key, items))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key, items):
+        # Identical texts (greetings, "okay") are translated once per batch
+        unique = list(dict.fromkeys(text for text, _ in items))
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, self.translator.translate_batch, unique, key[0], key[1]
+            )
+            translated = dict(zip(unique, results))
+        except Exception as e:
+            logger.error(f"Batched translation {key[0]}->{key[1]} failed: {e}")
+            translated = {}
+        self.batches += 1
+        self.items += len(items)
+        for text, future in items:
+            if not future.done():
+                future.set_result(translated.get(text, text))
+
+    async def stop(self):
+        for key in list(self._pending):
+            self._flush(key)
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {
+            "pending": sum(len(v) for v in self._pending.values()),
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
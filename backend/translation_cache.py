@@ -0,0 +1,125 @@
+"""Translation result cache.
+
+Classroom speech repeats itself ("okay", "next slide", greetings), so results
+are cached by (backend, source, target, normalized text). Lookups hit a
+bounded in-memory LRU first and then, when TRANSLATION_CACHE_PERSIST is on,
+the translation_cache table next to transcripts, so hits survive restarts.
+A hit never reaches the tokenizer or generate().
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List
+
+import config
+
+logger = logging.getLogger("translation_cache")
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _SPACES.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+class TranslationCache:
+    def __init__(self, max_entries=config.TRANSLATION_CACHE_SIZE,
+                 persist=config.TRANSLATION_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.persist = persist
+        self.entries = OrderedDict()  # key digest -> translation
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(backend, source_lang, target_lang, text) -> str:
+        raw = "\x00".join((backend, source_lang, target_lang, normalize(text)))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, backend, source_lang, target_lang, texts) -> Dict[str, str]:
+        """Cached translations for `texts`, as {text: translation}."""
+        keys = {text: self.key(backend, source_lang, target_lang, text) for text in texts}
+        found, missing = {}, {}
+        with self.lock:
+            for text, key in keys.items():
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[text] = self.entries[key]
+                else:
+                    missing[key] = text
+        if missing and self.persist:
+            stored = self._load(list(missing))
+            with self.lock:
+                for key, translation in stored.items():
+                    found[missing[key]] = translation
+                    self._remember(key, translation)
+            self.persistent_hits += len(stored)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, backend, source_lang, target_lang, pairs: List[tuple]):
+        """Store (text, translation) pairs from a successful generate()."""
+        if not pairs:
+            return
+        rows = {self.key(backend, source_lang, target_lang, text): (text, translation)
+                for text, translation in pairs}
+        with self.lock:
+            for key, (_, translation) in rows.items():
+                self._remember(key, translation)
+        if self.persist:
+            self._save(rows, backend, source_lang, target_lang)
+
+    def _remember(self, key, translation):
+        self.entries[key] = translation
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _load(self, keys) -> Dict[str, str]:
+        import database
+        import models
+
+        try:
+            with database.session_scope() as session:
+                rows = (
+                    session.query(models.TranslationCacheEntry)
+                    .filter(models.TranslationCacheEntry.key.in_(keys))
+                    .all()
+                )
+                return {row.key: row.translation for row in rows}
+        except Exception as e:
+            logger.error(f"Translation cache read failed: {e}")
+            return {}
+
+    def _save(self, rows, backend, source_lang, target_lang):
+        import database
+        import models
+
+        try:
+            with database.session_scope() as session:
+                for key, (text, translation) in rows.items():
+                    session.merge(models.TranslationCacheEntry(
+                        key=key, backend=backend, source_lang=source_lang,
+                        target_lang=target_lang, text=normalize(text), translation=translation,
+                    ))
+        except Exception as e:
+            logger.error(f"Translation cache write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
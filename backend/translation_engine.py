@@ -1,5 +1,9 @@
 import logging
+import time
 import config
+import ct2_models
+import model_registry
+import translation_cache
 import utils
 
 logger = logging.getLogger("translator")
@@ -15,15 +19,36 @@ LANG_MAP = {
     "ur": "ur",
 }
 
+M2M100_MODEL = "facebook/m2m100_418M"
+
+
+def marian_model_name(source_lang, target_lang):
+    src = LANG_MAP.get(source_lang, "en")  # Map Whisper language to Marian
+    return f"Helsinki-NLP/opus-mt-{src}-{target_lang}"
+
+
+def model_missing(error) -> bool:
+    """True when the hub has no such model, as opposed to a failed download or load."""
+    while error is not None:
+        if type(error).__name__ == "RepositoryNotFoundError" or "not a valid model identifier" in str(error):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
 
 class Translator:
     """
     Translation engine with proper language mapping.
     """
 
-    def __init__(self, backend=config.TRANSLATION_BACKEND):
+    def __init__(self, backend=config.TRANSLATION_BACKEND, cache=None):
         self.backend = backend
-        self.models = {}  # Cache loaded models
+        self.models = model_registry.ModelRegistry()  # Loaded models within the RAM budget
+        if cache is None and config.TRANSLATION_CACHE_SIZE > 0:
+            cache = translation_cache.TranslationCache()
+        self.cache = cache  # Translated segments, checked before the model
+        self.routes = {}  # (source, target) -> hops; two hops pivot through English
+        self.route_retry = {}  # (source, target) -> when a pivot taken after a load failure expires
 
     def translate(self, text: str, source_lang="auto", target_lang="en") -> str:
         """
@@ -36,44 +61,171 @@ class Translator:
         if source_lang == target_lang:
             return text
 
+        return self.translate_batch([text], source_lang, target_lang)[0]
+
+    def translate_batch(self, texts, source_lang="auto", target_lang="en"):
+        """
+        Translate several texts of one language pair. Cached results are used
+        as-is; the rest go through a single padded generate() call per hop.
+        Returns the originals if translation fails.
+        """
+        if source_lang == target_lang:
+            return list(texts)
         try:
-            if self.backend == "marian":
-                return self._translate_marian(text, source_lang, target_lang)
-            elif self.backend == "m2m100":
-                return self._translate_m2m100(text, source_lang, target_lang)
-            else:
-                return self._translate_cloud(text, source_lang, target_lang)
+            return self._translate_cached(texts, source_lang, target_lang, self._generate_routed)
         except Exception as e:
             logger.error(f"Translation failed: {e}, returning original text")
-            return text
+            return list(texts)
+
+    def _translate_cached(self, texts, source_lang, target_lang, generate):
+        """Answer from the cache; only the misses (deduplicated) reach generate()."""
+        found = {}
+        if self.cache is not None:
+            found = self.cache.get_many(self.backend, source_lang, target_lang, texts)
+        missing = list(dict.fromkeys(t for t in texts if t not in found))
+        if missing:
+            results = generate(missing, source_lang, target_lang)
+            if self.cache is not None:
+                self.cache.put_many(self.backend, source_lang, target_lang, list(zip(missing, results)))
+            found.update(zip(missing, results))
+        return [found[t] for t in texts]
 
-    def _translate_marian(self, text, source_lang, target_lang):
+    def _generate_routed(self, texts, source_lang, target_lang):
         """
-        Use MarianMT models for translation with proper language mapping.
+        Direct model when the pair has one, otherwise source -> en -> target.
+        Each pivot hop is one batch and is cached on its own, so rooms sharing
+        a hop (ta->en for ta->hi and ta->te) reuse it.
         """
-        from transformers import MarianMTModel, MarianTokenizer
+        route = self._route(source_lang, target_lang)
+        if len(route) == 1:
+            return self._generate(texts, source_lang, target_lang)
+        for hop_source, hop_target in route:
+            texts = self._translate_cached(texts, hop_source, hop_target, self._generate)
+        return texts
 
-        src = LANG_MAP.get(source_lang, "en")  # Map Whisper language to Marian
-        tgt = target_lang
+    def _route(self, source_lang, target_lang):
+        """
+        Resolve (and remember) the hops for a pair; Opus-MT backends only. A
+        pair without a direct model pivots for good; after any other load
+        failure the direct model is tried again once the registry would retry
+        the load (TRANSLATION_LOAD_RETRY_SEC).
+        """
+        key = (source_lang, target_lang)
+        now = self.models.clock()
+        if key in self.routes and now < self.route_retry.get(key, float("inf")):
+            return self.routes[key]
+        route = [key]
+        self.route_retry.pop(key, None)
+        if self.backend in ("marian", "ct2") and "en" not in key:
+            try:
+                self._load_pair(source_lang, target_lang)
+            except Exception as e:
+                route = [(source_lang, "en"), ("en", target_lang)]
+                if model_missing(e):
+                    logger.info(f"No direct model for {source_lang}->{target_lang}, pivoting through English")
+                else:
+                    self.route_retry[key] = now + self.models.retry_sec
+                    logger.warning(f"Direct model for {source_lang}->{target_lang} failed to load ({e}), "
+                                   f"pivoting through English for {self.models.retry_sec:.0f}s")
+        self.routes[key] = route
+        return route
 
-        model_name = f"Helsinki-NLP/opus-mt-{src}-{tgt}"
+    def _load_pair(self, source_lang, target_lang):
+        if self.backend == "ct2":
+            return self._load_ct2(marian_model_name(source_lang, target_lang))
+        return self._load_marian(source_lang, target_lang)
 
-        if model_name not in self.models:
+    def _generate(self, texts, source_lang, target_lang):
+        if self.backend == "marian":
+            return self._translate_marian(texts, source_lang, target_lang)
+        elif self.backend == "m2m100":
+            return self._translate_m2m100(texts, source_lang, target_lang)
+        elif self.backend in ("ct2", "ct2-m2m100"):
+            return self._translate_ct2(texts, source_lang, target_lang)
+        else:
+            return [self._translate_cloud(t, source_lang, target_lang) for t in texts]
+
+    def preload(self, pairs):
+        """
+        Eagerly load and warm up the models for (source, target) pairs.
+
+        Returns {"src-tgt": seconds} for the pairs that loaded; failures are
+        logged and skipped so a missing pair never blocks startup.
+        """
+        timings = {}
+        for source_lang, target_lang in pairs:
+            if source_lang == target_lang:
+                continue
+            started = time.monotonic()
             try:
-                tokenizer = MarianTokenizer.from_pretrained(model_name)
-                model = MarianMTModel.from_pretrained(model_name)
-                self.models[model_name] = (tokenizer, model)
-                logger.info(f"Loaded Marian model: {model_name}")
+                if self.backend not in ("marian", "ct2", "m2m100", "ct2-m2m100"):
+                    continue
+                route = self._route(source_lang, target_lang)
+                for hop_source, hop_target in route:
+                    if self.backend in ("marian", "ct2"):
+                        self.models.pin(marian_model_name(hop_source, hop_target))
+                    else:
+                        self.models.pin(M2M100_MODEL)
+                    self._generate(["Hello."], hop_source, hop_target)  # bypasses the cache
             except Exception as e:
-                logger.error(f"Failed to load Marian model {model_name}: {e}")
-                return text
+                logger.error(f"Preload failed for {source_lang}->{target_lang}: {e}")
+                continue
+            elapsed = round(time.monotonic() - started, 2)
+            timings[f"{source_lang}-{target_lang}"] = elapsed
+            logger.info(f"Preloaded translation {source_lang}->{target_lang} in {elapsed}s")
+        return timings
 
-        tokenizer, model = self.models[model_name]
-        batch = tokenizer([text], return_tensors="pt", padding=True)
+    def _load_marian(self, source_lang, target_lang):
+        """Load (or fetch cached) Marian tokenizer and model for a pair."""
+        from transformers import MarianMTModel, MarianTokenizer
+
+        model_name = marian_model_name(source_lang, target_lang)
+        return self.models.get(model_name, lambda: (
+            MarianTokenizer.from_pretrained(model_name),
+            MarianMTModel.from_pretrained(model_name),
+        ))
+
+    def _load_m2m100(self):
+        from transformers import M2M100ForConditionalGeneration, M2M100Tokenizer
+
+        return self.models.get(M2M100_MODEL, lambda: (
+            M2M100Tokenizer.from_pretrained(M2M100_MODEL),
+            M2M100ForConditionalGeneration.from_pretrained(M2M100_MODEL),
+        ))
+
+    def _load_ct2(self, model_name):
+        """Tokenizer plus CTranslate2 translator for a converted HF model."""
+        import ctranslate2
+        from transformers import AutoTokenizer
+
+        def load():
+            path = ct2_models.convert(model_name)
+            return (
+                AutoTokenizer.from_pretrained(model_name),
+                ctranslate2.Translator(
+                    path, device="cpu", compute_type=config.TRANSLATION_CT2_COMPUTE,
+                    intra_threads=config.TRANSLATION_CT2_THREADS,
+                    inter_threads=config.TRANSLATION_CT2_INTER_THREADS,
+                ),
+            )
+
+        # Weights live inside CTranslate2, so size the entry by the converted files
+        return self.models.get(model_name, load,
+                               size=lambda: ct2_models.disk_bytes(ct2_models.model_path(model_name)))
+
+    def _translate_marian(self, texts, source_lang, target_lang):
+        """
+        Use MarianMT models for translation with proper language mapping.
+        """
+        # A missing pair raises; translate_batch falls back to the originals
+        # so the untranslated text is never cached
+        tokenizer, model = self._load_marian(source_lang, target_lang)
+
+        batch = tokenizer(list(texts), return_tensors="pt", padding=True, truncation=True)
         generated = model.generate(**batch, max_length=256)
-        return tokenizer.decode(generated[0], skip_special_tokens=True)
+        return tokenizer.batch_decode(generated, skip_special_tokens=True)
 
-    def _translate_m2m100(self, text, source_lang, target_lang):
+    def _translate_m2m100(self, texts, source_lang, target_lang):
         """
         Use M2M100 models for multilingual translation.
 
@@ -82,24 +234,39 @@ class Translator:
         - Works with language codes like: en, hi, ta, kn, fr
         - Can be enabled later if needed
         """
-        from transformers import M2M100ForConditionalGeneration, M2M100Tokenizer
-
-        model_name = "facebook/m2m100_418M"
-
-        if model_name not in self.models:
-            tokenizer = M2M100Tokenizer.from_pretrained(model_name)
-            model = M2M100ForConditionalGeneration.from_pretrained(model_name)
-            self.models[model_name] = (tokenizer, model)
-
-        tokenizer, model = self.models[model_name]
+        tokenizer, model = self._load_m2m100()
 
         tokenizer.src_lang = source_lang
-        encoded = tokenizer(text, return_tensors="pt")
+        encoded = tokenizer(list(texts), return_tensors="pt", padding=True, truncation=True)
         generated_tokens = model.generate(
             **encoded,
             forced_bos_token_id=tokenizer.get_lang_id(target_lang)
         )
-        return tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)[0]
+        return tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
+
+    def _translate_ct2(self, texts, source_lang, target_lang):
+        """
+        Opus-MT / M2M100 converted to CTranslate2 (int8 by default): the
+        same batch as the PyTorch path at a fraction of the latency and RSS.
+        """
+        if self.backend == "ct2-m2m100":
+            tokenizer, model = self._load_ct2(M2M100_MODEL)
+            tokenizer.src_lang = source_lang
+            prefix = [[tokenizer.lang_code_to_token[target_lang]]] * len(texts)
+        else:
+            tokenizer, model = self._load_ct2(marian_model_name(source_lang, target_lang))
+            prefix = None
+
+        sources = [tokenizer.convert_ids_to_tokens(tokenizer.encode(t)) for t in texts]
+        results = model.translate_batch(
+            sources, target_prefix=prefix, beam_size=config.TRANSLATION_CT2_BEAM,
+            max_batch_size=config.TRANSLATION_BATCH_SIZE, max_decoding_length=256,
+        )
+        outputs = []
+        for result in results:
+            tokens = result.hypotheses[0][1:] if prefix else result.hypotheses[0]
+            outputs.append(tokenizer.decode(tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True))
+        return outputs
 
     def _translate_cloud(self, text, source_lang, target_lang):
         """
@@ -1,6 +1,8 @@
 import asyncio, logging
 from datetime import datetime
 
+import numpy as np
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -15,3 +17,13 @@ async def run_blocking(fn, *args, **kwargs):
     return await loop.run_in_executor(None, lambda: fn(*args, **kwargs))
 
 
+
+
+def pcm16_to_float32(pcm) -> np.ndarray:
+    """Convert little-endian int16 PCM (bytes or int16 array) to float32 in [-1, 1)."""
+    if isinstance(pcm, np.ndarray):
+        samples = pcm
+    else:
+        # A trailing odd byte is half a sample; drop it rather than fail the buffer
+        samples = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // 2)
+    return samples.astype(np.float32) / 32768.0
@@ -3,43 +3,245 @@ import asyncio
 import logging
 import json
 
+import config
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib json bytes instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack clients fall back to JSON
+    msgpack = None
+
 logger = logging.getLogger("ws_manager")
 
+# Wire formats a client can ask for; binary ones always get coalesced frames
+ENCODINGS = ("json", "orjson", "msgpack")
+
+
+class Subscriber:
+    """One socket on a topic with its own bounded outgoing queue and writer task."""
+
+    def __init__(self, ws: WebSocket, topic, role, language, queue_size,
+                 encoding="json", batch=False):
+        self.ws = ws
+        self.topic = topic
+        self.role = role  # "source" (the room's audio sender) or "listener"
+        self.language = language  # None: receives the room default translation
+        self.encoding = encoding
+        self.batch = batch or encoding != "json"  # one frame per coalescing window
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = 0
+        self.writer = None
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active = {}  # topic -> websocket
-        self.lock = asyncio.Lock()
+    """
+    Pub/sub hub. Any number of listeners per topic plus at most one audio
+    source (a new source replaces the old one). publish() only encodes and
+    enqueues, so a slow client never blocks the pipeline; each subscriber's
+    writer task drains its own queue. When a queue is full, WS_SLOW_POLICY
+    either drops the oldest queued message or disconnects the client.
 
-    async def connect(self, ws: WebSocket, topic="default"):
+    Messages published within WS_COALESCE_MS are delivered together. Each
+    frame is encoded once per (language, encoding) and the same immutable
+    str/bytes is queued to every subscriber sharing it. Batching clients get
+    one {"type": "batch", "messages": [...]} frame per window; plain JSON
+    clients keep one text frame per message.
+    """
+
+    def __init__(self, queue_size=config.WS_SEND_QUEUE, policy=config.WS_SLOW_POLICY,
+                 send_timeout=config.WS_SEND_TIMEOUT_SEC, coalesce_ms=config.WS_COALESCE_MS):
+        self.topics = {}  # topic -> {websocket: Subscriber}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.coalesce = coalesce_ms / 1000.0
+        self.pending = {}  # topic -> [(message, translations)] waiting for the window
+        self.flush_timers = {}
+        self.disconnected_slow = 0
+        self.frames = 0
+
+    async def connect(self, ws: WebSocket, topic="default", encoding="json", batch=False):
+        """Audio source for a room; replaces (and closes) the previous source."""
         await ws.accept()
-        async with self.lock:
-            if topic in self.active:
-                try:
-                    await self.active[topic].close(code=1000)
-                except:
-                    pass
-            self.active[topic] = ws
+        for old in [s for s in self.topics.get(topic, {}).values() if s.role == "source"]:
+            self._remove(old)
+            try:
+                await old.ws.close(code=1000)
+            except:
+                pass
+        self._add(Subscriber(ws, topic, "source", None, self.queue_size,
+                             self._negotiate(encoding), batch))
         logger.info(f"WS connected topic={topic}")
 
+    async def subscribe(self, ws: WebSocket, topic="default", language=None,
+                        encoding="json", batch=False):
+        """Listener; any number per topic, each with its own target language."""
+        await ws.accept()
+        self._add(Subscriber(ws, topic, "listener", language, self.queue_size,
+                             self._negotiate(encoding), batch))
+        logger.info(f"Listener joined topic={topic} language={language}")
+
     async def disconnect(self, ws: WebSocket, topic="default"):
-        async with self.lock:
-            if self.active.get(topic) is ws:
-                del self.active[topic]
-        logger.info(f"WS disconnected topic={topic}")
+        subscriber = self.topics.get(topic, {}).get(ws)
+        if subscriber is not None:
+            self._remove(subscriber)
+            logger.info(f"WS disconnected topic={topic} role={subscriber.role}")
+
+    unsubscribe = disconnect
+
+    def _negotiate(self, encoding):
+        if encoding not in ENCODINGS:
+            logger.info(f"Unknown encoding {encoding!r}, using json")
+            return "json"
+        if encoding == "msgpack" and msgpack is None:
+            logger.warning("msgpack not installed, using json for this client")
+            return "json"
+        return encoding
+
+    def _add(self, subscriber):
+        self.topics.setdefault(subscriber.topic, {})[subscriber.ws] = subscriber
+        subscriber.writer = asyncio.create_task(self._write(subscriber))
+
+    def _remove(self, subscriber):
+        room = self.topics.get(subscriber.topic, {})
+        if room.get(subscriber.ws) is subscriber:
+            del room[subscriber.ws]
+            if not room:
+                del self.topics[subscriber.topic]
+        if subscriber.writer is not None and subscriber.writer is not asyncio.current_task():
+            subscriber.writer.cancel()
+
+    async def _write(self, subscriber):
+        try:
+            while True:
+                frame = await subscriber.queue.get()
+                if isinstance(frame, bytes):
+                    await asyncio.wait_for(subscriber.ws.send_bytes(frame), self.send_timeout)
+                else:
+                    await asyncio.wait_for(subscriber.ws.send_text(frame), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Dropping subscriber on {subscriber.topic}: {type(e).__name__}")
+            self._remove(subscriber)
 
     def has_clients(self, topic="default"):
-        return topic in self.active
+        return bool(self.topics.get(topic))
+
+    def set_language(self, ws: WebSocket, topic, language):
+        subscriber = self.topics.get(topic, {}).get(ws)
+        if subscriber is not None:
+            subscriber.language = language
+
+    def target_languages(self, topic="default") -> set:
+        """Distinct languages the room's listeners currently want."""
+        return {s.language for s in self.topics.get(topic, {}).values() if s.language}
+
+    def publish(self, message: dict, topic="default", translations=None):
+        """
+        Queue a message for every subscriber without waiting on any socket.
+        With `translations` ({language: text}), listeners get the payload with
+        their own translation.
+        """
+        if topic not in self.topics:
+            return
+        if self.coalesce <= 0:
+            self._deliver(topic, [(message, translations)])
+            return
+        self.pending.setdefault(topic, []).append((message, translations))
+        if topic not in self.flush_timers:
+            loop = asyncio.get_running_loop()
+            self.flush_timers[topic] = loop.call_later(self.coalesce, self._flush, topic)
+
+    def _flush(self, topic):
+        self.flush_timers.pop(topic, None)
+        events = self.pending.pop(topic, None)
+        if events:
+            self._deliver(topic, events)
+
+    def _deliver(self, topic, events):
+        translated = any(translations for _, translations in events)
+        frames = {}  # (language, encoding, batch) -> encoded frames, shared
+        for subscriber in list(self.topics.get(topic, {}).values()):
+            language = subscriber.language if translated else None
+            key = (language, subscriber.encoding, subscriber.batch)
+            if key not in frames:
+                messages = [self._localize(m, t, language) for m, t in events]
+                frames[key] = self._encode(messages, subscriber.encoding, subscriber.batch)
+                self.frames += len(frames[key])
+            for frame in frames[key]:
+                self._offer(subscriber, frame)
+
+    @staticmethod
+    def _localize(message, translations, language):
+        if not translations or language is None:
+            return message
+        payload = dict(message["payload"], target_language=language,
+                       translation=translations.get(language, message["payload"].get("translation")))
+        return dict(message, payload=payload)
+
+    @staticmethod
+    def _encode(messages, encoding, batch):
+        if batch and len(messages) > 1:
+            messages = [{"type": "batch", "messages": messages}]
+        if encoding == "msgpack":
+            return [msgpack.packb(m, default=str) for m in messages]
+        if encoding == "orjson":
+            if orjson is not None:
+                return [orjson.dumps(m, default=str) for m in messages]
+            return [json.dumps(m, default=str, ensure_ascii=False).encode("utf-8") for m in messages]
+        return [json.dumps(m, default=str, ensure_ascii=False) for m in messages]
+
+    def notify(self, ws: WebSocket, topic, message: dict):
+        """Queue a control message for one subscriber (e.g. flow control to a source)."""
+        subscriber = self.topics.get(topic, {}).get(ws)
+        if subscriber is not None:
+            for frame in self._encode([message], subscriber.encoding, False):
+                self._offer(subscriber, frame)
 
     async def broadcast(self, message: dict, topic="default"):
-        async with self.lock:
-            ws = self.active.get(topic)
+        """Awaitable form of publish() for callers that expect a coroutine."""
+        self.publish(message, topic)
 
-        if not ws:
-            return  # ✅ NO SOCKET → NO SEND
+    def _offer(self, subscriber, frame):
+        try:
+            subscriber.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        subscriber.dropped += 1
+        if self.policy == "disconnect":
+            self.disconnected_slow += 1
+            logger.warning(f"Disconnecting slow client on {subscriber.topic}")
+            self._remove(subscriber)
+            asyncio.ensure_future(self._close(subscriber.ws, 1013))  # try again later
+        else:
+            subscriber.queue.get_nowait()  # drop the oldest queued frame
+            subscriber.queue.put_nowait(frame)
 
+    async def _close(self, ws, code):
         try:
-            safe = json.dumps(message, default=str, ensure_ascii=False)
-            await ws.send_text(safe)
+            await ws.close(code=code)
         except Exception:
-            await self.disconnect(ws, topic)
\ No newline at end of file
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "disconnected_slow": self.disconnected_slow,
+            "frames_encoded": self.frames,
+            "topics": {
+                topic: {
+                    "sources": sum(1 for s in room.values() if s.role == "source"),
+                    "listeners": sum(1 for s in room.values() if s.role == "listener"),
+                    "languages": sorted({s.language for s in room.values() if s.language}),
+                    "encodings": sorted({s.encoding for s in room.values()}),
+                    "queued": sum(s.queue.qsize() for s in room.values()),
+                    "dropped": sum(s.dropped for s in room.values()),
+                }
+                for topic, room in self.topics.items()
+            },
+        }
@@ -1,8 +1,8 @@
 let socket=null;
 
-export function connectTranscriptSocket(roomId,onTranscript) {
+export function connectTranscriptSocket(roomId,onTranscript,targetLanguage="en") {
     socket=new WebSocket(
-        `ws://127.0.0.1:8000/ws/transcripts/${roomId}`
+        `ws://127.0.0.1:8000/ws/transcripts/${roomId}?lang=${encodeURIComponent(targetLanguage)}`
     );
     socket.onopen=()=>{
         console.log("📝 Transcript WebSocket connected");
@@ -16,4 +16,11 @@ export function connectTranscriptSocket(roomId,onTranscript) {
     };
     socket.onerror=(e)=>
         console.error("📝 Transcript WebSocket error:", e);
-}
\ No newline at end of file
+}
+
+// Switch this listener's translation language without reconnecting
+export function setTranscriptLanguage(targetLanguage) {
+    if(socket && socket.readyState===WebSocket.OPEN){
+        socket.send(JSON.stringify({type:"config",target_language:targetLanguage}));
+    }
+}
@@ -2,19 +2,40 @@ import asyncio
 import base64
 import json
 import logging
+import struct
 import time
+from collections import deque
 
 import pyaudio
 import websockets
 
-from .config import CHANNELS, CHUNK_MS, DEVICE_INDEX, SAMPLE_RATE, SERVER_WS_URL
+from .config import (CHANNELS, CHUNK_MS, CODEC, DEVICE_INDEX, OPUS_BITRATE, OPUS_FRAME_MS,
+                     RESUME_BUFFER_SEC, SAMPLE_RATE, SERVER_WS_URL)
 from .rnnoise_wrapper import RNNoiseProc
 from .vad import VAD
 
+try:
+    import opuslib
+except Exception:  # ImportError, or libopus missing
+    opuslib = None
+
 logger = logging.getLogger("pi_audio")
 
+PROTOCOL_VERSION = 2
+SEQ = struct.Struct(">I")  # frame number prefix on binary frames
+
+
+class Redirected(Exception):
+    """The server sent us to the worker that owns the room."""
+
 
 class PiAudioClient:
+    """
+    Captures continuously, also while the connection is down: speech frames
+    are numbered and kept until the server acks them, so a reconnect resumes
+    the session (same token) and resends only what the server never got.
+    """
+
     def __init__(self):
         self.uri = SERVER_WS_URL
         self.pa = pyaudio.PyAudio()
@@ -22,6 +43,15 @@ class PiAudioClient:
         self.stream = None
         self.rn = RNNoiseProc()
         self.vad = VAD(sample_rate=SAMPLE_RATE)
+        self.codec = CODEC
+        self.encoder = None
+        # Unit numbered and resent: one Opus packet, or one capture chunk
+        self.frame_ms = OPUS_FRAME_MS if CODEC == "opus" else CHUNK_MS
+        self.pending = deque(maxlen=RESUME_BUFFER_SEC * 1000 // self.frame_ms)  # (seq, pcm), unacked
+        self.seq = 0
+        self.session = None  # server session token, kept across reconnects
+        self.throttled = False  # server asked to slow down: no bursts of backlog
+        self.new_audio = asyncio.Event()
 
     def open(self):
         self.stream = self.pa.open(
@@ -34,28 +64,155 @@ class PiAudioClient:
         )
         logger.info("Microphone opened")
 
-    async def send_loop(self):
-        reconnect = 1
+    async def capture_loop(self):
+        loop = asyncio.get_running_loop()
+        step = SAMPLE_RATE * self.frame_ms // 1000 * 2 * CHANNELS
+        while True:
+            data = await loop.run_in_executor(None, self.stream.read, self.chunk, False)
+            data = self.rn.denoise(data)
+            if not self.vad.is_speech(data):
+                continue
+            for i in range(0, len(data) - step + 1, step):
+                self.pending.append((self.seq, data[i:i + step]))  # oldest falls out when full
+                self.seq += 1
+            self.new_audio.set()
+
+    def prune(self, seq):
+        """Forget frames the server has committed."""
+        while self.pending and self.pending[0][0] <= seq:
+            self.pending.popleft()
+
+    async def handshake(self, ws):
+        """
+        Agree on the uplink codec and resume the session; returns (codec, last
+        acked seq), with seq None when the server does not keep sessions. A
+        refused Opus hello is retried as a pcm16 v2 hello, so sessions stay on;
+        only a server that never answers gets unversioned pcm16.
+        """
+        codec = self.codec
+        if codec == "opus" and opuslib is None:
+            logger.warning("opuslib not available, sending pcm16")
+            codec = "pcm16"
+        if codec == "base64":
+            return codec, None  # legacy frames need no handshake
+        reply = await self.hello(ws, codec)
+        if reply is not None and reply["type"] == "error" and codec != "pcm16":
+            logger.warning(f"Server refused {codec}: {reply.get('reason')}, retrying with pcm16")
+            codec = "pcm16"
+            reply = await self.hello(ws, codec)
+        if reply is None:
+            logger.warning("No handshake reply (older server?), sending pcm16")
+            return "pcm16", None
+        if reply["type"] == "error":
+            logger.warning(f"Server refused pcm16: {reply.get('reason')}, sending without a session")
+            return "pcm16", None
+        if codec == "opus":
+            self.encoder = opuslib.Encoder(SAMPLE_RATE, CHANNELS, opuslib.APPLICATION_VOIP)
+            self.encoder.bitrate = OPUS_BITRATE
+        if reply.get("session") is None:
+            return codec, None
+        if not reply.get("resumed"):
+            logger.info("Started a new audio session")
+        self.session = reply["session"]
+        self.prune(reply["ack"])
+        return codec, reply["ack"]
+
+    async def hello(self, ws, codec):
+        """Send a v2 hello; the welcome / error reply, or None on timeout."""
+        await ws.send(json.dumps({
+            "type": "hello",
+            "version": PROTOCOL_VERSION,
+            "codec": codec,
+            "sample_rate": SAMPLE_RATE,
+            "channels": CHANNELS,
+            "frame_ms": self.frame_ms,
+            "session": self.session,
+        }))
+        try:
+            while True:
+                reply = json.loads(await asyncio.wait_for(ws.recv(), timeout=5))
+                self.check_redirect(reply)
+                if reply.get("type") in ("welcome", "error"):
+                    return reply
+        except asyncio.TimeoutError:
+            return None
+
+    async def send_audio(self, ws, codec, seq, data, numbered):
+        if codec == "base64":
+            payload = {
+                "type": "audio",
+                "ts": time.time(),
+                "seq": seq,
+                "data": base64.b64encode(data).decode("ascii"),
+            }
+            await ws.send(json.dumps(payload))
+            return
+        if codec == "opus":
+            data = self.encoder.encode(data, len(data) // (2 * CHANNELS))
+        await ws.send(SEQ.pack(seq) + data if numbered else data)
+
+    async def send_pending(self, ws, codec, acked):
+        numbered = acked is not None
+        sent = acked if numbered else -1
         while True:
-            try:
-                async with websockets.connect(self.uri) as ws:
-                    logger.info("Connected to server")
-                    reconnect = 1
-                    while True:
-                        data = self.stream.read(self.chunk, exception_on_overflow=False)
-                        data = self.rn.denoise(data)
-                        if not self.vad.is_speech(data):
-                            continue
-                        payload = {
-                            "type": "audio",
-                            "ts": time.time(),
-                            "data": base64.b64encode(data).decode("ascii"),
-                        }
-                        await ws.send(json.dumps(payload))
-                        await asyncio.sleep(0)
-            except Exception:
-                logger.exception("ws error")
-                await asyncio.sleep(reconnect)
-                reconnect = min(30, reconnect * 2)
+            self.new_audio.clear()
+            for seq, data in list(self.pending):
+                if seq <= sent:
+                    continue
+                await self.send_audio(ws, codec, seq, data, numbered)
+                sent = seq
+                if not numbered:
+                    self.prune(seq)  # no acks without a session
+                if self.throttled:
+                    await asyncio.sleep(self.frame_ms / 1000.0)  # real time until resumed
+            await self.new_audio.wait()
+
+    def check_redirect(self, message):
+        if message.get("type") == "redirect":
+            self.uri = message["url"]
+            raise Redirected(self.uri)
 
+    async def receive_loop(self, ws):
+        async for message in ws:
+            if isinstance(message, str):
+                data = json.loads(message)
+                self.check_redirect(data)
+                if data.get("type") == "ack":
+                    self.prune(data["seq"])
+                elif data.get("type") == "flow":
+                    self.throttled = data.get("action") == "slow_down"
 
+    async def send_loop(self):
+        capture = asyncio.ensure_future(self.capture_loop())
+        reconnect = 1
+        try:
+            while True:
+                try:
+                    async with websockets.connect(self.uri) as ws:
+                        codec, acked = await self.handshake(ws)
+                        self.throttled = False
+                        logger.info(f"Connected to server, codec={codec}, resume after {acked}")
+                        reconnect = 1
+                        tasks = {asyncio.ensure_future(self.send_pending(ws, codec, acked)),
+                                 asyncio.ensure_future(self.receive_loop(ws))}
+                        try:
+                            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                        except asyncio.CancelledError:
+                            await ws.send(json.dumps({"type": "bye"}))  # no grace period needed
+                            raise
+                        finally:
+                            for task in tasks:
+                                task.cancel()
+                        for task in done:
+                            task.result()  # re-raise the connection error
+                except asyncio.CancelledError:
+                    raise
+                except Redirected as e:
+                    logger.info(f"Room is served by {e}, reconnecting there")
+                except Exception:
+                    logger.exception("ws error")
+                    self.uri = SERVER_WS_URL  # the owner may be gone; start from the entry point
+                    await asyncio.sleep(reconnect)
+                    reconnect = min(30, reconnect * 2)
+        finally:
+            capture.cancel()
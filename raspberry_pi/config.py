@@ -5,4 +5,10 @@ SAMPLE_RATE = 16000
 CHUNK_MS = 200
 CHANNELS = 1
 DEVICE_INDEX = None  # set to an int if you need a specific microphone
-
+# Uplink codec: "opus" (about 10x less bandwidth, needs opuslib), "pcm16"
+# (raw binary frames) or "base64" (legacy JSON frames for old servers)
+CODEC = "opus"
+OPUS_FRAME_MS = 20  # CHUNK_MS must be a multiple of this
+OPUS_BITRATE = 24000
+# Unacknowledged speech kept for resending after a reconnect
+RESUME_BUFFER_SEC = 60
@@ -1,7 +1,990 @@
+import os
+import sys
+
+import pytest
+
 from backend import config
 
+# Backend modules use flat imports (see backend/run.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
 
 def test_config_defaults():
     assert config.SAMPLE_RATE == 16000
     assert config.WHISPER_CHUNK_SEC > 0
 
+
+def test_pcm16_to_float32_scales_into_whisper_input():
+    np = pytest.importorskip("numpy")
+    import asyncio
+    import utils
+    from asr_whisper import WhisperASR
+
+    samples = np.array([-32768, -16384, 0, 16384, 32767], dtype=np.int16)
+    audio = utils.pcm16_to_float32(samples.tobytes())
+    assert audio.dtype == np.float32
+    np.testing.assert_array_equal(audio, [-1.0, -0.5, 0.0, 0.5, 32767 / 32768])
+    np.testing.assert_array_equal(utils.pcm16_to_float32(samples), audio)
+    assert len(utils.pcm16_to_float32(samples.tobytes() + b"\x01")) == 5  # half a sample dropped
+    empty = utils.pcm16_to_float32(b"")
+    assert empty.dtype == np.float32 and empty.shape == (0,)
+
+    asr = WhisperASR(load=False)
+    seen = []
+    asr._transcribe_sync = lambda source, **options: seen.append((source, options)) or ([], None)
+    asyncio.run(asr.transcribe_array(audio.astype(np.float64), language="hi"))
+    source, options = seen[0]
+    assert source.dtype == np.float32 and options["language"] == "hi"
+    np.testing.assert_array_equal(source, audio)
+
+
+def test_local_agreement_commits_common_prefix():
+    pytest.importorskip("numpy")
+    from streaming_asr import LocalAgreement
+
+    policy = LocalAgreement()
+    committed, tail = policy.insert([(0.0, 0.4, " good"), (0.4, 0.8, " morning")])
+    assert committed == [] and len(tail) == 2
+
+    committed, tail = policy.insert([(0.0, 0.4, " good"), (0.4, 0.9, " morning,"), (0.9, 1.2, " class")])
+    assert [w[2] for w in committed] == [" good", " morning,"]
+    assert [w[2] for w in tail] == [" class"]
+    assert policy.committed_end == 0.9
+    assert [w[2] for w in policy.flush()] == [" class"]
+
+
+def test_asr_scheduler_batches_across_rooms_in_order():
+    import asyncio
+    from asr_scheduler import ASRScheduler
+
+    class FakeASR:
+        def __init__(self):
+            self.calls = []
+
+        def transcribe_batch(self, audios, languages=None, **options):
+            self.calls.append(list(audios))
+            return [([{"text": a}], None) for a in audios]
+
+    async def scenario():
+        fake = FakeASR()
+        scheduler = ASRScheduler(fake, max_batch=8, max_wait_ms=50, queue_size=16)
+        scheduler.start()
+        results = await asyncio.gather(
+            scheduler.transcribe("a", "a1"),
+            scheduler.transcribe("b", "b1"),
+            scheduler.transcribe("a", "a2"),
+        )
+        await scheduler.stop()
+        return fake.calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert [r[0][0]["text"] for r in results] == ["a1", "b1", "a2"]
+    assert calls == [["a1", "b1"], ["a2"]]
+
+
+def test_asr_scheduler_runs_bulk_behind_live_and_never_sheds_it(monkeypatch):
+    import asyncio
+    import types
+    import asr_scheduler
+    import asr_tiers
+
+    class FakeASR:
+        def __init__(self):
+            self.calls = []
+
+        def transcribe_batch(self, audios, languages=None, **options):
+            self.calls.append(list(audios))
+            return [([{"text": a}], types.SimpleNamespace()) for a in audios]
+
+    async def scenario():
+        fake = FakeASR()
+        scheduler = asr_scheduler.ASRScheduler(fake, max_batch=8, max_wait_ms=20, queue_size=4)
+        # Bulk queued first still waits for live audio, and never shares its batch
+        first = [asyncio.ensure_future(scheduler.transcribe("job#0", "b1", bulk=True)),
+                 asyncio.ensure_future(scheduler.transcribe("room", "l1"))]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth() == 1 and scheduler.bulk_depth() == 1
+        scheduler.start()
+        await asyncio.gather(*first)
+
+        # Under the shed tier late live chunks are dropped, late bulk pieces are not
+        monkeypatch.setattr(asr_scheduler.config, "ASR_DEADLINE_SEC", -1.0)
+        scheduler.quality.level = len(asr_tiers.TIERS) - 1
+        live, bulk = await asyncio.gather(scheduler.transcribe("room", "l2"),
+                                          scheduler.transcribe("job#0", "b2", bulk=True))
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return fake.calls, live, bulk, stats
+
+    calls, live, bulk, stats = asyncio.run(scenario())
+    assert calls == [["l1"], ["b1"], ["b2"]]
+    assert live == ([], None) and bulk[0][0]["text"] == "b2"
+    assert stats["dropped"] == 1
+
+
+def test_segmenter_drops_silence_and_cuts_on_endpoint():
+    np = pytest.importorskip("numpy")
+    from segmenter import SpeechSegmenter
+
+    seg = SpeechSegmenter(preroll_ms=60, hangover_ms=90, min_speech_ms=60, max_utterance_sec=5)
+    seg.vad = None  # energy gate only, deterministic
+    rate = config.SAMPLE_RATE
+    silence = np.zeros(rate // 2, dtype=np.int16)
+    tone = (np.sin(np.arange(rate // 2) * 2 * np.pi * 220 / rate) * 8000).astype(np.int16)
+
+    assert seg.feed(silence.tobytes()) == []
+    utterances = seg.feed(np.concatenate([tone, silence]).tobytes())
+    assert len(utterances) == 1
+    # pre-roll + speech + hangover, but not the trailing silence
+    assert len(tone) * 2 < len(utterances[0]) < (len(tone) + len(silence)) * 2
+    assert seg.flush() == []
+
+
+def test_room_language_cache_votes_and_ttl():
+    from language_id import RoomLanguageCache
+
+    now = [0.0]
+    cache = RoomLanguageCache(ttl_sec=60, min_speech_sec=2, max_speech_sec=6,
+                              min_confidence=0.7, clock=lambda: now[0])
+    assert cache.vote("room", {"hi": 0.5, "ur": 0.5}, 1.0) is None
+    assert cache.leader("room") in ("hi", "ur")
+    assert cache.vote("room", {"hi": 0.95, "ur": 0.05}, 4.0) == "hi"
+    assert cache.get("room") == "hi"
+
+    now[0] = 59.0
+    assert cache.get("room") == "hi"  # reading refreshes the TTL
+    now[0] = 118.0
+    assert cache.get("room") == "hi"
+    now[0] = 200.0
+    assert cache.get("room") is None
+
+
+def test_quality_controller_steps_down_and_recovers():
+    from asr_tiers import QualityController
+
+    now = [0.0]
+    quality = QualityController(enabled=True, rtf_high=0.8, rtf_low=0.4, queue_high=16,
+                                dwell_sec=5, clock=lambda: now[0])
+    assert quality.tier["name"] == "full"
+    for name in ("greedy", "fast", "shed", "shed"):
+        now[0] += 6
+        quality.observe(queue_depth=40, rtf=1.5)
+        assert quality.tier["name"] == name
+
+    quality.observe(queue_depth=0, rtf=0.1)  # within dwell time: no change
+    assert quality.tier["name"] == "shed"
+    for _ in range(10):
+        now[0] += 6
+        quality.observe(queue_depth=0, rtf=0.1)
+    assert quality.tier["name"] == "full"
+
+
+def test_segmenter_split_reports_piece_offsets():
+    np = pytest.importorskip("numpy")
+    from segmenter import SpeechSegmenter
+
+    seg = SpeechSegmenter(preroll_ms=0, hangover_ms=90, min_speech_ms=60, max_utterance_sec=5)
+    seg.vad = None
+    rate = config.SAMPLE_RATE
+    silence = np.zeros(rate, dtype=np.int16)
+    tone = (np.sin(np.arange(rate // 2) * 2 * np.pi * 220 / rate) * 8000).astype(np.int16)
+    recording = np.concatenate([silence, tone, silence, tone, silence])
+
+    pieces = seg.split(recording.tobytes())
+    starts = [start / rate for start, _ in pieces]
+    assert len(pieces) == 2
+    assert abs(starts[0] - 1.0) < 0.05 and abs(starts[1] - 2.5) < 0.05
+
+
+def test_bulk_job_segments_recording_window_by_window(monkeypatch):
+    np = pytest.importorskip("numpy")
+    import asyncio
+    import asr_whisper
+    import bulk_jobs
+    from segmenter import SpeechSegmenter
+
+    rate = config.SAMPLE_RATE
+    silence = np.zeros(rate, dtype=np.int16)
+    tone = (np.sin(np.arange(rate // 2) * 2 * np.pi * 220 / rate) * 8000).astype(np.int16)
+    pcm = np.concatenate([silence, tone, silence, tone, silence, tone]).tobytes()
+    window = int(0.7 * rate) * 2  # decode windows do not line up with VAD frames
+
+    def windows(path):
+        for start in range(0, len(pcm), window):
+            yield pcm[start:start + window]
+
+    monkeypatch.setattr(asr_whisper, "decode_audio_windows", windows)
+    manager = bulk_jobs.BulkJobManager(None, None, None, parallel=2)
+    job = bulk_jobs.BulkJob(id="j", room_id="r", files=["talk.wav"], offset_sec=1.2)
+
+    async def collect():
+        return [w async for w in manager._piece_windows(job, "talk.wav")]
+
+    batches = asyncio.run(collect())
+    whole = SpeechSegmenter(max_utterance_sec=config.BULK_MAX_PIECE_SEC).split(pcm)
+    expected = [(start / rate, piece) for start, piece in whole if start / rate >= 1.2]
+    assert [len(b) for b in batches] == [2]  # the piece before the resume offset is skipped
+    assert [start for start, _ in batches[0]] == [start for start, _ in expected]
+    for (_, got), (_, piece) in zip(batches[0], expected):
+        np.testing.assert_array_equal(got, np.frombuffer(piece, dtype=np.int16) / 32768.0)
+    assert job.file_duration_sec == len(pcm) / 2 / rate
+
+
+def test_translation_batcher_groups_by_language_pair():
+    import asyncio
+    from translation_batcher import TranslationBatcher
+
+    class FakeTranslator:
+        def __init__(self):
+            self.calls = []
+
+        def translate_batch(self, texts, source_lang, target_lang):
+            self.calls.append((source_lang, target_lang, list(texts)))
+            return [f"{target_lang}:{t}" for t in texts]
+
+    async def scenario():
+        fake = FakeTranslator()
+        batcher = TranslationBatcher(fake, max_batch=8, max_wait_ms=20)
+        results = await asyncio.gather(
+            batcher.translate("namaste", "hi", "en"),
+            batcher.translate("okay", "hi", "en"),
+            batcher.translate("okay", "hi", "en"),
+            batcher.translate("vanakkam", "ta", "en"),
+            batcher.translate("same", "en", "en"),
+        )
+        await batcher.stop()
+        return fake.calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert results == ["en:namaste", "en:okay", "en:okay", "en:vanakkam", "same"]
+    assert sorted(calls) == [("hi", "en", ["namaste", "okay"]), ("ta", "en", ["vanakkam"])]
+
+
+def test_room_pipeline_overlaps_stages_in_order():
+    import asyncio
+    from pipeline import RoomPipeline
+
+    async def scenario():
+        events, delivered = [], []
+        gate = asyncio.Event()
+
+        async def asr(room, item):
+            events.append(("asr", item))
+            if item == 2:
+                gate.set()  # chunk 2 is in the ASR while chunk 1 is translated
+            return [item]
+
+        async def translate(room, item):
+            if item == 1:
+                await gate.wait()
+            events.append(("translate", item))
+            return [item]
+
+        async def deliver(room, item):
+            delivered.append(item)
+            return ()
+
+        room = RoomPipeline("r1", [("asr", asr, None), ("translate", translate, None),
+                                   ("broadcast", deliver, asyncio.Semaphore(1))])
+        for item in (1, 2, 3):
+            await room.put(item, stage="asr")
+        await room.close()
+        return events, delivered
+
+    events, delivered = asyncio.run(scenario())
+    assert delivered == [1, 2, 3]
+    assert events.index(("asr", 2)) < events.index(("translate", 1))
+
+
+def test_translator_cache_skips_generation_for_repeats():
+    pytest.importorskip("numpy")
+    from translation_cache import TranslationCache
+    from translation_engine import Translator
+
+    translator = Translator(backend="marian", cache=TranslationCache(max_entries=2, persist=False))
+    calls = []
+
+    def generate(texts, source_lang, target_lang):
+        calls.append(list(texts))
+        return [t.upper() for t in texts]
+
+    translator._generate = generate
+    assert translator.translate_batch(["okay", "next slide"], "hi", "en") == ["OKAY", "NEXT SLIDE"]
+    assert translator.translate_batch(["okay ", "namaste"], "hi", "en") == ["OKAY", "NAMASTE"]
+    assert calls == [["okay", "next slide"], ["namaste"]]
+    # LRU of two: "next slide" was evicted, "okay" stayed
+    assert translator.cache.stats()["entries"] == 2
+    translator.translate_batch(["next slide"], "hi", "en")
+    assert calls[-1] == ["next slide"]
+    assert translator.cache.stats()["hits"] == 1
+
+
+def test_translator_ct2_tokenizes_and_strips_m2m100_target_prefix(monkeypatch):
+    pytest.importorskip("numpy")
+    import sys
+    import types
+    import ct2_models
+    from translation_engine import M2M100_MODEL, Translator
+
+    class FakeTokenizer:
+        lang_code_to_token = {"hi": "__hi__", "ta": "__ta__"}
+
+        def __init__(self):
+            self.src_lang = None
+            self.vocab = ["</s>", "__hi__", "__ta__"]
+
+        def encode(self, text):
+            words = ([f"__{self.src_lang}__"] if self.src_lang else []) + text.split() + ["</s>"]
+            return self.convert_tokens_to_ids(words)
+
+        def convert_tokens_to_ids(self, tokens):
+            for token in tokens:
+                if token not in self.vocab:
+                    self.vocab.append(token)
+            return [self.vocab.index(t) for t in tokens]
+
+        def convert_ids_to_tokens(self, ids):
+            return [self.vocab[i] for i in ids]
+
+        def decode(self, ids, skip_special_tokens=False):
+            tokens = self.convert_ids_to_tokens(ids)
+            if skip_special_tokens:
+                tokens = [t for t in tokens if t != "</s>"]
+            return " ".join(tokens)
+
+    class FakeTranslator:
+        calls = []
+
+        def __init__(self, path, **options):
+            self.path = path
+
+        def translate_batch(self, sources, target_prefix=None, **options):
+            FakeTranslator.calls.append((self.path, sources, target_prefix))
+            prefixes = target_prefix or [[]] * len(sources)
+            return [types.SimpleNamespace(hypotheses=[prefix + [t.upper() for t in source if t.isalpha()]])
+                    for source, prefix in zip(sources, prefixes)]
+
+    monkeypatch.setitem(sys.modules, "ctranslate2", types.SimpleNamespace(Translator=FakeTranslator))
+    monkeypatch.setitem(sys.modules, "transformers", types.SimpleNamespace(
+        AutoTokenizer=types.SimpleNamespace(from_pretrained=lambda name: FakeTokenizer())))
+    monkeypatch.setattr(ct2_models, "convert", lambda name: f"ct2/{name}")
+    monkeypatch.setattr(ct2_models, "disk_bytes", lambda path: 1)
+
+    m2m = Translator(backend="ct2-m2m100")
+    m2m.cache = None
+    assert m2m.translate_batch(["vanakkam nanba"], "ta", "hi") == ["VANAKKAM NANBA"]
+    path, sources, prefix = FakeTranslator.calls[-1]
+    assert path == f"ct2/{M2M100_MODEL}"
+    assert sources == [["__ta__", "vanakkam", "nanba", "</s>"]] and prefix == [["__hi__"]]
+
+    marian = Translator(backend="ct2")
+    marian.cache = None
+    assert marian.translate_batch(["namaste", "shukriya ji"], "hi", "en") == ["NAMASTE", "SHUKRIYA JI"]
+    path, sources, prefix = FakeTranslator.calls[-1]
+    assert path == "ct2/Helsinki-NLP/opus-mt-hi-en" and prefix is None
+    assert sources == [["namaste", "</s>"], ["shukriya", "ji", "</s>"]]
+
+
+def test_model_registry_budget_eviction_and_failed_loads():
+    from model_registry import ModelRegistry, ModelUnavailable
+
+    now = [0.0]
+    registry = ModelRegistry(budget_mb=2, idle_sec=60, retry_sec=30,
+                             sizer=lambda value: value * 2**20, clock=lambda: now[0])
+    registry.pin("hi-en")
+    registry.get("hi-en", lambda: 1)
+    registry.get("ta-en", lambda: 1)
+    registry.get("kn-en", lambda: 1)  # over budget: LRU unpinned ta-en goes
+    assert "hi-en" in registry and "kn-en" in registry and "ta-en" not in registry
+
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise OSError("no such model")
+
+    for _ in range(3):
+        with pytest.raises((OSError, ModelUnavailable)):
+            registry.get("xx-en", broken)
+    assert len(attempts) == 1
+    now[0] = 120.0
+    registry.get("hi-en", lambda: 1)  # kn-en idle for 120s is dropped
+    assert "kn-en" not in registry and registry.stats()["models"]["hi-en"]["pinned"]
+    with pytest.raises(OSError):
+        registry.get("xx-en", broken)
+    assert len(attempts) == 2
+
+
+def test_translator_pivots_through_english_without_direct_model():
+    pytest.importorskip("numpy")
+    from translation_engine import Translator
+
+    translator = Translator(backend="marian")
+    translator.cache = None
+    calls = []
+
+    now = [0.0]
+    translator.models.clock = lambda: now[0]
+    outage = {("ta", "te")}
+
+    def load_pair(source_lang, target_lang):
+        if (source_lang, target_lang) == ("ta", "hi"):
+            raise OSError("opus-mt-ta-hi is not a local folder and is not a valid model identifier")
+        if (source_lang, target_lang) in outage:
+            raise OSError("connection reset")
+
+    def generate(texts, source_lang, target_lang):
+        calls.append((source_lang, target_lang, list(texts)))
+        return [f"{t}>{target_lang}" for t in texts]
+
+    translator._load_pair = load_pair
+    translator._generate = generate
+    assert translator.translate_batch(["vanakkam", "nandri"], "ta", "hi") == \
+        ["vanakkam>en>hi", "nandri>en>hi"]
+    assert calls == [("ta", "en", ["vanakkam", "nandri"]), ("en", "hi", ["vanakkam>en", "nandri>en"])]
+    assert translator.routes[("ta", "hi")] == [("ta", "en"), ("en", "hi")]
+
+    # A load failure of an existing model only pivots until the registry retries it
+    assert translator._route("ta", "te") == [("ta", "en"), ("en", "te")]
+    outage.clear()
+    assert translator._route("ta", "te") == [("ta", "en"), ("en", "te")]
+    now[0] = translator.models.retry_sec
+    assert translator._route("ta", "te") == [("ta", "te")]
+    assert translator._route("ta", "hi") == [("ta", "en"), ("en", "hi")]
+
+
+def test_connection_manager_fans_out_per_language_and_drops_slow_clients():
+    import asyncio
+    import json
+    pytest.importorskip("fastapi")
+    from websocket_manager import ConnectionManager
+
+    class FakeSocket:
+        def __init__(self, stall=False):
+            self.sent = []
+            self.stall = stall
+
+        async def accept(self):
+            pass
+
+        async def send_text(self, text):
+            if self.stall:
+                await asyncio.Event().wait()
+            self.sent.append(json.loads(text))
+
+        async def close(self, code=1000):
+            pass
+
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, policy="drop_oldest", send_timeout=10, coalesce_ms=0)
+        source, hindi, tamil, slow = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket(stall=True)
+        await manager.connect(source, "r1")
+        await manager.subscribe(hindi, "r1", "hi")
+        await manager.subscribe(tamil, "r1", "ta")
+        await manager.subscribe(slow, "r1", "ta")
+        assert manager.target_languages("r1") == {"hi", "ta"}
+        for i in range(5):
+            manager.publish({"type": "transcript", "payload": {"text": f"t{i}", "translation": "en"}},
+                            "r1", translations={"hi": f"hi{i}", "ta": f"ta{i}"})
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.01)
+        stats = manager.stats()["topics"]["r1"]
+        for ws in (source, hindi, tamil, slow):
+            await manager.disconnect(ws, "r1")
+        return source, hindi, tamil, stats
+
+    source, hindi, tamil, stats = asyncio.run(scenario())
+    assert [m["payload"]["translation"] for m in hindi.sent] == ["hi0", "hi1", "hi2", "hi3", "hi4"]
+    assert [m["payload"]["translation"] for m in tamil.sent] == ["ta0", "ta1", "ta2", "ta3", "ta4"]
+    assert source.sent[0]["payload"]["translation"] == "en"
+    assert stats["sources"] == 1 and stats["listeners"] == 3 and stats["dropped"] > 0
+
+
+def test_sentence_aggregator_flushes_on_terminator_and_timeouts():
+    from sentence_aggregator import SentenceAggregator
+
+    now = [0.0]
+    agg = SentenceAggregator(pause_sec=0.8, max_latency_sec=3.0, max_chars=300, clock=lambda: now[0])
+    fragment = lambda text, lang="en": {"text": text, "language": lang, "tier": "full"}
+
+    assert agg.add([fragment(" Good morning")]) == []
+    now[0] = 0.5
+    out = agg.add([fragment(" everyone. Today we")])
+    assert [s["text"] for s in out] == ["Good morning everyone."]
+    assert agg.parts == ["Today we"]
+
+    now[0] = 1.0
+    assert agg.expire() == []
+    now[0] = 1.4  # 0.9s without a new fragment
+    assert [s["text"] for s in agg.expire()] == ["Today we"]
+
+    # A steady stream without terminators still goes out after max latency
+    for t in (2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0):
+        now[0] = t
+        agg.add([fragment(" and")])
+    assert agg.deadline() == 5.0
+    now[0] = 5.0
+    assert agg.expire()[0]["text"].count("and") == 7
+    assert [s["language"] for s in agg.add([fragment("ek"), fragment("two", lang="hi")])] == ["en"]
+
+    # A terminator inside a fragment splits its span; the tail's latency clock starts at the cut
+    timed = SentenceAggregator(pause_sec=0.8, max_latency_sec=3.0, max_chars=300, clock=lambda: now[0])
+    now[0] = 10.0
+    timed.add([dict(fragment("Good morning"), start=0.0, end=1.0)])
+    head = timed.add([dict(fragment("everyone. Today we"), start=1.0, end=3.0)])[0]
+    assert timed.first_at == 9.0  # "Today we" was spoken a second before it arrived
+    tail = timed.flush()[0]
+    assert (head["start"], head["end"]) == (0.0, 2.0) and (tail["start"], tail["end"]) == (2.0, 3.0)
+    assert head["end"] <= tail["start"]
+
+
+def test_connection_manager_coalesces_window_into_shared_frames():
+    import asyncio
+    import json
+    pytest.importorskip("fastapi")
+    from websocket_manager import ConnectionManager
+
+    class FakeSocket:
+        def __init__(self):
+            self.sent = []
+
+        async def accept(self):
+            pass
+
+        async def send_text(self, text):
+            self.sent.append(text)
+
+    async def scenario():
+        manager = ConnectionManager(coalesce_ms=20)
+        plain, batched, batched2 = FakeSocket(), FakeSocket(), FakeSocket()
+        await manager.subscribe(plain, "r1", "hi")
+        await manager.subscribe(batched, "r1", "hi", batch=True)
+        await manager.subscribe(batched2, "r1", "hi", batch=True)
+        for i in range(3):
+            manager.publish({"type": "transcript", "payload": {"text": f"t{i}"}}, "r1",
+                            translations={"hi": f"hi{i}"})
+        await asyncio.sleep(0.05)
+        frames = manager.stats()["frames_encoded"]
+        for ws in (plain, batched, batched2):
+            await manager.disconnect(ws, "r1")
+        return plain, batched, batched2, frames
+
+    plain, batched, batched2, frames = asyncio.run(scenario())
+    assert len(plain.sent) == 3 and len(batched.sent) == 1
+    assert batched.sent[0] is batched2.sent[0]  # encoded once, shared
+    frame = json.loads(batched.sent[0])
+    assert frame["type"] == "batch"
+    assert [m["payload"]["translation"] for m in frame["messages"]] == ["hi0", "hi1", "hi2"]
+    assert frames == 4
+
+
+def test_ingest_queue_overflow_policies_never_block():
+    import asyncio
+    from pipeline import IngestQueue
+
+    async def scenario():
+        frame = b"\x00\x00" * 1600  # 0.1 s
+        dropping = IngestQueue(maxsize=2, policy="drop_oldest", sample_rate=16000)
+        merging = IngestQueue(maxsize=2, policy="merge", sample_rate=16000, merge_max_sec=0.25)
+        throttling = IngestQueue(maxsize=4, policy="slow_down", sample_rate=16000)
+        for i in range(3):
+            dropping.offer(frame, float(i))
+            merging.offer(frame, float(i))
+        merged = [merging.stats()["queued_sec"], merging.merged]
+        merging.offer(frame, 3.0)  # past merge_max_sec: the oldest audio goes instead
+        signals = [throttling.offer(frame, 0.0) for _ in range(4)]
+        control = IngestQueue(maxsize=1, sample_rate=16000)
+        control.put_nowait(("flush", b"", 0.0, None))
+        control.offer(frame, 1.0)
+        return dropping, merging, merged, signals, control
+
+    dropping, merging, merged, signals, control = asyncio.run(scenario())
+    assert [item[2] for item in dropping._queue] == [1.0, 2.0]
+    assert dropping.stats()["dropped_sec"] == 0.1
+    assert merged == [0.3, 1] and [item[2] for item in merging._queue] == [1.0, 3.0]
+    assert merging.get_nowait()[1] == b"\x00\x00" * 3200 and merging.stats()["dropped_sec"] == 0.1
+    assert control.qsize() == 1 and control.stats()["dropped_sec"] == 0.1
+    assert signals == [False, False, True, True]
+
+
+def test_audio_ring_buffer_views_wrap_without_copy():
+    np = pytest.importorskip("numpy")
+    from audio_buffer import AudioOverwritten, AudioRingBuffer
+
+    ring = AudioRingBuffer(capacity_sec=1, sample_rate=10)
+    samples = (np.arange(16) * 1024).astype(np.int16)
+    ring.write(samples[:8].tobytes())
+    ring.write(samples[8:])  # wraps past the end of the ring
+
+    assert (ring.start, ring.end) == (6, 16)
+    window = ring.view(7, 15)  # crosses the wrap point, still one slice
+    assert np.shares_memory(window, ring._data) and not window.flags.writeable
+    np.testing.assert_allclose(window, np.arange(7, 15) / 32.0)
+    with pytest.raises(AudioOverwritten):
+        ring.view(5)
+    ring.write(samples[:2])  # a writer wrapping over a view handed out earlier
+    assert not ring.holds(7) and ring.holds(8)
+
+
+def test_ingest_decoder_handshake_and_legacy_frames():
+    import base64
+    import ingest_protocol
+
+    decoder = ingest_protocol.IngestDecoder(sample_rate=16000)
+    pcm = b"\x01\x00\x02\x00"
+    # legacy Pi frames work without a handshake
+    assert decoder.decode_text({"type": "audio", "data": base64.b64encode(pcm).decode()}) == (None, pcm)
+    assert decoder.decode_text({"type": "audio", "data": "not base64!"}) == (None, None)
+
+    refused = decoder.hello({"type": "hello", "version": 99, "codec": "pcm16"})
+    assert refused["type"] == "error" and decoder.codec == "pcm16"
+    assert decoder.hello({"type": "hello", "version": 1, "codec": "pcm16", "sample_rate": 8000})["type"] == "error"
+
+    welcome = decoder.hello({"type": "hello", "version": 1, "codec": "pcm16", "sample_rate": 16000})
+    assert welcome["type"] == "welcome" and decoder.version == 1
+    assert decoder.decode_binary(pcm + b"\x03") == (None, pcm)  # odd trailing byte dropped
+    assert decoder.stats()["pcm_bytes"] == 8 and decoder.stats()["errors"] == 3
+
+    decoder.hello({"type": "hello", "version": 2, "codec": "pcm16"})
+    assert decoder.decode_binary(ingest_protocol.SEQ.pack(7) + pcm) == (7, pcm)
+
+
+def test_audio_session_dedupes_resends_and_survives_grace_period():
+    import asyncio
+    from audio_sessions import SessionRegistry
+
+    async def scenario():
+        registry = SessionRegistry(grace_sec=0.01)
+        acks, expired = [], []
+        session = registry.open("room1")
+        registry.attach(session, "ws1", acks.append)
+        accepted = [session.accept(seq) for seq in (0, 1, 3)]
+        session.commit(1)
+        session.commit(3)  # within AUDIO_ACK_INTERVAL_MS of the first ack
+
+        async def on_expire():
+            expired.append(True)
+
+        registry.detach(session, on_expire)
+        resumed = registry.resume(session.token, "room1")
+        ended_grace = registry.attach(resumed, "ws2", acks.append)
+        duplicate = resumed.accept(3)  # resent after the reconnect
+
+        other = registry.open("room1")
+        fresh = other.accept(500)  # sender resuming a session this server never saw
+        registry.detach(other, on_expire)
+        await asyncio.sleep(0.05)
+        return session, resumed, accepted + [fresh], acks, ended_grace, duplicate, expired, registry
+
+    session, resumed, accepted, acks, ended_grace, duplicate, expired, registry = asyncio.run(scenario())
+    assert accepted == [True, True, True, True] and session.lost == 1
+    assert acks == [{"type": "ack", "seq": 1}] and session.committed_seq == 3
+    assert resumed is session and ended_grace and not duplicate
+    assert registry.resume(session.token, "room2") is None
+    assert expired == [True] and registry.stats()["expired"] == 1 and registry.stats()["active"] == 1
+    registry.close(session)  # counters outlive their sessions
+    stats = registry.stats()
+    assert (stats["active"], stats["resumes"], stats["duplicates"], stats["lost"]) == (0, 1, 1, 1)
+
+
+def test_memory_room_state_leases_and_broker():
+    import asyncio
+    from room_state import MemoryBroker, MemoryRoomStore
+
+    now = [0.0]
+    store = MemoryRoomStore(clock=lambda: now[0])
+    broker = MemoryBroker()
+    delivered = []
+
+    async def scenario():
+        await broker.start(lambda topic, event: delivered.append((topic, event)))
+        first = await store.claim("r1", "w1", "ws://a", ttl=10)
+        contested = await store.claim("r1", "w2", "ws://b", ttl=10)
+        now[0] = 11.0  # w1 stopped renewing
+        taken_over = await store.claim("r1", "w2", "ws://b", ttl=10)
+        await store.set("r1", "listeners:w1", ["hi"])
+        await store.set("r1", "listeners:w2", ["ta", "hi"])
+        await store.set("r1", "target_language", "en")
+        shared = await store.scan("r1", "listeners:")
+        await broker.publish("r1", {"message": {"type": "transcript"}})
+        return first, contested, taken_over, shared
+
+    first, contested, taken_over, shared = asyncio.run(scenario())
+    assert first["worker"] == "w1" and contested["worker"] == "w1"
+    assert taken_over == {"worker": "w2", "url": "ws://b"}
+    assert set().union(*shared.values()) == {"hi", "ta"}
+    assert delivered == [("r1", {"message": {"type": "transcript"}})]
+
+
+def test_redis_room_state_reaches_other_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis runs the lease scripts with it
+    import asyncio
+    from room_state import RedisBroker, RedisRoomStore
+
+    async def scenario():
+        server = fakeredis.FakeServer()
+        worker_a = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        worker_b = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        store_a, store_b = RedisRoomStore(worker_a), RedisRoomStore(worker_b)
+        broker_a, broker_b = RedisBroker(worker_a), RedisBroker(worker_b)
+        received = []
+        await broker_b.start(lambda topic, event: received.append((topic, event)))
+        await broker_a.start(lambda topic, event: None)
+
+        owner = await store_a.claim("r1", "a", "ws://a", ttl=10)
+        redirected = await store_b.claim("r1", "b", "ws://b", ttl=10)
+        await store_b.set("r1", "listeners:b", ["ta"])
+        languages = await store_a.scan("r1", "listeners:")
+        await broker_a.publish("r1", {"message": {"type": "transcript", "payload": {"text": "x"}}})
+        for _ in range(50):
+            if received:
+                break
+            await asyncio.sleep(0.01)
+        await store_b.release("r1", "b")  # not b's lease: kept
+        kept = await store_b.claim("r1", "b", "ws://b", ttl=10)
+        await store_a.release("r1", "a")
+        reclaimed = await store_b.claim("r1", "b", "ws://b", ttl=10)
+        await broker_a.stop()
+        await broker_b.stop()
+        return owner, redirected, languages, received, kept, reclaimed
+
+    owner, redirected, languages, received, kept, reclaimed = asyncio.run(scenario())
+    assert owner["worker"] == "a" and redirected == kept == {"worker": "a", "url": "ws://a"}
+    assert languages == {"listeners:b": ["ta"]}
+    assert received == [("r1", {"message": {"type": "transcript", "payload": {"text": "x"}}})]
+    assert reclaimed["worker"] == "b"
+
+
+def test_transcript_writer_groups_rows_and_drains_on_stop():
+    import asyncio
+    from transcript_writer import TranscriptWriter
+
+    batches = []
+
+    def save(rows):
+        batches.append(list(rows))
+        return [{"id": i, "text": row} for i, row in enumerate(rows)]
+
+    async def scenario():
+        writer = TranscriptWriter(save, batch_size=3, flush_ms=20, durability="async")
+        writer.start()
+        queued = await writer.write(["r1-a"])  # returns before any write
+        await writer.write(["r2-a"])
+        written_before = len(batches)
+        await asyncio.sleep(0.05)  # flush interval: both rooms in one transaction
+        waited = await writer.write(["r1-b"], wait=True)
+        await writer.write(["x", "y", "z", "w"])
+        await writer.stop()
+
+        off = TranscriptWriter(save, durability="off")
+        skipped = await off.write(["dropped"])
+
+        def flaky(rows):
+            if rows == ["boom"]:
+                raise RuntimeError("database is locked")
+            return list(rows)
+
+        failing = TranscriptWriter(flaky, batch_size=2, flush_ms=10)
+        failing.start()
+        with pytest.raises(RuntimeError):
+            await failing.write(["boom"], wait=True)
+        await failing.write(["ok1", "ok2"], wait=True)
+        await failing.stop()
+        return queued, written_before, waited, writer.stats(), skipped, failing.stats()
+
+    queued, written_before, waited, stats, skipped, failing = asyncio.run(scenario())
+    assert queued is None and written_before == 0
+    assert batches[0] == ["r1-a", "r2-a"]
+    assert waited == [{"id": 0, "text": "r1-b"}]
+    assert [row for batch in batches[2:] for row in batch] == ["x", "y", "z", "w"]
+    assert all(len(batch) <= 3 for batch in batches)
+    assert stats["written"] == 7 and stats["queued"] == 0 and stats["failed"] == 0
+    assert skipped is None and "dropped" not in [row for batch in batches for row in batch]
+    assert (failing["batches"], failing["failed"], failing["avg_batch"]) == (2, 1, 2.0)
+
+
+def test_asr_worker_pool_gives_up_on_failing_model_loads(monkeypatch):
+    import asr_workers
+
+    class DeadProcess:
+        exitcode = 1
+
+        def is_alive(self):
+            return False
+
+    pool = asr_workers.ASRWorkerPool(workers=1)
+    pool.running = True
+    spawned = []
+
+    def spawn(worker):
+        spawned.append(worker.generation)
+        worker.generation += 1
+        worker.ready = False
+        worker.process = DeadProcess()
+
+    monkeypatch.setattr(pool, "_spawn", spawn)
+    monkeypatch.setattr(asr_workers.config, "ASR_WORKER_MAX_RESTARTS", 3)
+    monkeypatch.setattr(asr_workers.config, "ASR_WORKER_TIMEOUT_SEC", 0.01)
+    pool._spawn(pool.workers[0])
+    pool.workers[0].error = "RuntimeError: model not found"
+    for _ in range(10):
+        pool._check_workers()
+        pool.workers[0].retry_at = min(pool.workers[0].retry_at, 1.0)  # skip the backoff wait
+
+    assert pool.workers[0].given_up and len(spawned) == 3
+    assert "model not found" in pool.error
+    with pytest.raises(RuntimeError, match="model not found"):
+        pool.transcribe_batch([])
+
+
+def _fresh_main(monkeypatch, tmp_path, asr, load_models=None):
+    """backend.main with its own database, stub ASR and fresh per-app state (one app lifecycle)."""
+    pytest.importorskip("numpy")
+    pytest.importorskip("fastapi")
+    sqlalchemy = pytest.importorskip("sqlalchemy")
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy.orm import sessionmaker
+    import asr_scheduler
+    import audio_sessions
+    import bulk_jobs
+    import database
+    import language_id
+    import main
+    import room_state
+    import transcript_writer
+    import translation_batcher
+    import websocket_manager
+
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'transcripts.db'}",
+                                      connect_args={"check_same_thread": False})
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+    scheduler = asr_scheduler.ASRScheduler(asr)
+    batcher = translation_batcher.TranslationBatcher(main.translator)
+    store, broker = room_state.create("memory")
+    db_executor = ThreadPoolExecutor(1)
+    monkeypatch.setattr(main.translator, "cache", None)
+    for name, value in {
+        "asr": asr, "scheduler": scheduler, "batcher": batcher, "store": store, "broker": broker,
+        "jobs": bulk_jobs.BulkJobManager(scheduler, batcher, main.broadcast, job_dir=tmp_path / "jobs"),
+        "writer": transcript_writer.TranscriptWriter(main.save_transcripts, db_executor),
+        "manager": websocket_manager.ConnectionManager(),
+        "sessions": audio_sessions.SessionRegistry(),
+        "room_languages": language_id.RoomLanguageCache(),
+        "ROOM_PIPELINES": {},
+        "MODEL_STATUS": {"asr": {"ready": False, "load_sec": None, "error": None},
+                         "translation": {"ready": False, "load_sec": {}, "error": None}},
+        "INGEST_EXECUTOR": ThreadPoolExecutor(1),
+        "DB_EXECUTOR": db_executor,
+        "ASR_SLOTS": asyncio.Semaphore(4),
+        "TRANSLATE_SLOTS": asyncio.Semaphore(4),
+    }.items():
+        monkeypatch.setattr(main, name, value)
+
+    async def ready_at_once():
+        main.MODEL_STATUS["asr"]["ready"] = True
+        main.scheduler.start()
+
+    monkeypatch.setattr(main, "load_models", load_models or ready_at_once)
+    return main, database
+
+
+def test_shutdown_drains_detached_rooms_into_the_database(monkeypatch, tmp_path):
+    import time
+    import types
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from ingest_protocol import SEQ
+
+    class StubASR:
+        def __init__(self):
+            self.calls = 0
+
+        def detect_language_batch(self, audios):
+            return [{"en": 1.0} for _ in audios]
+
+        def transcribe_batch(self, audios, languages=None, **options):
+            self.calls += 1
+            return [([{"text": "Good morning everyone.", "start": 0.0, "end": len(a) / 16000}],
+                     types.SimpleNamespace(language="en")) for a in audios]
+
+    asr = StubASR()
+    main, database = _fresh_main(monkeypatch, tmp_path, asr)
+    tone = (np.sin(np.arange(1600) * 0.3) * 12000).astype(np.int16).tobytes()  # 0.1 s of "speech"
+
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws/audio/r1") as ws:
+            ws.send_text('{"type": "hello", "version": 2, "codec": "pcm16"}')
+            assert ws.receive_json()["type"] == "welcome"
+            for seq in range(30):  # 3 s utterance, still open (VAD_MAX_UTTERANCE_SEC is 10)
+                ws.send_bytes(SEQ.pack(seq) + tone)
+            deadline = time.monotonic() + 5
+            while main.sessions.stats()["active"] == 0 or \
+                    max(s.committed_seq for s in main.sessions.sessions.values()) < 29:
+                assert time.monotonic() < deadline
+                time.sleep(0.02)
+        # Dropped without a bye: the session detaches and keeps the room open
+        while main.sessions.stats()["detached"] == 0:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        assert "r1" in main.ROOM_PIPELINES
+        assert asr.calls == 0
+
+    with database.session_scope() as session:
+        texts = [row.text for row in session.query(main.models.Transcript).filter_by(room_id="r1")]
+    assert asr.calls == 1 and texts == ["Good morning everyone."]
+    assert main.ROOM_PIPELINES == {} and main.sessions.stats()["detached"] == 0
+
+
+def test_ready_reports_503_until_models_load(monkeypatch, tmp_path):
+    import threading
+    import time
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    import utils
+
+    loaded = threading.Event()
+
+    async def load_models():
+        await utils.run_blocking(loaded.wait, 5)
+        main.MODEL_STATUS["asr"].update(ready=True, load_sec=0.1)
+        main.scheduler.start()
+
+    main, _ = _fresh_main(monkeypatch, tmp_path, asr=None, load_models=load_models)
+    with TestClient(main.app) as client:
+        assert client.get("/health").status_code == 200
+        waiting = client.get("/ready")
+        assert waiting.status_code == 503 and waiting.json()["ready"] is False
+        loaded.set()
+        deadline = time.monotonic() + 5
+        while (ready := client.get("/ready")).status_code != 200:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        assert ready.json()["models"]["asr"]["ready"] is True
+
+
+def test_translator_preload_pins_configured_pairs_past_the_budget():
+    pytest.importorskip("numpy")
+    from model_registry import ModelRegistry
+    from translation_engine import Translator, marian_model_name
+
+    translator = Translator(backend="marian")
+    translator.cache = None
+    translator.models = ModelRegistry(budget_mb=2, sizer=lambda value: 2**20)
+
+    def generate(texts, source_lang, target_lang):
+        translator.models.get(marian_model_name(source_lang, target_lang), lambda: "model")
+        return list(texts)
+
+    translator._generate = generate
+    timings = translator.preload([("hi", "en"), ("en", "hi"), ("en", "en")])
+    assert sorted(timings) == ["en-hi", "hi-en"]
+    for pair in (("ta", "en"), ("kn", "en")):  # over budget: only unpinned models make room
+        generate(["x"], *pair)
+    names = set(translator.models.entries)
+    assert {marian_model_name("hi", "en"), marian_model_name("en", "hi")} <= names
+    assert marian_model_name("ta", "en") not in names